@@ -0,0 +1,7 @@
+from banners.models import Banner
+from shop.memoize import memoize
+
+
+@memoize('banners')
+def get_active_banners():
+    return list(Banner.objects.filter(active=True))
@@ -1,8 +1,9 @@
-from django.core.cache import cache
+from random import sample
+
 from django.shortcuts import render
 from django.views.generic import ListView
 
-from banners.models import Banner
+from banners.services import get_active_banners
 
 
 class BannerListView(ListView):
@@ -12,17 +13,9 @@ class BannerListView(ListView):
         Добавляет в глобальный контекст три случайных баннера.
         """
 
-        if 'banners' in cache:
-            banners = cache.get('banners')
-        else:
-            total_count = Banner.objects.filter(active=True).count()
-
-            if total_count < 3:
-                banners = Banner.objects.filter(active=True)
-            else:
-                banners = Banner.objects.filter(active=True).order_by("?")[:3]
-
-        cache.set('banners', banners, 600)
+        banners = get_active_banners()
+        if len(banners) > 3:
+            banners = sample(banners, 3)
 
         context = {
             "banners": banners,
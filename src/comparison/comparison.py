@@ -1,4 +1,5 @@
-from shop.models import Product, ProductAttribute, Attribute
+from discounts.services import annotate_discounted_prices
+from shop.models import Product, ProductAttribute, Attribute, SellerProduct
 from .comparison_table import ComparisonTable, ComparisonCategory
 from django.utils.translation import gettext_lazy as _
 
@@ -110,10 +111,15 @@ class Comparison:
                     product_attributes[product][attr.attribute_category] = []
                 product_attributes[product][attr.attribute_category].append(attr)
 
+        # цены со скидками всех предложений сравниваемых товаров получаем одним проходом
+        prices = {}
+        for seller_product in annotate_discounted_prices(SellerProduct.objects.filter(product__in=self.products)):
+            prices.setdefault(seller_product.product_id, []).append(seller_product.discounted_price)
+
         # проводим настройка категорий (ComparisonCategory), передавая туда фильтры и создаем таблицы (ComparisonTable)
         tables = []
         for product, categories in product_attributes.items():
-            table = ComparisonTable(product=product)
+            table = ComparisonTable(product=product, prices=prices.get(product.pk, []))
             for category in categories:
                 comp_category = ComparisonCategory(product=product, category_name=category,
                                                    attributes=categories[category])
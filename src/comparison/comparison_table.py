@@ -1,4 +1,5 @@
 from shop.models import Product, ProductAttribute, Attribute
+from discounts.services import annotate_discounted_prices
 from typing import List
 from django.utils.translation import gettext_lazy as _
 from django.http import HttpResponse
@@ -8,14 +9,14 @@ class ComparisonTable:
     """
     Класс представляющий таблицу с товаром и его атрибутами, а также предоставляющий контекст для шаблона
     """
-    def __init__(self, product: Product) -> None:
+    def __init__(self, product: Product, prices: List = None) -> None:
         self.product = product
         self.categories = []
         self.avg_price = 0
         self.msg_css_classes = ""
         self.msg_css_data_roles = ""
 
-        self.set_average_price()
+        self.set_average_price(prices)
 
     def add_category(self, category: "ComparisonCategory") -> None:
         self.categories.append(category)
@@ -40,19 +41,20 @@ class ComparisonTable:
             self.msg_css_classes = "table_message"
             return _("Одинаковые поля скрыты")
 
-    def set_average_price(self):
+    def set_average_price(self, prices: List = None):
         """
-        Получаем среднюю цену товара
+        Получаем среднюю цену товара с учётом скидок. Цены предложений продавцов можно передать
+        заранее (Comparison получает их для всех товаров сразу), иначе они читаются здесь
         """
 
-        sum_price = 0
-        seller_products = self.product.seller_products.all()
-        seller_products_count = len(seller_products)
+        if prices is None:
+            prices = [
+                seller_product.discounted_price
+                for seller_product in annotate_discounted_prices(self.product.seller_products.all())
+            ]
 
-        if seller_products_count:
-            for seller_product in seller_products:
-                sum_price += seller_product.price
-            self.avg_price = f"{float(sum_price / len(seller_products)):.2f}"
+        if prices:
+            self.avg_price = f"{float(sum(prices) / len(prices)):.2f}"
         else:
             self.avg_price = "0.00"
 
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from discounts.services import refresh_effective_prices
+from discounts.tasks import schedule_price_boundary
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает цены товаров продавцов со скидками (EffectivePrice)'
+
+    def handle(self, *args, **options):
+        count = refresh_effective_prices()
+        boundary = schedule_price_boundary()
+        self.stdout.write(self.style.SUCCESS(f'Цены со скидками пересобраны: изменено {count} записей'))
+        if boundary:
+            self.stdout.write(f'Следующая пересборка: {boundary:%d.%m.%Y %H:%M}')
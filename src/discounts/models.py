@@ -1,7 +1,7 @@
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 
-from shop.models import Category, Product
+from shop.models import Category, Product, SellerProduct
 
 DISCOUNT_WEIGHTS = [
     (1, 'Вес скидки низкий'),
@@ -17,6 +17,8 @@ class BaseDiscount(models.Model):
     valid_to = models.DateTimeField()
     active = models.BooleanField(default=True)
     weight = models.IntegerField(choices=DISCOUNT_WEIGHTS)
+    # Метка изменения для ETag/Last-Modified страниц скидок
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         abstract = True
@@ -52,3 +54,28 @@ class CartDiscount(BaseDiscount):
     max_total = models.DecimalField(max_digits=10, decimal_places=2, default=0,
                                     help_text="Максимальная общая стоимость товаров в корзине")
     discount_price = models.DecimalField(max_digits=10, decimal_places=2, help_text="Итоговая стоимость корзины")
+
+
+class EffectivePrice(models.Model):
+    """
+    Модель EffectivePrice - цена товара продавца с учётом лучшей действующей скидки на товар
+    или его категорию. Запись есть только у товаров, на которые сейчас действует скидка.
+    Таблица пересобирается задачей discounts.tasks.rebuild_effective_prices при изменении
+    скидок и цен, а также на границах действия скидок (valid_from/valid_to).
+    """
+
+    seller_product = models.OneToOneField(
+        SellerProduct,
+        primary_key=True,
+        related_name='effective_price',
+        on_delete=models.CASCADE,
+    )
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    discount = models.ForeignKey(ProductDiscount, related_name='+', on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['pk']
+
+    def __str__(self):
+        return f"effective-price-{self.seller_product_id}"
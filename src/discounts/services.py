@@ -0,0 +1,250 @@
+from decimal import Decimal
+from itertools import chain
+
+from django.db import transaction
+from django.utils import timezone
+
+from shop.cache_keys import invalidate
+from shop.memoize import memoize
+from shop.models import Category, SellerProduct
+from shop.snapshots import invalidate_product_snapshots
+
+from .models import BundleDiscount, EffectivePrice, ProductDiscount
+
+
+def get_active_discounts(model, *fields):
+    # Активные скидки, которые ещё не закончились: {id: (поля..., начало, окончание)}
+    return {
+        pk: tuple(values)
+        for pk, *values in model.objects.filter(active=True, valid_to__gt=timezone.now()).values_list(
+            'pk', *fields, 'valid_from', 'valid_to'
+        )
+    }
+
+
+def get_links(relation, discount_field, target_field, discount_ids):
+    # Пары (id скидки, id товара или категории) из промежуточной таблицы связи
+    return relation.through.objects.filter(**{f'{discount_field}__in': discount_ids}).values_list(
+        discount_field, target_field
+    )
+
+
+def expand_categories(category_ids, paths):
+    # Категории вместе со всеми потомками (по материализованному пути)
+    prefixes = tuple(paths[pk] for pk in category_ids if pk in paths)
+    return {pk for pk, path in paths.items() if path.startswith(prefixes)}
+
+
+def index_product_discounts(index):
+    discounts = get_active_discounts(ProductDiscount, 'weight', 'discount', 'pk')
+    for discount_id, product_id in get_links(ProductDiscount.products, 'productdiscount_id', 'product_id', discounts):
+        index['products'].setdefault(product_id, []).append(discounts[discount_id])
+
+    discount_categories = {}
+    for discount_id, category_id in get_links(
+        ProductDiscount.categories, 'productdiscount_id', 'category_id', discounts
+    ):
+        discount_categories.setdefault(discount_id, set()).add(category_id)
+    if discount_categories:
+        # Скидка на категорию действует и на её подкатегории, как и группы категорий наборов
+        paths = dict(Category.objects.values_list('pk', 'path'))
+        for discount_id, category_ids in discount_categories.items():
+            for category_id in expand_categories(category_ids, paths):
+                index['categories'].setdefault(category_id, []).append(discounts[discount_id])
+
+
+def index_bundle_discounts(index):
+    index['bundles'] = get_active_discounts(BundleDiscount, 'discount_amount')
+    category_groups = {}
+    for group in (1, 2):
+        for bundle_id, product_id in get_links(
+            getattr(BundleDiscount, f'product_group_{group}'), 'bundlediscount_id', 'product_id', index['bundles']
+        ):
+            index['bundle_products'].setdefault(product_id, []).append((bundle_id, group))
+        for bundle_id, category_id in get_links(
+            getattr(BundleDiscount, f'category_group_{group}'), 'bundlediscount_id', 'category_id', index['bundles']
+        ):
+            category_groups.setdefault((bundle_id, group), set()).add(category_id)
+
+    if category_groups:
+        paths = dict(Category.objects.values_list('pk', 'path'))
+        for bundle_group, category_ids in category_groups.items():
+            for category_id in expand_categories(category_ids, paths):
+                index['bundle_categories'].setdefault(category_id, []).append(bundle_group)
+
+
+@memoize('discounts')
+def get_discount_index():
+    """
+    Индекс скидок на товары и на наборы. В индекс попадают активные скидки, которые
+    ещё не закончились; срок действия проверяется при расчёте, поэтому индекс
+    пересобирается только при изменении скидок или дерева категорий.
+
+    - 'products', 'categories': {id товара или категории: [(вес, процент, id скидки, начало, окончание)]},
+      категории скидок развёрнуты до всех потомков;
+    - 'bundles': {id набора: (сумма скидки, начало, окончание)};
+    - 'bundle_products', 'bundle_categories': {id товара или категории: [(id набора, номер группы)]},
+      группы категорий развёрнуты до всех потомков.
+    """
+
+    index = {'products': {}, 'categories': {}, 'bundles': {}, 'bundle_products': {}, 'bundle_categories': {}}
+    index_product_discounts(index)
+    index_bundle_discounts(index)
+    return index
+
+
+def get_product_discount(index, product_id, category_id, now):
+    """
+    Скидка на товар (процент, id скидки): из действующих скидок на товар и на его категорию
+    выбирается скидка с наибольшим весом; при равном весе скидка на сам товар
+    важнее скидки на категорию, затем - больший процент. Без скидки - (0, None).
+    """
+
+    candidates = [
+        (weight, specific, percent, -discount_id)
+        for specific, discounts in (
+            (True, index['products'].get(product_id, ())),
+            (False, index['categories'].get(category_id, ())),
+        )
+        for weight, percent, discount_id, valid_from, valid_to in discounts
+        if valid_from <= now <= valid_to
+    ]
+    if not candidates:
+        return 0, None
+    weight, specific, percent, discount_id = max(candidates)
+    return percent, -discount_id
+
+
+def get_product_discount_percent(index, product_id, category_id, now):
+    return get_product_discount(index, product_id, category_id, now)[0]
+
+
+def apply_percent(price, percent):
+    return (price * (100 - percent) / 100).quantize(Decimal('0.01'))
+
+
+def get_next_price_boundary(index, now):
+    """
+    Ближайший момент, когда начинается или заканчивается одна из скидок на товары
+    """
+
+    return min(
+        (
+            moment
+            for discounts in chain(index['products'].values(), index['categories'].values())
+            for *values, valid_from, valid_to in discounts
+            for moment in (valid_from, valid_to)
+            if moment > now
+        ),
+        default=None,
+    )
+
+
+def refresh_effective_prices(seller_product_ids=None):
+    """
+    Пересобирает таблицу EffectivePrice для переданных товаров продавцов (по умолчанию - для всех).
+    Записываются только изменившиеся цены; если что-то изменилось, сбрасываются
+    версия цен и кэш страниц. Возвращает число изменённых записей.
+    """
+
+    now = timezone.now()
+    seller_products = SellerProduct.objects.all()
+    existing = EffectivePrice.objects.all()
+    if seller_product_ids is None:
+        # Полная пересборка читает скидки из базы, а не из кэша
+        index = get_discount_index.refresh()
+    else:
+        index = get_discount_index()
+        seller_products = seller_products.filter(pk__in=seller_product_ids)
+        existing = existing.filter(seller_product_id__in=seller_product_ids)
+
+    prices = {}
+    product_ids = {}
+    for pk, price, product_id, category_id in seller_products.values_list(
+        'pk', 'price', 'product_id', 'product__category_id'
+    ):
+        product_ids[pk] = product_id
+        percent, discount_id = get_product_discount(index, product_id, category_id, now)
+        if percent:
+            prices[pk] = (apply_percent(price, percent), discount_id)
+
+    current = {
+        pk: (price, discount_id)
+        for pk, price, discount_id in existing.values_list('seller_product_id', 'price', 'discount_id')
+    }
+    changed = {pk: value for pk, value in prices.items() if current.get(pk) != value}
+    removed = current.keys() - prices.keys()
+
+    with transaction.atomic():
+        EffectivePrice.objects.filter(seller_product_id__in=removed).delete()
+        EffectivePrice.objects.bulk_create(
+            [
+                EffectivePrice(seller_product_id=pk, price=price, discount_id=discount_id)
+                for pk, (price, discount_id) in changed.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['seller_product'],
+            update_fields=['price', 'discount', 'updated_at'],
+            batch_size=1000,
+        )
+    if changed or removed:
+        invalidate('prices', 'pages')
+        # Цены со скидками входят в снимки страниц товаров
+        invalidate_product_snapshots({product_ids[pk] for pk in chain(changed, removed) if pk in product_ids})
+    return len(changed) + len(removed)
+
+
+def get_best_bundle_discount(index, products, now):
+    """
+    Наибольшая скидка среди наборов, обе группы которых есть в корзине.
+    products - пары (id товара, id категории) позиций корзины; число обращений
+    к индексу зависит от размера корзины, а не от числа наборов.
+    """
+
+    found_groups = {}
+    for product_id, category_id in set(products):
+        for bundle_id, group in chain(
+            index['bundle_products'].get(product_id, ()), index['bundle_categories'].get(category_id, ())
+        ):
+            found_groups.setdefault(bundle_id, set()).add(group)
+
+    amounts = []
+    for bundle_id, groups in found_groups.items():
+        amount, valid_from, valid_to = index['bundles'][bundle_id]
+        if len(groups) == 2 and valid_from <= now <= valid_to:
+            amounts.append(amount)
+    return max(amounts, default=0)
+
+
+def get_discounted_prices(seller_products):
+    """
+    Цены со скидками для списка или queryset товаров продавцов: один запрос к EffectivePrice
+    независимо от их числа. Возвращает {id товара продавца: (цена, применённая скидка или None)}.
+    Подходят и объекты, первичный ключ которых - id товара продавца (CatalogListing).
+    """
+
+    seller_products = list(seller_products)
+    effective_prices = EffectivePrice.objects.select_related('discount').in_bulk(
+        [seller_product.pk for seller_product in seller_products]
+    )
+    prices = {}
+    for seller_product in seller_products:
+        effective_price = effective_prices.get(seller_product.pk)
+        if effective_price:
+            prices[seller_product.pk] = (effective_price.price, effective_price.discount)
+        else:
+            prices[seller_product.pk] = (seller_product.price, None)
+    return prices
+
+
+def annotate_discounted_prices(seller_products):
+    """
+    Проставляет товарам продавцов цену со скидкой (discounted_price) и применённую скидку
+    (applied_discount) и возвращает их списком
+    """
+
+    seller_products = list(seller_products)
+    prices = get_discounted_prices(seller_products)
+    for seller_product in seller_products:
+        seller_product.discounted_price, seller_product.applied_discount = prices[seller_product.pk]
+    return seller_products
@@ -0,0 +1,84 @@
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+
+from discounts.models import BundleDiscount, CartDiscount, ProductDiscount
+from discounts.tasks import queue_all_effective_prices, queue_effective_prices
+from shop.cache_keys import invalidate
+from shop.models import Category, Product, SellerProduct
+
+
+# Изменения связей учитываются только после выполнения: pre_* и post_* одного
+# сохранения в админке иначе сбрасывали бы индекс несколько раз
+M2M_CHANGED_ACTIONS = ('post_add', 'post_remove', 'post_clear')
+
+
+# Индекс скидок и страницы со скидками сбрасываются при любом изменении скидок,
+# цены со скидками пересобираются одной задачей после фиксации транзакции
+@receiver(post_save, sender=ProductDiscount)
+@receiver(post_delete, sender=ProductDiscount)
+@receiver(m2m_changed, sender=ProductDiscount.products.through)
+@receiver(m2m_changed, sender=ProductDiscount.categories.through)
+def reset_product_discounts(sender, action=None, **kwargs):
+    if action is None or action in M2M_CHANGED_ACTIONS:
+        invalidate('discounts', 'pages')
+        queue_all_effective_prices()
+
+
+@receiver(post_save, sender=BundleDiscount)
+@receiver(post_delete, sender=BundleDiscount)
+@receiver(m2m_changed, sender=BundleDiscount.product_group_1.through)
+@receiver(m2m_changed, sender=BundleDiscount.product_group_2.through)
+@receiver(m2m_changed, sender=BundleDiscount.category_group_1.through)
+@receiver(m2m_changed, sender=BundleDiscount.category_group_2.through)
+def reset_discount_index(sender, action=None, **kwargs):
+    if action is None or action in M2M_CHANGED_ACTIONS:
+        invalidate('discounts', 'pages')
+
+
+@receiver(post_save, sender=CartDiscount)
+@receiver(post_delete, sender=CartDiscount)
+def reset_discount_pages(sender, **kwargs):
+    invalidate('pages')
+
+
+@receiver(pre_save, sender=Category)
+def check_category_parent(sender, instance, raw=False, **kwargs):
+    # Скидки на категории действуют на подкатегории, поэтому цены меняет только перенос категории
+    if raw or instance._state.adding:
+        instance.parent_changed = False
+    else:
+        old_parent_id = Category.objects.filter(pk=instance.pk).values_list('parent_id', flat=True).first()
+        instance.parent_changed = old_parent_id != instance.parent_id
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def refresh_category_prices(sender, instance, signal, raw=False, **kwargs):
+    if not raw and (signal is post_delete or getattr(instance, 'parent_changed', True)):
+        queue_all_effective_prices()
+
+
+@receiver(pre_save, sender=SellerProduct)
+def check_seller_product_price(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Цена со скидкой пересобирается, только если цена товара продавца изменилась
+    if raw or (update_fields is not None and 'price' not in update_fields):
+        instance.price_changed = False
+    elif instance._state.adding:
+        instance.price_changed = True
+    else:
+        old_price = SellerProduct.objects.filter(pk=instance.pk).values_list('price', flat=True).first()
+        instance.price_changed = old_price != instance.price
+
+
+@receiver(post_save, sender=SellerProduct)
+def refresh_seller_product_price(sender, instance, raw=False, **kwargs):
+    if not raw and getattr(instance, 'price_changed', True):
+        queue_effective_prices(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_prices(sender, instance, created=False, raw=False, **kwargs):
+    # Могла измениться категория товара, а с ней - скидка на категорию
+    if not raw and not created:
+        queue_effective_prices(*instance.seller_products.values_list('pk', flat=True))
@@ -0,0 +1,85 @@
+import threading
+from datetime import timedelta
+
+from celery import shared_task
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from discounts.services import (get_discount_index, get_next_price_boundary,
+                                refresh_effective_prices)
+
+
+class PendingPricesState(threading.local):
+    """
+    Товары продавцов текущего потока, цены со скидками которых пересобираются
+    одной задачей после фиксации транзакции; rebuild_all - нужна полная пересборка
+    """
+
+    def __init__(self):
+        self.seller_product_ids = set()
+        self.rebuild_all = False
+
+
+pending_prices_state = PendingPricesState()
+
+
+def schedule_price_boundary():
+    """
+    Ставит пересборку цен на ближайшую границу действия скидок (один раз на каждую границу)
+    """
+
+    now = timezone.now()
+    boundary = get_next_price_boundary(get_discount_index(), now)
+    if boundary is None:
+        return None
+    timeout = int((boundary - now).total_seconds()) + 60
+    if cache.add(f'lock:effective_prices:{int(boundary.timestamp())}', 1, timeout):
+        # Скидка действует до valid_to включительно, поэтому пересборка - сразу после границы
+        rebuild_effective_prices.apply_async(eta=boundary + timedelta(seconds=1))
+    return boundary
+
+
+@shared_task
+def rebuild_effective_prices(seller_product_ids=None):
+    """
+    Фоновая задача: пересобирает цены со скидками (EffectivePrice).
+    После полной пересборки планируется следующая на ближайшей границе действия скидок.
+    """
+
+    count = refresh_effective_prices(seller_product_ids)
+    if seller_product_ids is None:
+        schedule_price_boundary()
+    return count
+
+
+def flush_pending_effective_prices():
+    seller_product_ids, pending_prices_state.seller_product_ids = pending_prices_state.seller_product_ids, set()
+    rebuild_all, pending_prices_state.rebuild_all = pending_prices_state.rebuild_all, False
+    if rebuild_all:
+        rebuild_effective_prices.delay()
+    elif seller_product_ids:
+        rebuild_effective_prices.delay(sorted(seller_product_ids))
+
+
+def queue_effective_prices(*seller_product_ids):
+    """
+    Запрашивает пересборку цен со скидками товаров продавцов после фиксации транзакции;
+    все товары транзакции пересобираются одной задачей.
+    """
+
+    if not seller_product_ids:
+        return
+    pending_prices_state.seller_product_ids.update(seller_product_ids)
+    # Первый выполненный обработчик ставит задачу на все накопленные товары, остальные ничего не делают
+    transaction.on_commit(flush_pending_effective_prices)
+
+
+def queue_all_effective_prices():
+    """
+    Запрашивает полную пересборку цен со скидками после фиксации транзакции,
+    сколько бы раз она ни была запрошена в транзакции
+    """
+
+    pending_prices_state.rebuild_all = True
+    transaction.on_commit(flush_pending_effective_prices)
@@ -1,3 +1,257 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.formats import localize
+
+from discounts.models import BundleDiscount, EffectivePrice, ProductDiscount
+from discounts.services import (annotate_discounted_prices, get_discount_index,
+                                get_next_price_boundary,
+                                refresh_effective_prices)
+from discounts.tasks import (flush_pending_effective_prices,
+                             rebuild_effective_prices)
+from discounts.utils import (apply_best_bundle_discount,
+                             calculate_best_discount,
+                             calculate_product_discounts)
+from shop.cart import DatabaseCartBackend
+from shop.catalog import refresh_catalog_listing
+from shop.snapshots import get_product_snapshot
+from shop.models import (Cart, CartItem, Category, Product, Seller,
+                         SellerProduct)
+
+User = get_user_model()
+
+
+class ProductDiscountIndexTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='seller', email='seller@example.com', password='testpassword')
+        seller = Seller.objects.create(
+            user=user, name='Seller', email='seller@example.com', phone='89999999999', address='Address'
+        )
+        self.category = Category.objects.create(name='Телевизоры')
+        self.child_category = Category.objects.create(name='Приставки', parent=self.category)
+        self.cart = Cart.objects.create(user=user)
+        for name, category in (('Телевизор', self.category), ('Приставка', self.child_category)):
+            product = Product.objects.create(name=name, category=category)
+            seller_product = SellerProduct.objects.create(
+                seller=seller, product=product, price=Decimal('100.00'), quantity=5
+            )
+            self.cart.add_product(seller_product, 2)
+        self.product = Product.objects.get(name='Телевизор')
+
+    def create_discount(self, percent, weight, products=(), categories=(), **kwargs):
+        now = timezone.now()
+        discount = ProductDiscount.objects.create(
+            name=f'-{percent}%', discount=percent, weight=weight,
+            valid_from=kwargs.pop('valid_from', now - timedelta(days=1)),
+            valid_to=kwargs.pop('valid_to', now + timedelta(days=1)),
+            **kwargs,
+        )
+        discount.products.set(products)
+        discount.categories.set(categories)
+        return discount
+
+    def get_cart_items(self):
+        return CartItem.objects.filter(cart=self.cart).select_related('product__product')
+
+    def test_best_valid_discount_by_weight(self):
+        """
+        Проверяем, что неактивные и истёкшие скидки не учитываются, скидка выбирается
+        по весу, а корзина считается без запросов к базе, пока индекс не изменился
+        """
+        now = timezone.now()
+        self.create_discount(10, 1, products=[self.product])
+        self.create_discount(20, 3, categories=[self.category, self.child_category])
+        self.create_discount(50, 3, products=[self.product], active=False)
+        self.create_discount(60, 3, products=[self.product], valid_to=now - timedelta(hours=1))
+
+        cart_items = list(self.get_cart_items())
+        calculate_product_discounts(cart_items)
+        with self.assertNumQueries(0):
+            self.assertEqual(calculate_product_discounts(cart_items), Decimal('80.00'))
+
+        # Сохранение скидки сбрасывает закэшированный индекс
+        self.create_discount(30, 3, products=[self.product])
+        self.assertEqual(calculate_product_discounts(cart_items), Decimal('100.00'))
+
+    def test_cart_page_discount_from_read_items(self):
+        """
+        Проверяем, что скидка на странице корзины считается по прочитанным позициям
+        без синхронной записи корзины и совпадает для позиций не из базы (Redis)
+        """
+        self.create_discount(10, 1, products=[self.product])
+        self.client.force_login(self.cart.user)
+        with mock.patch.object(DatabaseCartBackend, 'flush') as flush:
+            response = self.client.get(reverse('shop:cart_detail'))
+        flush.assert_not_called()
+        self.assertEqual(response.context['total_price'], Decimal('380.00'))
+
+        unsaved_items = [
+            CartItem(id=item.product_id, product=item.product, quantity=item.quantity, price=item.price)
+            for item in self.get_cart_items()
+        ]
+        self.assertEqual(calculate_best_discount(self.cart, unsaved_items), Decimal('20.00'))
+
+    def test_bundle_groups_with_categories(self):
+        """
+        Проверяем, что группа категорий набора включает подкатегории,
+        а лучший набор выбирается без запросов к базе
+        """
+        now = timezone.now()
+        other_product = Product.objects.create(name='Пульт', category=self.child_category)
+
+        def create_bundle(amount, group_1, group_2):
+            bundle = BundleDiscount.objects.create(
+                name=f'-{amount}', discount_amount=amount, weight=1,
+                valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1),
+            )
+            bundle.product_group_1.set(group_1)
+            bundle.category_group_2.set(group_2)
+            return bundle
+
+        create_bundle(Decimal('15.00'), [self.product], [self.category])
+        create_bundle(Decimal('50.00'), [other_product], [self.category])
+
+        cart_items = list(self.get_cart_items())
+        apply_best_bundle_discount(cart_items)
+        with self.assertNumQueries(0):
+            self.assertEqual(apply_best_bundle_discount(cart_items), Decimal('15.00'))
+
+        without_group_1 = [item for item in cart_items if item.product.product_id != self.product.pk]
+        self.assertEqual(apply_best_bundle_discount(without_group_1), 0)
+
+    def test_effective_prices(self):
+        """
+        Проверяем, что таблица цен со скидками пересобирается по лучшей скидке,
+        записывает только изменения и знает ближайшую границу действия скидок
+        """
+        now = timezone.now()
+        product_discount = self.create_discount(10, 3, products=[self.product])
+        category_discount = self.create_discount(20, 1, categories=[self.category])
+        future_discount = self.create_discount(
+            50, 3, categories=[self.child_category], valid_from=now + timedelta(hours=1)
+        )
+
+        # Скидка на категорию действует и на товары её подкатегорий
+        self.assertEqual(refresh_effective_prices(), 2)
+        self.assertEqual(
+            list(
+                EffectivePrice.objects.order_by('seller_product').values_list(
+                    'seller_product__product', 'price', 'discount'
+                )
+            ),
+            [
+                (self.product.pk, Decimal('90.00'), product_discount.pk),
+                (Product.objects.get(name='Приставка').pk, Decimal('80.00'), category_discount.pk),
+            ],
+        )
+        self.assertEqual(refresh_effective_prices(), 0)
+        self.assertEqual(get_next_price_boundary(get_discount_index(), now), future_discount.valid_from)
+
+        product_discount.active = False
+        product_discount.save()
+        self.assertEqual(refresh_effective_prices(), 1)
+        self.assertEqual(EffectivePrice.objects.get(seller_product__product=self.product).price, Decimal('80.00'))
+
+    def test_price_changes_queued_once_per_transaction(self):
+        """
+        Проверяем, что пересборка цен ставится только при изменении цены
+        и одной задачей на все товары транзакции
+        """
+        seller_products = list(SellerProduct.objects.order_by('pk'))
+        with mock.patch.object(rebuild_effective_prices, 'delay') as delay:
+            flush_pending_effective_prices()
+            delay.reset_mock()
+            seller_products[0].quantity = 1
+            seller_products[0].save()
+            flush_pending_effective_prices()
+            delay.assert_not_called()
+
+            for seller_product in seller_products:
+                seller_product.price = Decimal('150.00')
+                seller_product.save()
+            flush_pending_effective_prices()
+        delay.assert_called_once_with([seller_product.pk for seller_product in seller_products])
+
+    def test_discount_changes_queue_one_full_rebuild(self):
+        """
+        Проверяем, что сохранение скидки со связями ставит одну полную пересборку цен,
+        а категория вызывает пересборку только при переносе
+        """
+        with mock.patch.object(rebuild_effective_prices, 'delay') as delay:
+            flush_pending_effective_prices()
+            delay.reset_mock()
+            discount = self.create_discount(10, 1, products=[self.product], categories=[self.category])
+            discount.products.clear()
+            flush_pending_effective_prices()
+        delay.assert_called_once_with()
+
+        with mock.patch.object(rebuild_effective_prices, 'delay') as delay:
+            self.child_category.name = 'Игровые приставки'
+            self.child_category.save()
+            flush_pending_effective_prices()
+            delay.assert_not_called()
+            self.child_category.parent = None
+            self.child_category.save()
+            flush_pending_effective_prices()
+        delay.assert_called_once_with()
+
+    def test_product_page_uses_discounted_prices(self):
+        """
+        Проверяем, что снимок страницы товара строится по ценам со скидками
+        и перестраивается после пересборки цен
+        """
+        other_offer = SellerProduct.objects.create(
+            seller=Seller.objects.get(), product=self.product, price=Decimal('95.00'), quantity=1
+        )
+        self.assertEqual(get_product_snapshot(self.product.pk).average_price, Decimal('97.50'))
+
+        self.create_discount(10, 1, products=[self.product])
+        refresh_effective_prices()
+        snapshot = get_product_snapshot(self.product.pk)
+        self.assertEqual(
+            [(offer.price, offer.discounted_price) for offer in snapshot.offers],
+            [(Decimal('100.00'), Decimal('90.00')), (Decimal('95.00'), Decimal('85.50'))],
+        )
+        self.assertEqual((snapshot.average_price, snapshot.min_price_id), (Decimal('87.75'), other_offer.pk))
+        response = self.client.get(reverse('shop:product_detail', args=[self.product.pk]))
+        self.assertContains(response, f'{localize(Decimal("85.50"))}$')
+
+    def test_discounted_prices_in_one_query(self):
+        """
+        Проверяем, что цены со скидками для списка товаров читаются одним запросом,
+        а число запросов страницы каталога не зависит от числа товаров на ней
+        """
+        discount = self.create_discount(10, 3, products=[self.product])
+        refresh_effective_prices()
+        refresh_catalog_listing()
+
+        seller_products = list(SellerProduct.objects.order_by('pk'))
+        with self.assertNumQueries(1):
+            annotated = annotate_discounted_prices(seller_products)
+        self.assertEqual(
+            [(item.discounted_price, item.applied_discount) for item in annotated],
+            [(Decimal('90.00'), discount), (Decimal('100.00'), None)],
+        )
+
+        def count_catalog_queries():
+            url = reverse('shop:catalog_products_list', args=[self.category.pk])
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertContains(response, f'<span class="Card-price">${localize(Decimal("90.00"))}</span>', html=True)
+            return len(queries)
 
-# Create your tests here.
+        small = count_catalog_queries()
+        seller = SellerProduct.objects.first().seller
+        for number in range(6):
+            product = Product.objects.create(name=f'Товар {number}', category=self.category)
+            SellerProduct.objects.create(seller=seller, product=product, price=Decimal('10.00'), quantity=1)
+        refresh_catalog_listing()
+        self.assertEqual(count_catalog_queries(), small)
@@ -1,6 +1,9 @@
 from django import forms
+from django.utils import timezone
 
-from discounts.models import BundleDiscount, CartDiscount, ProductDiscount
+from discounts.models import CartDiscount
+from discounts.services import (get_best_bundle_discount, get_discount_index,
+                                get_product_discount_percent)
 
 
 # Проверка, чтоб дата окончания скидки была больше даты начала скидки
@@ -40,34 +43,23 @@ def check_if_products_belong_to_categories_of_another_group(products, categories
 
 
 def calculate_product_discounts(cart_items):
+    # Скидки на товары и категории читаются из закэшированного индекса, корзина считается в памяти.
+    # Позициям нужны товары продавцов вместе с товарами (select_related('product__product'))
+    index = get_discount_index()
+    now = timezone.now()
     total_discount = 0
 
     for item in cart_items:
         product = item.product
-        quantity = item.quantity
-
-        # Получаем скидку, связанную с данным продуктом
-        product_discount = ProductDiscount.objects.filter(products__in=[product.product]).first()
-
-        # Если у продукта нет скидки, проверяем, входит ли он в категорию со скидкой
-        if not product_discount:
-            product_discount = ProductDiscount.objects.filter(categories__in=[product.product.category]).first()
-
-        if product_discount:
-            # Проверяем даты действия скидки
-            check_dates_of_discount({
-                'valid_from': product_discount.valid_from,
-                'valid_to': product_discount.valid_to
-            })
-
+        percent = get_product_discount_percent(index, product.product_id, product.product.category_id, now)
+        if percent:
             # Вычисляем сумму скидки для данного продукта и добавляем ее к общей сумме
-            discount_amount = (product.price * product_discount.discount * quantity) / 100
-            total_discount += discount_amount
+            total_discount += (product.price * percent * item.quantity) / 100
 
     return total_discount
 
 
-def calculate_cart_discount(cart):
+def calculate_cart_discount(cart, total_quantity, total_price):
     # Получаем активную скидку на данную корзину
     cart_discount = CartDiscount.objects.filter(carts=cart, active=True).first()
 
@@ -78,41 +70,30 @@ def calculate_cart_discount(cart):
             'valid_to': cart_discount.valid_to
         })
         # Проверяем, соответствует ли корзина условиям скидки
-        if (cart_discount.min_quantity <= cart.total_quantity() <= cart_discount.max_quantity and
-                cart_discount.min_total <= cart.total_price() <= cart_discount.max_total):
+        if (cart_discount.min_quantity <= total_quantity <= cart_discount.max_quantity and
+                cart_discount.min_total <= total_price <= cart_discount.max_total):
             # Вычисляем сумму скидки
-            discount_amount = max(cart.total_price() - cart_discount.discount_price, 0)
+            discount_amount = max(total_price - cart_discount.discount_price, 0)
             return discount_amount
 
     return 0
 
 
-def apply_best_bundle_discount(cart):
-    # Получаем все активные скидки на наборы
-    bundle_discounts = BundleDiscount.objects.filter(active=True)
-
-    best_discount_amount = 0
-
-    # Проходим по всем скидкам на наборы
-    for discount in bundle_discounts:
-        # Получаем все товары в корзине из первой и второй группы товаров
-        cart_items_group_1 = cart.cart_items.filter(product__product__in=discount.product_group_1.all())
-        cart_items_group_2 = cart.cart_items.filter(product__product__in=discount.product_group_2.all())
-
-        # Если в корзине есть товары из обеих групп, то скидка может быть применена
-        if cart_items_group_1.exists() and cart_items_group_2.exists():
-            # Если сумма скидки больше, чем у предыдущей лучшей скидки, то обновляем лучшую скидку
-            if discount.discount_amount > best_discount_amount:
-                best_discount_amount = discount.discount_amount
-
-    return best_discount_amount
+def apply_best_bundle_discount(cart_items):
+    # Наборы сопоставляются с товарами корзины по закэшированному индексу, без запросов к базе
+    products = [(item.product.product_id, item.product.product.category_id) for item in cart_items]
+    return get_best_bundle_discount(get_discount_index(), products, timezone.now())
 
 
 def calculate_best_discount(cart, cart_items):
-    # Вычисляем сумму каждой скидки
+    # Вычисляем сумму каждой скидки по переданным позициям (из базы или из Redis),
+    # итоги для скидки на корзину считаются по ним же
+    cart_items = list(cart_items)
+    total_quantity = sum(item.quantity for item in cart_items)
+    total_price = sum(item.price * item.quantity for item in cart_items)
     product_discount = calculate_product_discounts(cart_items)
-    cart_discount = calculate_cart_discount(cart)
-    bundle_discount = apply_best_bundle_discount(cart)
+    cart_discount = calculate_cart_discount(cart, total_quantity, total_price)
+    bundle_discount = apply_best_bundle_discount(cart_items)
 
     # Находим максимальную сумму скидки
     max_discount = max(product_discount, cart_discount, bundle_discount)
@@ -1,14 +1,33 @@
+from django.db.models import Count, Max
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import never_cache
+from django.utils.functional import cached_property
 from django.views.generic import DetailView, TemplateView
 
+from shop.mixins import ConditionalGetMixin
+from shop.page_cache import cache_anonymous_page
+
 from .models import BundleDiscount, CartDiscount, ProductDiscount
 
+DISCOUNT_MODELS = (ProductDiscount, BundleDiscount, CartDiscount)
+
 
-@method_decorator(decorator=never_cache, name="get")
-class DiscountListView(TemplateView):
+@method_decorator(decorator=cache_anonymous_page, name='get')
+class DiscountListView(ConditionalGetMixin, TemplateView):
     template_name = 'shop/discount.html'
 
+    @cached_property
+    def discount_stamps(self):
+        return [
+            model.objects.aggregate(modified_at=Max('updated_at'), count=Count('pk'))
+            for model in DISCOUNT_MODELS
+        ]
+
+    def get_content_fingerprint(self):
+        return tuple((stamps['modified_at'], stamps['count']) for stamps in self.discount_stamps)
+
+    def get_last_modified(self):
+        return max((stamps['modified_at'] for stamps in self.discount_stamps if stamps['modified_at']), default=None)
+
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(**kwargs)
         context['product_discount_list'] = ProductDiscount.objects.all()
@@ -17,16 +36,32 @@ class DiscountListView(TemplateView):
         return context
 
 
-class ProductDiscountDetailView(DetailView):
-    model = ProductDiscount
+class DiscountDetailMixin(ConditionalGetMixin):
     template_name = 'shop/discount_detail.html'
 
+    @method_decorator(cache_anonymous_page)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_object(self, queryset=None):
+        if not hasattr(self, 'discount'):
+            self.discount = super().get_object(queryset)
+        return self.discount
+
+    def get_content_fingerprint(self):
+        return (self.get_object().updated_at,)
 
-class BundleDiscountDetailView(DetailView):
+    def get_last_modified(self):
+        return self.get_object().updated_at
+
+
+class ProductDiscountDetailView(DiscountDetailMixin, DetailView):
+    model = ProductDiscount
+
+
+class BundleDiscountDetailView(DiscountDetailMixin, DetailView):
     model = BundleDiscount
-    template_name = 'shop/discount_detail.html'
 
 
-class CartDiscountDetailView(DetailView):
+class CartDiscountDetailView(DiscountDetailMixin, DetailView):
     model = CartDiscount
-    template_name = 'shop/discount_detail.html'
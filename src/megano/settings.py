@@ -59,6 +59,7 @@ MIDDLEWARE = [
     "django.middleware.cache.UpdateCacheMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
+    "shop.middleware.VisitorVersionMiddleware",
     "django.middleware.locale.LocaleMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -103,6 +104,7 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'shop.context_processors.categories',
                 'shop.context_processors.info_cart',
+                'shop.context_processors.page_cache_csrf',
             ],
         },
     },
@@ -187,6 +189,15 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 DEFAULT_CACHE_TIME = 24 * 60 * 60
 
+# Режим пагинации каталога: 'offset' (номера страниц) или 'keyset' (курсорная пагинация)
+CATALOG_PAGINATION_MODE = os.getenv('CATALOG_PAGINATION_MODE', 'offset')
+# Наибольшее число товаров в выдаче поиска по названию; если найдено больше, каталог об этом сообщает
+SEARCH_RESULTS_LIMIT = int(os.getenv('SEARCH_RESULTS_LIMIT', 1000))
+
+# Уровень кэша в памяти процесса перед Redis для маленьких часто читаемых значений
+LOCAL_CACHE_TIMEOUT = int(os.getenv('LOCAL_CACHE_TIMEOUT', 60))
+LOCAL_CACHE_MAX_ENTRIES = 256
+
 AUTH_USER_MODEL = 'accounts.User'
 
 LANGUAGE_CODE = 'ru'
@@ -218,14 +229,45 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Europe/Moscow'
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
+CELERY_BEAT_SCHEDULE = {
+    'flush-carts': {
+        'task': 'shop.tasks.flush_carts',
+        'schedule': float(os.getenv('CART_FLUSH_INTERVAL', 30)),
+    },
+    # Страховочная пересборка цен со скидками; обычно она запускается изменениями и границами скидок
+    'rebuild-effective-prices': {
+        'task': 'discounts.tasks.rebuild_effective_prices',
+        'schedule': 60 * 60,
+    },
+}
 
 CACHES = {
     "default": {
-        'BACKEND': str(os.getenv('CACHES_BACKEND')),
+        # Обёртка собирает метрики кэша по пространствам имён (см. shop/cache_metrics.py)
+        'BACKEND': 'shop.cache_metrics.InstrumentedCache',
         'LOCATION': str(os.getenv('CACHES_LOCATION')),
+        'OPTIONS': {
+            'WRAPPED_BACKEND': str(os.getenv('CACHES_BACKEND')),
+        },
     }
 }
 
+# Время жизни страниц в кэше для анонимных посетителей (shop.page_cache)
+PAGE_CACHE_TIMEOUT = int(os.getenv('PAGE_CACHE_TIMEOUT', 5 * 60))
+
+# Как часто (в секундах) процесс переносит накопленные метрики кэша в Redis
+CACHE_METRICS_FLUSH_INTERVAL = int(os.getenv('CACHE_METRICS_FLUSH_INTERVAL', 10))
+# Размер значения измеряется (сериализацией) для одной записи в кэш из N, 0 отключает измерение
+CACHE_METRICS_SIZE_SAMPLE_RATE = int(os.getenv('CACHE_METRICS_SIZE_SAMPLE_RATE', 10))
+# Токен для доступа к /metrics/ без входа в админку (заголовок Authorization: Bearer <токен>)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Хранилище корзин: shop.cart.DatabaseCartBackend (Cart/CartItem и сессия)
+# или shop.cart.RedisCartBackend (хэши Redis с отложенной записью в базу задачей flush_carts)
+CART_BACKEND = os.getenv('CART_BACKEND', 'shop.cart.DatabaseCartBackend')
+# Время жизни корзины в Redis (в секундах) с последнего изменения
+CART_REDIS_TIMEOUT = int(os.getenv('CART_REDIS_TIMEOUT', 30 * 24 * 60 * 60))
+
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
 
@@ -20,12 +20,15 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from shop.views import cache_metrics
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("accounts/", include("accounts.urls", namespace="accounts")),
     path("banners/", include('banners.urls')),
     path("orders/", include('orders.urls')),
     path("payments/", include("payments.urls", namespace="payments")),
+    path("metrics/", cache_metrics, name="cache_metrics"),
 ]
 
 urlpatterns += i18n_patterns(
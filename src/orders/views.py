@@ -12,6 +12,7 @@ from accounts.models import User
 from orders.forms import (CommentOrderForm, PasswordForm, SelectDeliveryForm,
                           SelectPaymentForm, UserDataForm)
 from orders.models import Order, OrderItem
+from shop.cart import get_cart
 from shop.models import Cart, CartItem
 
 
@@ -151,7 +152,8 @@ class Step4OrderConfirmation(FormView):
         context = super().get_context_data(**kwargs)
         user = User.objects.get(pk=self.request.user.pk)
 
-        # Получаем корзину пользователя
+        # Получаем корзину пользователя; изменения из Redis записываются в базу до оформления
+        get_cart(self.request).flush()
         cart = Cart.objects.get(user=user)
         cart_items = CartItem.objects.filter(cart=cart)
         total_price = cart.total_price()
@@ -189,6 +191,7 @@ class Step4OrderConfirmation(FormView):
 
         # Добавление товаров в заказ
 
+        get_cart(self.request).flush()
         cart = Cart.objects.get(user=user)
         cart_items = CartItem.objects.filter(cart=cart)
 
@@ -9,6 +9,7 @@ from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import TemplateView, View
 from accounts.models import User
+from shop.cart import get_cart
 from shop.models import Cart, CartItem
 
 from orders.models import Order
@@ -21,6 +22,8 @@ class PaymentProcess(View):
     @csrf_exempt
     def get(self, request, *args, **kwargs):
         user = User.objects.get(pk=self.request.user.pk)
+        backend = get_cart(request)
+        backend.flush()
         cart = Cart.objects.get(user=user)
         cart_items = CartItem.objects.filter(cart=cart)
 
@@ -44,7 +47,7 @@ class PaymentProcess(View):
                     "quantity": item.quantity
                 }
             )
-            cart.delete_product(item)
+        backend.clear()
 
         order = Order.objects.get(pk=kwargs["id"])
         order.order_status = "Paid"
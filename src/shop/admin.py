@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db import transaction
 from django.urls import path
 
 from .forms import (AttributeFormSet, CustomAttributeAdminForm,
@@ -6,8 +7,9 @@ from .forms import (AttributeFormSet, CustomAttributeAdminForm,
 from .models import (Attribute, Cart, CartItem, Category, HistoryProduct,
                      Product, ProductAttribute, Review, Seller, SellerProduct,
                      SiteSettings)
-from .utils import (import_json, reset_cache_all, reset_cache_products,
-                    reset_cache_seller_products)
+from .reviews import delete_reviews
+from .utils import (cache_stats, import_json, reset_cache_all,
+                    reset_cache_products, reset_cache_seller_products)
 
 
 @admin.register(HistoryProduct)
@@ -51,6 +53,20 @@ class ReviewAdmin(admin.ModelAdmin):
 
         return False
 
+    def delete_model(self, request, obj):
+        """
+        Метод удаляет отзыв вместе с обновлением статистики отзывов товара
+        """
+
+        delete_reviews(Review.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        """
+        Метод удаляет выбранные отзывы вместе с обновлением статистики отзывов товаров
+        """
+
+        delete_reviews(queryset)
+
     def get_search_results(self, request, queryset, search_term):
         """
         Метод для получения результатов поиска по заданному запросу.
@@ -126,8 +142,34 @@ class CategoryAdmin(admin.ModelAdmin):
 
 admin.site.register(Product, ProductAdmin)
 admin.site.register(Category, CategoryAdmin)
-admin.site.register(Cart)
-admin.site.register(CartItem)
+
+
+@admin.register(Cart)
+class CartAdmin(admin.ModelAdmin):
+    # Итоги меняются только вместе с позициями корзины
+    readonly_fields = ['quantity_total', 'price_total']
+
+
+@admin.register(CartItem)
+class CartItemAdmin(admin.ModelAdmin):
+
+    def save_model(self, request, obj, form, change):
+        """
+        Метод сохраняет позицию и меняет итоги корзины на разницу выражением F(),
+        как и добавление товаров на сайте
+        """
+
+        with transaction.atomic():
+            old = None
+            if change:
+                old = CartItem.objects.select_for_update().filter(pk=obj.pk).values_list(
+                    'cart_id', 'quantity', 'price'
+                ).first()
+            obj.save()
+            if old is not None:
+                cart_id, quantity, price = old
+                Cart.objects.get(pk=cart_id).update_totals(-quantity, -price * quantity)
+            obj.cart.update_totals(obj.quantity, obj.price * obj.quantity)
 
 
 @admin.register(Attribute)
@@ -224,5 +266,10 @@ class SiteSettingsAdmin(admin.ModelAdmin):
                 reset_cache_seller_products,
                 name="reset_cache_seller_products",
             ),
+            path(
+                "cache_stats/",
+                self.admin_site.admin_view(cache_stats),
+                name="cache_stats",
+            ),
         ]
         return new_urls + urls
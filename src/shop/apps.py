@@ -1,4 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def setup_search_index(sender, **kwargs):
+    from shop.search import get_search_backend
+
+    get_search_backend().setup()
 
 
 class ProductsConfig(AppConfig):
@@ -7,3 +14,5 @@ class ProductsConfig(AppConfig):
 
     def ready(self):
         import shop.signals
+
+        post_migrate.connect(setup_search_index, sender=self)
@@ -0,0 +1,89 @@
+import time
+
+from django.core.cache import cache
+
+from .local_cache import (MISSING, ensure_listener, get_local_timeout,
+                          local_cache, publish_invalidation)
+
+# Реестр пространств имён кэша. Ключ каждого значения содержит текущую версию
+# пространства, поэтому сброс всего пространства - одно увеличение счётчика версии,
+# а устаревшие значения просто перестают читаться и вытесняются по таймауту.
+NAMESPACES = {
+    'product': 'Снимки страниц товаров',
+    'products': 'Все предложения продавцов',
+    'categories': 'Меню категорий',
+    'popular': 'Популярные товары',
+    'popular_categories': 'Популярные категории',
+    'limited': 'Товары ограниченного тиража',
+    'banners': 'Активные баннеры',
+    'site_settings': 'Настройки сайта',
+    'facets': 'Сводки фасетов каталога',
+    'price_bounds': 'Границы цен категорий',
+    'tags': 'Индекс тегов',
+    'pages': 'Страницы целиком для анонимных посетителей',
+    'discounts': 'Индекс скидок на товары и наборы',
+    'prices': 'Цены со скидками (версия таблицы EffectivePrice)',
+}
+
+# Маленькие значения, которые читаются почти на каждой странице: они дополнительно
+# хранятся в памяти процесса (shop.local_cache), сброс приходит через Redis pub/sub
+LOCAL_NAMESPACES = {'categories', 'banners', 'site_settings'}
+
+
+def get_version_key(namespace):
+    if namespace not in NAMESPACES:
+        raise KeyError(f'Неизвестное пространство имён кэша: {namespace}')
+    return f'version:{namespace}'
+
+
+def get_version(namespace):
+    if namespace in LOCAL_NAMESPACES:
+        ensure_listener()
+        version = local_cache.get(f'version:{namespace}')
+        if version is not MISSING:
+            return version
+
+    version_key = get_version_key(namespace)
+    version = cache.get(version_key)
+    if version is None:
+        # Начальная версия берётся из времени, чтобы после вытеснения счётчика
+        # не вернуться к номеру версии, под которым ещё лежат старые значения
+        cache.add(version_key, int(time.time() * 1000), None)
+        version = cache.get(version_key)
+    if namespace in LOCAL_NAMESPACES:
+        local_cache.set(f'version:{namespace}', version, get_local_timeout())
+    return version
+
+
+def make_key(namespace, *parts):
+    """
+    Возвращает ключ кэша вида '<пространство>:<версия>:<части>'
+    """
+
+    return ':'.join([namespace, str(get_version(namespace)), *map(str, parts)])
+
+
+def delete_key(namespace, *parts):
+    """
+    Удаляет одно значение пространства имён
+    """
+
+    cache.delete(make_key(namespace, *parts))
+    if namespace in LOCAL_NAMESPACES:
+        publish_invalidation(namespace)
+
+
+def invalidate(*namespaces):
+    """
+    Сбрасывает пространства имён целиком: O(1) на пространство
+    """
+
+    for namespace in namespaces:
+        version_key = get_version_key(namespace)
+        try:
+            version = cache.incr(version_key)
+        except ValueError:
+            version = int(time.time() * 1000)
+            cache.add(version_key, version, None)
+        if namespace in LOCAL_NAMESPACES:
+            publish_invalidation(namespace, version)
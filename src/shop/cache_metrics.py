@@ -0,0 +1,213 @@
+import itertools
+import logging
+import pickle
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.utils.module_loading import import_string
+
+from .cache_keys import NAMESPACES
+from .local_cache import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = 'cache:metrics'
+METRICS = ('hits', 'misses', 'get_us', 'sets', 'sized_sets', 'set_bytes', 'set_us')
+MISSING = object()
+
+pending = Counter()
+totals = Counter()
+flush_state = {'flushed_at': time.monotonic()}
+metrics_lock = threading.Lock()
+size_samples = itertools.count()
+
+
+def get_namespace(key):
+    """
+    Пространство имён ключа вида '<пространство>:<версия>:...'.
+    Ключи блокировок и ключи вне реестра учитываются отдельно.
+    """
+
+    prefix = str(key).split(':', 1)[0]
+    if prefix in NAMESPACES or prefix == 'lock':
+        return prefix
+    return 'other'
+
+
+def get_value_size(value):
+    """
+    Размер значения в байтах или None, если запись не попала в выборку.
+    Строки и байты измеряются всегда, остальные значения сериализуются
+    только для одной записи из CACHE_METRICS_SIZE_SAMPLE_RATE.
+    """
+
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    sample_rate = settings.CACHE_METRICS_SIZE_SAMPLE_RATE
+    if not sample_rate or next(size_samples) % sample_rate:
+        return None
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return None
+
+
+def get_size_metrics(value):
+    size = get_value_size(value)
+    if size is None:
+        return {}
+    return {'sized_sets': 1, 'set_bytes': size}
+
+
+def flush_metrics():
+    """
+    Переносит накопленные в процессе счётчики в общий хэш Redis.
+    Без Redis счётчики копятся в памяти процесса.
+    """
+
+    with metrics_lock:
+        data = dict(pending)
+        pending.clear()
+        flush_state['flushed_at'] = time.monotonic()
+    if not data:
+        return
+    connection = get_redis_connection()
+    if connection is None:
+        totals.update(data)
+        return
+    try:
+        pipeline = connection.pipeline(transaction=False)
+        for field, value in data.items():
+            pipeline.hincrby(METRICS_KEY, field, value)
+        pipeline.execute()
+    except Exception:
+        logger.exception('Не удалось сохранить метрики кэша')
+
+
+def record_metrics(namespace, **values):
+    with metrics_lock:
+        for metric, value in values.items():
+            pending[f'{namespace}:{metric}'] += value
+        due = time.monotonic() - flush_state['flushed_at'] > settings.CACHE_METRICS_FLUSH_INTERVAL
+    if due:
+        flush_metrics()
+
+
+def read_totals():
+    flush_metrics()
+    connection = get_redis_connection()
+    if connection is None:
+        return dict(totals)
+    return {field.decode(): int(value) for field, value in connection.hgetall(METRICS_KEY).items()}
+
+
+def get_cache_metrics():
+    """
+    Сводка по пространствам имён со всех воркеров: попадания, промахи, доля попаданий,
+    записи, средний размер (по измеренным записям) и средние задержки (мс).
+    """
+
+    counts = {}
+    for field, value in read_totals().items():
+        namespace, metric = field.rsplit(':', 1)
+        counts.setdefault(namespace, dict.fromkeys(METRICS, 0))[metric] = value
+
+    metrics = {}
+    for namespace, values in sorted(counts.items()):
+        reads = values['hits'] + values['misses']
+        metrics[namespace] = {
+            **values,
+            'ratio': values['hits'] / (reads or 1),
+            'avg_size': values['set_bytes'] // (values['sized_sets'] or 1),
+            'avg_get_ms': values['get_us'] / 1000 / (reads or 1),
+            'avg_set_ms': values['set_us'] / 1000 / (values['sets'] or 1),
+        }
+    return metrics
+
+
+def reset_cache_metrics():
+    with metrics_lock:
+        pending.clear()
+        totals.clear()
+    connection = get_redis_connection()
+    if connection is not None:
+        connection.delete(METRICS_KEY)
+
+
+def format_metrics(metrics):
+    """
+    Метрики в текстовом формате Prometheus
+    """
+
+    lines = []
+    for name, field in (
+        ('cache_hits_total', 'hits'),
+        ('cache_misses_total', 'misses'),
+        ('cache_sets_total', 'sets'),
+        ('cache_sized_sets_total', 'sized_sets'),
+        ('cache_set_bytes_total', 'set_bytes'),
+        ('cache_get_seconds_total', 'get_us'),
+        ('cache_set_seconds_total', 'set_us'),
+    ):
+        lines.append(f'# TYPE {name} counter')
+        for namespace, values in metrics.items():
+            value = values[field] / 1_000_000 if field.endswith('_us') else values[field]
+            lines.append(f'{name}{{namespace="{namespace}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class InstrumentedCache:
+    """
+    Обёртка над бэкендом кэша (OPTIONS['WRAPPED_BACKEND']), считающая попадания,
+    промахи, размеры записываемых значений и задержки чтения и записи
+    по пространствам имён. Остальные методы передаются бэкенду без изменений.
+    """
+
+    def __init__(self, location, params):
+        options = dict(params.get('OPTIONS', {}))
+        backend = options.pop('WRAPPED_BACKEND')
+        self.backend = import_string(backend)(location, {**params, 'OPTIONS': options})
+
+    def __getattr__(self, name):
+        if name == 'backend':
+            raise AttributeError(name)
+        return getattr(self.backend, name)
+
+    def __contains__(self, key):
+        return key in self.backend
+
+    def get(self, key, default=None, version=None):
+        start = time.perf_counter()
+        value = self.backend.get(key, MISSING, version=version)
+        elapsed = int((time.perf_counter() - start) * 1_000_000)
+        hit = value is not MISSING
+        record_metrics(get_namespace(key), hits=int(hit), misses=int(not hit), get_us=elapsed)
+        return value if hit else default
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        start = time.perf_counter()
+        values = self.backend.get_many(keys, version=version)
+        elapsed = int((time.perf_counter() - start) * 1_000_000)
+        for key in keys:
+            hit = key in values
+            record_metrics(get_namespace(key), hits=int(hit), misses=int(not hit), get_us=elapsed // len(keys))
+        return values
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, **kwargs):
+        start = time.perf_counter()
+        result = self.backend.set(key, value, timeout, **kwargs)
+        elapsed = int((time.perf_counter() - start) * 1_000_000)
+        record_metrics(get_namespace(key), sets=1, set_us=elapsed, **get_size_metrics(value))
+        return result
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, **kwargs):
+        start = time.perf_counter()
+        result = self.backend.set_many(data, timeout, **kwargs)
+        elapsed = int((time.perf_counter() - start) * 1_000_000)
+        for key, value in data.items():
+            record_metrics(get_namespace(key), sets=1, set_us=elapsed // len(data), **get_size_metrics(value))
+        return result
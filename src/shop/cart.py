@@ -0,0 +1,256 @@
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import DecimalField, F, Sum
+from django.db.models.functions import Coalesce
+from django.shortcuts import get_object_or_404
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+
+from .cart_redis import (DIRTY_CARTS_KEY, LOADED_FIELD, flush_cart,
+                         get_anonymous_cart_key, get_user_cart_key,
+                         parse_lines, read_user_cart)
+from .local_cache import get_redis_connection
+from .models import Cart, CartItem, SellerProduct
+from .utils import (add_many_to_session_cart, clear_session_cart,
+                    get_cart_from_session, get_total_price_from_session_cart,
+                    get_total_quantity_from_session_cart,
+                    remove_from_session_cart, update_session_cart)
+
+
+def rebuild_cart_totals(dry_run=False, queryset=None):
+    """
+    Сверяет итоги корзин с их позициями и исправляет расхождения.
+    Возвращает список расхождений (id, сохранённые итоги, фактические).
+    queryset ограничивает проверку частью корзин.
+    """
+
+    if queryset is None:
+        queryset = Cart.objects.all()
+    carts = list(
+        queryset.annotate(
+            actual_quantity=Coalesce(Sum('cart_items__quantity'), 0),
+            actual_price=Coalesce(
+                Sum(F('cart_items__price') * F('cart_items__quantity'), output_field=DecimalField()), 0,
+                output_field=DecimalField(),
+            ),
+        )
+    )
+    carts = [
+        cart for cart in carts
+        if (cart.quantity_total, cart.price_total) != (cart.actual_quantity, cart.actual_price)
+    ]
+    drift = [
+        (cart.pk, (cart.quantity_total, cart.price_total), (cart.actual_quantity, cart.actual_price))
+        for cart in carts
+    ]
+    if dry_run:
+        return drift
+
+    for cart in carts:
+        cart.quantity_total, cart.price_total = cart.actual_quantity, cart.actual_price
+    Cart.objects.bulk_update(carts, ['quantity_total', 'price_total'], batch_size=500)
+    return drift
+
+
+class DatabaseCartBackend:
+    """
+    Корзина в таблицах Cart/CartItem, для анонимных посетителей - в сессии.
+    Позиции адресуются так же, как в шаблоне корзины: id CartItem у пользователя
+    и id товара продавца у анонимного посетителя.
+    """
+
+    def __init__(self, request, user=None):
+        self.request = request
+        self.user = user or (request.user if request.user.is_authenticated else None)
+
+    @cached_property
+    def cart(self):
+        cart, created = Cart.objects.get_or_create(user=self.user)
+        return cart
+
+    def add_product(self, product, quantity=1):
+        self.add_products([(product, quantity)])
+
+    def add_products(self, items):
+        if self.user:
+            self.cart.add_products(items)
+        else:
+            add_many_to_session_cart(self.request, items)
+
+    def update_product(self, item_id, quantity):
+        if self.user:
+            self.cart.update_product(get_object_or_404(CartItem, pk=item_id, cart=self.cart), quantity)
+        else:
+            update_session_cart(self.request, item_id, quantity)
+
+    def delete_product(self, item_id):
+        if self.user:
+            self.cart.delete_product(get_object_or_404(CartItem, pk=item_id, cart=self.cart))
+        else:
+            remove_from_session_cart(self.request, item_id)
+
+    def get_items(self):
+        if self.user:
+            return list(self.cart.cart_items.select_related('product__product'))
+        return get_cart_from_session(self.request)
+
+    def get_totals(self):
+        """
+        Итоги корзины (количество, сумма) одним чтением, корзина при этом не создаётся
+        """
+
+        if self.user:
+            totals = Cart.objects.filter(user=self.user).values_list('quantity_total', 'price_total').first()
+            return totals or (0, 0)
+        return get_total_quantity_from_session_cart(self.request), get_total_price_from_session_cart(self.request)
+
+    def total_quantity(self):
+        return self.get_totals()[0]
+
+    def total_price(self):
+        return self.get_totals()[1]
+
+    def clear(self):
+        if self.user:
+            for cart_item in self.cart.cart_items.all():
+                self.cart.delete_product(cart_item)
+        else:
+            clear_session_cart(self.request)
+
+    def merge_anonymous_cart(self):
+        """
+        После входа переносит корзину из сессии в корзину пользователя
+        """
+
+        session_cart = get_cart_from_session(self.request)
+        if session_cart:
+            # Позиции переносятся одним upsert-запросом, число запросов не зависит от размера корзины
+            self.add_products((item.product, item.quantity) for item in session_cart)
+        clear_session_cart(self.request)
+
+    def flush(self):
+        """
+        Корзина и так хранится в базе
+        """
+
+
+class RedisCartBackend:
+    """
+    Корзина в хэше Redis (shop.cart_redis) - для пользователей и анонимных посетителей.
+    Изменения корзин пользователей записываются в Cart/CartItem отложенно задачей
+    shop.tasks.flush_carts, перед оформлением заказа - синхронно (flush).
+    Позиции адресуются id товара продавца.
+    """
+
+    def __init__(self, request, user=None):
+        self.request = request
+        self.user = user or (request.user if request.user.is_authenticated else None)
+        self.connection = get_redis_connection()
+
+    @property
+    def key(self):
+        if self.user:
+            return get_user_cart_key(self.user.pk)
+        if 'cart_id' not in self.request.session:
+            # Отдельный id, а не ключ сессии: ключ сессии меняется при входе
+            self.request.session['cart_id'] = uuid.uuid4().hex
+        return get_anonymous_cart_key(self.request.session['cart_id'])
+
+    def read(self):
+        if self.user:
+            return read_user_cart(self.connection, self.user.pk)
+        if 'cart_id' not in self.request.session:
+            return {}
+        return parse_lines(self.connection.hgetall(self.key))
+
+    def write(self, commands):
+        if self.user:
+            # Корзина должна быть загружена из базы до первого изменения
+            self.read()
+        pipeline = self.connection.pipeline()
+        commands(pipeline, self.key)
+        pipeline.expire(self.key, settings.CART_REDIS_TIMEOUT)
+        if self.user:
+            pipeline.sadd(DIRTY_CARTS_KEY, self.user.pk)
+        pipeline.execute()
+
+    def add_product(self, product, quantity=1):
+        self.add_products([(product, quantity)])
+
+    def add_products(self, items):
+        items = list(items)
+
+        def commands(pipeline, key):
+            for product, quantity in items:
+                pipeline.hincrby(key, f'q:{product.pk}', quantity)
+                pipeline.hsetnx(key, f'p:{product.pk}', str(product.price))
+
+        self.write(commands)
+
+    def update_product(self, item_id, quantity):
+        if quantity <= 0:
+            self.delete_product(item_id)
+        elif int(item_id) in self.read():
+            self.write(lambda pipeline, key: pipeline.hset(key, f'q:{item_id}', quantity))
+
+    def delete_product(self, item_id):
+        self.write(lambda pipeline, key: pipeline.hdel(key, f'q:{item_id}', f'p:{item_id}'))
+
+    def get_items(self):
+        lines = self.read()
+        products = SellerProduct.objects.select_related('product').in_bulk(lines)
+        return [
+            CartItem(id=product_id, product=products[product_id], quantity=quantity, price=price)
+            for product_id, (quantity, price) in lines.items()
+            if product_id in products
+        ]
+
+    def get_totals(self):
+        lines = self.read().values()
+        return (
+            sum(quantity for quantity, price in lines),
+            sum((price * quantity for quantity, price in lines), Decimal(0)),
+        )
+
+    def total_quantity(self):
+        return self.get_totals()[0]
+
+    def total_price(self):
+        return self.get_totals()[1]
+
+    def clear(self):
+        def commands(pipeline, key):
+            pipeline.delete(key)
+            if self.user:
+                pipeline.hset(key, LOADED_FIELD, 1)
+
+        self.write(commands)
+
+    def merge_anonymous_cart(self):
+        cart_id = self.request.session.pop('cart_id', None)
+        if not cart_id:
+            return
+        anonymous_key = get_anonymous_cart_key(cart_id)
+        lines = parse_lines(self.connection.hgetall(anonymous_key))
+        if lines:
+            products = SellerProduct.objects.in_bulk(lines)
+            self.add_products(
+                (products[product_id], quantity) for product_id, (quantity, price) in lines.items()
+                if product_id in products
+            )
+        self.connection.delete(anonymous_key)
+
+    def flush(self):
+        if self.user:
+            self.connection.srem(DIRTY_CARTS_KEY, self.user.pk)
+            flush_cart(self.user.pk)
+
+
+def get_cart(request, user=None):
+    """
+    Корзина текущего посетителя (или переданного пользователя) в бэкенде из настройки CART_BACKEND
+    """
+
+    return import_string(settings.CART_BACKEND)(request, user)
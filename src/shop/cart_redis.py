@@ -0,0 +1,118 @@
+import logging
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+
+from .local_cache import get_redis_connection
+from .models import Cart, CartItem, SellerProduct
+
+logger = logging.getLogger(__name__)
+
+DIRTY_CARTS_KEY = 'cart:dirty'
+# Служебное поле: корзина пользователя уже загружена из базы
+LOADED_FIELD = 'loaded'
+
+
+def get_user_cart_key(user_id):
+    return f'cart:user:{user_id}'
+
+
+def get_anonymous_cart_key(cart_id):
+    return f'cart:anonymous:{cart_id}'
+
+
+def parse_lines(data):
+    """
+    Хэш корзины: поля 'q:<id товара продавца>' (количество) и 'p:<id>' (цена позиции).
+    Возвращает {id товара продавца: (количество, цена)}.
+    """
+
+    fields = {field.decode(): value.decode() for field, value in data.items()}
+    return {
+        int(field[2:]): (int(quantity), Decimal(fields.get(f'p:{field[2:]}', '0')))
+        for field, quantity in fields.items()
+        if field.startswith('q:')
+    }
+
+
+def load_user_cart(connection, user_id):
+    """
+    Переносит корзину пользователя из базы в Redis (первое обращение или после вытеснения ключа)
+    """
+
+    key = get_user_cart_key(user_id)
+    pipeline = connection.pipeline()
+    pipeline.hsetnx(key, LOADED_FIELD, 1)
+    for product_id, quantity, price in CartItem.objects.filter(cart__user_id=user_id).values_list(
+        'product_id', 'quantity', 'price'
+    ):
+        pipeline.hsetnx(key, f'q:{product_id}', quantity)
+        pipeline.hsetnx(key, f'p:{product_id}', str(price))
+    pipeline.expire(key, settings.CART_REDIS_TIMEOUT)
+    pipeline.execute()
+
+
+def read_user_cart(connection, user_id):
+    data = connection.hgetall(get_user_cart_key(user_id))
+    if not data:
+        load_user_cart(connection, user_id)
+        data = connection.hgetall(get_user_cart_key(user_id))
+    return parse_lines(data)
+
+
+def flush_cart(user_id):
+    """
+    Записывает корзину пользователя из Redis в Cart/CartItem: удаляет исчезнувшие позиции,
+    остальные записывает одним upsert-запросом и пересчитывает итоги.
+    """
+
+    connection = get_redis_connection()
+    lines = read_user_cart(connection, user_id)
+    existing_ids = set(SellerProduct.objects.filter(pk__in=lines).values_list('pk', flat=True))
+    lines = {product_id: line for product_id, line in lines.items() if product_id in existing_ids}
+
+    with transaction.atomic():
+        cart, created = Cart.objects.get_or_create(user_id=user_id)
+        cart.cart_items.exclude(product_id__in=lines).delete()
+        CartItem.objects.bulk_create(
+            [
+                CartItem(cart=cart, product_id=product_id, quantity=quantity, price=price)
+                for product_id, (quantity, price) in lines.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['cart', 'product'],
+            update_fields=['quantity', 'price'],
+        )
+        Cart.objects.filter(pk=cart.pk).update(
+            quantity_total=sum(quantity for quantity, price in lines.values()),
+            price_total=sum((price * quantity for quantity, price in lines.values()), Decimal(0)),
+        )
+
+
+def flush_dirty_carts(batch_size=100):
+    """
+    Отложенная запись: сохраняет в базу корзины, изменённые с прошлого запуска
+    """
+
+    connection = get_redis_connection()
+    if connection is None:
+        # Кэш не в Redis - корзины хранятся в базе
+        return 0
+    flushed = 0
+    failed = []
+    while True:
+        user_ids = connection.spop(DIRTY_CARTS_KEY, batch_size)
+        if not user_ids:
+            break
+        for user_id in user_ids:
+            try:
+                flush_cart(int(user_id))
+                flushed += 1
+            except Exception:
+                logger.exception('Не удалось сохранить корзину пользователя %s', user_id)
+                failed.append(user_id)
+    if failed:
+        # Корзины вернутся в очередь и будут записаны при следующем запуске
+        connection.sadd(DIRTY_CARTS_KEY, *failed)
+    return flushed
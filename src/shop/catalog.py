@@ -0,0 +1,176 @@
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Now
+
+from .facets import update_facet_summaries
+from .models import CatalogListing, Category, Product, SellerProduct
+from .services import refresh_price_bounds
+
+LISTING_UPDATE_FIELDS = [
+    'product', 'category', 'name', 'preview', 'category_name', 'category_path', 'price',
+    'in_stock', 'free_delivery', 'review_count', 'sales_count', 'tag_slugs', 'created_at',
+    'updated_at',
+]
+
+
+def rebuild_category_tree():
+    """
+    Заново строит материализованные пути всех категорий по связям parent.
+    Нужна для категорий, созданных до появления пути, и после массовых изменений в обход save().
+    """
+
+    categories = list(Category.objects.only('id', 'parent_id'))
+    parents = {category.pk: category.parent_id for category in categories}
+    paths = {}
+
+    def build(category_id):
+        if category_id not in paths:
+            parent_id = parents.get(category_id)
+            prefix = build(parent_id) if parent_id else ''
+            paths[category_id] = f'{prefix}{category_id}/'
+        return paths[category_id]
+
+    for category in categories:
+        category.path = build(category.pk)
+        category.depth = category.path.count('/') - 1
+    Category.objects.bulk_update(categories, ['path', 'depth'], batch_size=500)
+    return len(categories)
+
+
+def format_tag_slugs(slugs):
+    """
+    Теги хранятся строкой вида ',slug1,slug2,', чтобы по ней можно было искать
+    без обращения к таблицам taggit.
+    """
+
+    slugs = sorted(slugs)
+    return f",{','.join(slugs)}," if slugs else ''
+
+
+def build_listing(seller_product):
+    product = seller_product.product
+    return CatalogListing(
+        seller_product=seller_product,
+        product=product,
+        category_id=product.category_id,
+        name=product.name,
+        preview=product.preview.name if product.preview else '',
+        category_name=product.category.name,
+        category_path=product.category.get_path(),
+        price=seller_product.price,
+        in_stock=seller_product.quantity > 0,
+        free_delivery=seller_product.free_delivery,
+        review_count=product.review_count,
+        sales_count=seller_product.sales_count,
+        tag_slugs=format_tag_slugs(tag.slug for tag in product.tags.all()),
+        created_at=seller_product.created_at,
+    )
+
+
+def get_changed_price_paths(listings, old_values):
+    """
+    Пути категорий, границы цен которых могли измениться: новые записи, записи
+    с изменившейся ценой и перенесённые записи (вместе с прежним путём)
+    """
+
+    paths = set()
+    for listing in listings:
+        old_path, old_price = old_values.get(listing.pk, (None, None))
+        if old_path != listing.category_path or old_price != listing.price:
+            paths.add(listing.category_path)
+        if old_path is not None and old_path != listing.category_path:
+            paths.add(old_path)
+    return paths
+
+
+def refresh_catalog_listing(seller_products=None):
+    """
+    Пересобирает записи витрины каталога для переданного queryset SellerProduct
+    (по умолчанию - для всех). Записи обновляются одним upsert-запросом.
+    """
+
+    if seller_products is None:
+        seller_products = SellerProduct.objects.all()
+
+    # Прежние пути и цены: перенесённые записи убираются из сводок и границ цен старой категории
+    old_values = {
+        pk: (category_path, price)
+        for pk, category_path, price in CatalogListing.objects.filter(
+            seller_product__in=seller_products.values('pk')
+        ).values_list('pk', 'category_path', 'price')
+    }
+    seller_products = (
+        seller_products
+        .select_related('product__category')
+        .prefetch_related('product__tags')
+    )
+    listings = [build_listing(seller_product) for seller_product in seller_products]
+    if listings:
+        CatalogListing.objects.bulk_create(
+            listings,
+            update_conflicts=True,
+            unique_fields=['seller_product'],
+            update_fields=LISTING_UPDATE_FIELDS,
+        )
+        old_paths = {pk: category_path for pk, (category_path, price) in old_values.items()}
+        update_facet_summaries(listings, old_paths=old_paths)
+        refresh_price_bounds(*get_changed_price_paths(listings, old_values))
+    return len(listings)
+
+
+def refresh_seller_product_listing(*seller_product_ids):
+    return refresh_catalog_listing(SellerProduct.objects.filter(id__in=seller_product_ids))
+
+
+def refresh_product_listing(*product_ids):
+    return refresh_catalog_listing(SellerProduct.objects.filter(product_id__in=product_ids))
+
+
+def refresh_category_listing(category_path):
+    return refresh_catalog_listing(SellerProduct.objects.filter(product__category__path__startswith=category_path))
+
+
+def update_sales_count(seller_product_id, delta):
+    """
+    Атомарно изменяет счётчики продаж предложения, товара и записи витрины на delta.
+    Значения меняются выражением F() на стороне базы, без чтения и гонок.
+    """
+
+    with transaction.atomic():
+        SellerProduct.objects.filter(pk=seller_product_id).update(sales_count=F('sales_count') + delta)
+        Product.objects.filter(seller_products=seller_product_id).update(sales_count=F('sales_count') + delta)
+        # Порядок сортировки по популярности меняется, поэтому обновляется и метка витрины
+        CatalogListing.objects.filter(pk=seller_product_id).update(
+            sales_count=F('sales_count') + delta, updated_at=Now()
+        )
+
+
+def rebuild_sales_counts(dry_run=False):
+    """
+    Сверяет счётчики продаж с позициями заказов и исправляет расхождения.
+    Возвращает список расхождений (модель, id, сохранённое значение, фактическое).
+    """
+
+    seller_products = list(
+        SellerProduct.objects
+        .annotate(actual_sales_count=Count('order_items'))
+        .exclude(sales_count=F('actual_sales_count'))
+    )
+    products = list(
+        Product.objects
+        .annotate(actual_sales_count=Count('seller_products__order_items'))
+        .exclude(sales_count=F('actual_sales_count'))
+    )
+    drift = [
+        (type(obj).__name__, obj.pk, obj.sales_count, obj.actual_sales_count)
+        for obj in seller_products + products
+    ]
+    if dry_run:
+        return drift
+
+    for obj in seller_products + products:
+        obj.sales_count = obj.actual_sales_count
+    SellerProduct.objects.bulk_update(seller_products, ['sales_count'], batch_size=500)
+    Product.objects.bulk_update(products, ['sales_count'], batch_size=500)
+    refresh_catalog_listing(SellerProduct.objects.filter(pk__in=[obj.pk for obj in seller_products]))
+    return drift
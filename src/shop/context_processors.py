@@ -1,6 +1,7 @@
 from .services import get_cached_categories, get_cached_products
-from .models import Cart
-from .utils import get_total_quantity_from_session_cart, get_total_price_from_session_cart
+from .cart import get_cart
+from .page_cache import (CART_PRICE_PLACEHOLDER, CART_QUANTITY_PLACEHOLDER,
+                         CSRF_TOKEN_PLACEHOLDER, is_rendering_for_cache)
 
 
 def categories(request):
@@ -12,15 +13,21 @@ def products(request, tag, sort):
 
 
 def info_cart(request):
-    total_quantity = 0
-    total_price = 0
-
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        total_quantity = cart.total_quantity()
-        total_price = cart.total_price()
-    else:
-        total_quantity = get_total_quantity_from_session_cart(request)
-        total_price = get_total_price_from_session_cart(request)
+    if is_rendering_for_cache(request):
+        # Итоги корзины подставляются после чтения страницы из кэша (shop.page_cache)
+        return {'total_quantity': CART_QUANTITY_PLACEHOLDER, 'total_price': CART_PRICE_PLACEHOLDER}
 
+    # Итоги хранятся вместе с корзиной: одно чтение, корзина здесь не создаётся
+    total_quantity, total_price = get_cart(request).get_totals()
     return {'total_quantity': total_quantity, 'total_price': total_price}
+
+
+def page_cache_csrf(request):
+    """
+    На странице, которая рендерится для кэша, вместо CSRF-токена выводится метка.
+    Должен стоять в списке после остальных процессоров.
+    """
+
+    if is_rendering_for_cache(request):
+        return {'csrf_token': CSRF_TOKEN_PLACEHOLDER}
+    return {}
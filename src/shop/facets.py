@@ -0,0 +1,224 @@
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .cache_keys import invalidate, make_key
+from .memoize import single_flight
+from .models import CatalogListing
+
+HISTOGRAM_BUCKETS = 10
+# Сколько секунд может длиться обновление сводок под блокировкой
+FACETS_LOCK_TIMEOUT = 30
+
+
+class FacetSummaryState(threading.local):
+    """
+    Изменения сводок в текущем потоке, ожидающие фиксации транзакции или выхода из
+    defer_facet_updates() (depth - глубина вложенности блоков): listing_ids - изменённые
+    и удалённые записи витрины, category_ids - затронутые сводки (None - весь каталог)
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.listing_ids = set()
+        self.category_ids = set()
+
+
+facet_summary_state = FacetSummaryState()
+
+
+def get_summary_cache_key(category_id):
+    return make_key('facets', category_id or 'all')
+
+
+def summary_row(listing):
+    return (
+        listing.product_id,
+        listing.price,
+        listing.in_stock,
+        listing.free_delivery,
+        tuple(slug for slug in listing.tag_slugs.split(',') if slug),
+    )
+
+
+def get_summary_category_ids(category_path):
+    """
+    Запись витрины входит в сводки всех категорий своего пути и в сводку всего каталога (None)
+    """
+
+    return [None] + [int(category_id) for category_id in category_path.split('/') if category_id]
+
+
+def build_facet_summary(category_path=None):
+    listings = CatalogListing.objects.all()
+    if category_path:
+        listings = listings.filter(category_path__startswith=category_path)
+    return {
+        pk: (product_id, price, in_stock, free_delivery, tuple(slug for slug in tag_slugs.split(',') if slug))
+        for pk, product_id, price, in_stock, free_delivery, tag_slugs in listings.values_list(
+            'pk', 'product_id', 'price', 'in_stock', 'free_delivery', 'tag_slugs'
+        )
+    }
+
+
+def get_facet_summary(category_path=None):
+    """
+    Возвращает закэшированную сводку по категории с путём category_path (включая дочерние)
+    или по всему каталогу:
+    {id записи витрины: (id товара, цена, в наличии, бесплатная доставка, теги)}
+    """
+
+    category_id = int(category_path.rstrip('/').rsplit('/', 1)[-1]) if category_path else None
+    cache_key = get_summary_cache_key(category_id)
+    summary = cache.get(cache_key)
+    if summary is None:
+        summary = build_facet_summary(category_path)
+        cache.set(cache_key, summary, settings.DEFAULT_CACHE_TIME)
+    return summary
+
+
+def update_facet_summaries(listings=(), removed=(), old_paths=None):
+    """
+    Запрашивает обновление уже закэшированных сводок для изменённых (listings)
+    и удалённых (removed) записей витрины; old_paths - {id записи: прежний путь}
+    для записей, перенесённых в другую категорию. Сводки обновляются после фиксации
+    транзакции (внутри defer_facet_updates() - при выходе из блока), все записи
+    транзакции - одним чтением и одной записью каждой затронутой сводки.
+    """
+
+    for listing in (*listings, *removed):
+        facet_summary_state.listing_ids.add(listing.pk)
+        facet_summary_state.category_ids.update(get_summary_category_ids(listing.category_path))
+    for category_path in (old_paths or {}).values():
+        facet_summary_state.category_ids.update(get_summary_category_ids(category_path))
+    if facet_summary_state.depth:
+        return
+    # Первый выполненный обработчик обновляет сводки по всем накопленным записям, остальные ничего не делают
+    transaction.on_commit(flush_pending_facet_summaries)
+
+
+def flush_pending_facet_summaries():
+    """
+    Обновляет сводки по накопленным записям под блокировкой; если её держит
+    другой процесс, сводки сбрасываются целиком, чтобы не потерять его изменения.
+    """
+
+    listing_ids, facet_summary_state.listing_ids = facet_summary_state.listing_ids, set()
+    category_ids, facet_summary_state.category_ids = facet_summary_state.category_ids, set()
+    if not listing_ids:
+        return
+    with single_flight('facets:update', FACETS_LOCK_TIMEOUT) as acquired:
+        if acquired:
+            apply_summary_changes(listing_ids, category_ids)
+            return
+    invalidate('facets')
+
+
+def apply_summary_changes(listing_ids, category_ids):
+    keys = {get_summary_cache_key(category_id): category_id for category_id in category_ids}
+    summaries = cache.get_many(keys)
+    if not summaries:
+        # Незакэшированные сводки будут построены при первом обращении
+        return
+
+    # Строки берутся из базы, а не из переданных объектов: изменения откаченной транзакции в сводки не попадают
+    rows = {
+        listing.pk: (get_summary_category_ids(listing.category_path), summary_row(listing))
+        for listing in CatalogListing.objects.filter(pk__in=listing_ids).only(
+            'product_id', 'price', 'in_stock', 'free_delivery', 'tag_slugs', 'category_path'
+        )
+    }
+    for key, summary in summaries.items():
+        for pk in listing_ids:
+            if pk in rows and keys[key] in rows[pk][0]:
+                summary[pk] = rows[pk][1]
+            else:
+                summary.pop(pk, None)
+    cache.set_many(summaries, settings.DEFAULT_CACHE_TIME)
+
+
+@contextmanager
+def defer_facet_updates():
+    """
+    Контекстный менеджер для массового импорта: сводки обновляются один раз после завершения блока
+    """
+
+    depth = facet_summary_state.depth
+    facet_summary_state.depth = depth + 1
+    try:
+        yield
+    finally:
+        facet_summary_state.depth = depth
+        if not depth:
+            transaction.on_commit(flush_pending_facet_summaries)
+
+
+def reset_facet_summaries():
+    """
+    Сбрасывает сводки всех категорий (например, при изменении дерева категорий)
+    """
+
+    invalidate('facets')
+
+
+def build_price_histogram(prices, buckets=HISTOGRAM_BUCKETS):
+    if not prices:
+        return []
+    low, high = min(prices), max(prices)
+    step = (high - low) / buckets or Decimal(1)
+    counts = Counter(min(int((price - low) / step), buckets - 1) for price in prices)
+    return [
+        {'from': low + step * index, 'to': low + step * (index + 1), 'count': counts[index]}
+        for index in range(buckets)
+    ]
+
+
+def compute_facets(
+    summary, price_range=None, in_stock=False, free_delivery=False, tag_product_ids=None, product_ids=None
+):
+    """
+    За один проход по сводке считает фасеты для текущих фильтров.
+    Счётчик каждого фасета учитывает все фильтры, кроме его собственного,
+    поэтому показывает, сколько товаров будет найдено при его выборе.
+    """
+
+    if product_ids is not None:
+        product_ids = set(product_ids)
+    tag_counts = Counter()
+    in_stock_count = free_delivery_count = total = 0
+    histogram_prices = []
+
+    for product_id, price, row_in_stock, row_free_delivery, tags in summary.values():
+        if product_ids is not None and product_id not in product_ids:
+            continue
+        checks = {
+            'price': price_range is None or price_range[0] <= price <= price_range[1],
+            'in_stock': not in_stock or row_in_stock,
+            'free_delivery': not free_delivery or row_free_delivery,
+            'tag': tag_product_ids is None or product_id in tag_product_ids,
+        }
+        failed = [name for name, passed in checks.items() if not passed]
+
+        if not failed:
+            total += 1
+        if not failed or failed == ['tag']:
+            tag_counts.update(tags)
+        if (not failed or failed == ['in_stock']) and row_in_stock:
+            in_stock_count += 1
+        if (not failed or failed == ['free_delivery']) and row_free_delivery:
+            free_delivery_count += 1
+        if not failed or failed == ['price']:
+            histogram_prices.append(price)
+
+    return {
+        'total': total,
+        'tags': dict(tag_counts),
+        'in_stock': in_stock_count,
+        'free_delivery': free_delivery_count,
+        'price_histogram': build_price_histogram(histogram_prices),
+    }
@@ -6,6 +6,8 @@ from django.utils.translation import gettext_lazy as _
 
 from shop.admin_mixin import UniqueAttributeMixin
 from shop.models import Attribute, ProductAttribute, Review
+from shop.search import get_search_backend
+from shop.tags import get_tag_index
 
 
 class ProductFilterForm(forms.Form):
@@ -30,9 +32,48 @@ class ProductFilterForm(forms.Form):
         'class': 'toggle'
     }))
 
+    def search_product_ids(self):
+        """
+        Ищет товары по полю title через полнотекстовый поисковый бэкенд.
+        Возвращает id товаров в порядке релевантности или None, если поле не заполнено.
+        search_truncated - найдено больше товаров, чем допускает SEARCH_RESULTS_LIMIT.
+        """
+
+        self.search_truncated = False
+        title = self.cleaned_data.get('title')
+        if not title:
+            return None
+        backend = get_search_backend()
+        # Лишний результат показывает, что выдача обрезана
+        product_ids = backend.search(title, limit=backend.limit + 1)
+        self.search_truncated = len(product_ids) > backend.limit
+        return product_ids[:backend.limit]
+
+
+class KnownChoicesField(forms.MultipleChoiceField):
+    """
+    Множественный выбор, который отбрасывает неизвестные значения вместо ошибки валидации
+    """
+
+    def to_python(self, value):
+        return [item for item in super().to_python(value) if self.valid_value(item)]
+
 
 class TagsForm(forms.Form):
-    tags = forms.CharField(required=False)
+    # Неизвестные (например, удалённые) теги отбрасываются, фильтр строится по оставшимся
+    tags = KnownChoicesField(required=False)
+    tag_mode = forms.ChoiceField(choices=[('and', 'Все теги'), ('or', 'Любой из тегов')], required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['tags'].choices = [(slug, name) for slug, (name, product_ids) in get_tag_index().items()]
+
+    def has_tag_filter(self):
+        """
+        Запрошен ли фильтр по тегам, даже если ни один из запрошенных тегов не найден
+        """
+
+        return bool(self['tags'].data)
 
 
 class CustomAttributeAdminForm(forms.ModelForm):
@@ -0,0 +1,142 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = 'cache:invalidate'
+MISSING = object()
+
+
+class LocalCache:
+    """
+    Ограниченный по размеру LRU-кэш в памяти процесса с временем жизни записей.
+    Используется как первый уровень перед Redis для маленьких часто читаемых значений.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return MISSING
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self.data[key]
+                return MISSING
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + timeout)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_entries:
+                self.data.popitem(last=False)
+
+    def evict_prefix(self, prefix):
+        with self.lock:
+            for key in [key for key in self.data if key.startswith(prefix)]:
+                del self.data[key]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+local_cache = LocalCache(settings.LOCAL_CACHE_MAX_ENTRIES)
+tier_stats = {'local': {'hits': 0, 'misses': 0}, 'redis': {'hits': 0, 'misses': 0}}
+listener_state = {'pid': None}
+listener_lock = threading.Lock()
+
+
+def get_local_timeout():
+    return settings.LOCAL_CACHE_TIMEOUT
+
+
+def record(tier, hit):
+    tier_stats[tier]['hits' if hit else 'misses'] += 1
+
+
+def get_tier_stats():
+    """
+    Доля попаданий по уровням кэша в текущем процессе
+    """
+
+    return {
+        tier: {**counts, 'ratio': counts['hits'] / (counts['hits'] + counts['misses'] or 1)}
+        for tier, counts in tier_stats.items()
+    }
+
+
+def get_redis_connection():
+    """
+    Соединение Redis для pub/sub, если кэш работает через django_redis
+    """
+
+    config = settings.CACHES['default']
+    # Бэкенд может быть обёрнут сбором метрик (shop.cache_metrics.InstrumentedCache)
+    backend = config.get('OPTIONS', {}).get('WRAPPED_BACKEND', config['BACKEND'])
+    if not backend.startswith('django_redis'):
+        return None
+    from django_redis import get_redis_connection as get_connection
+    return get_connection('default')
+
+
+def handle_invalidation(message):
+    """
+    Сообщение вида '<пространство>:<версия>' (версия может быть пустой,
+    если удалено одно значение): выбрасываем локальные копии пространства.
+    """
+
+    namespace, version = message.rsplit(':', 1)
+    local_cache.evict_prefix(f'{namespace}:')
+    if version:
+        local_cache.set(f'version:{namespace}', int(version), get_local_timeout())
+
+
+def publish_invalidation(namespace, version=''):
+    handle_invalidation(f'{namespace}:{version}')
+    connection = get_redis_connection()
+    if connection is not None:
+        connection.publish(INVALIDATION_CHANNEL, f'{namespace}:{version}')
+
+
+def listen_invalidations(connection):
+    while True:
+        try:
+            pubsub = connection.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            for message in pubsub.listen():
+                handle_invalidation(message['data'].decode())
+        except Exception:
+            logger.exception('Подписка на сброс локального кэша прервана')
+        # Пока подписки не было, сообщения могли потеряться
+        local_cache.clear()
+        time.sleep(1)
+
+
+def ensure_listener():
+    """
+    Запускает в процессе поток, слушающий сообщения о сбросе кэша.
+    Проверка pid нужна, чтобы поток запускался заново в каждом воркере после fork.
+    """
+
+    if listener_state['pid'] == os.getpid():
+        return
+    with listener_lock:
+        if listener_state['pid'] == os.getpid():
+            return
+        listener_state['pid'] = os.getpid()
+        local_cache.clear()
+        connection = get_redis_connection()
+        if connection is not None:
+            threading.Thread(target=listen_invalidations, args=(connection,), daemon=True).start()
@@ -0,0 +1,102 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import transaction
+
+from shop.catalog import refresh_catalog_listing
+from shop.models import (CatalogListing, Category, Product, Seller,
+                         SellerProduct)
+from shop.paginator import CursorPaginator
+
+SORTS = {
+    'price': ('price', 'pk'),
+    'created_at': ('-created_at', '-pk'),
+    'reviews': ('-review_count', '-pk'),
+    'popularity': ('-sales_count', '-pk'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает время выборки первой и глубокой страницы каталога '
+        'для OFFSET-пагинации и курсорной (keyset) пагинации'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page', type=int, default=500, help='Номер глубокой страницы')
+        parser.add_argument('--per-page', type=int, default=8, help='Товаров на странице')
+        parser.add_argument('--repeat', type=int, default=5, help='Количество замеров')
+        parser.add_argument(
+            '--synthetic',
+            type=int,
+            default=0,
+            help='Сгенерировать N тестовых товаров (изменения откатываются после замеров)',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['synthetic']:
+                self.create_synthetic_listing(options['synthetic'])
+
+            self.stdout.write(f"{'sort':<12}{'offset p1':>12}{'offset pN':>12}{'keyset p1':>12}{'keyset pN':>12}")
+            for sort, ordering in SORTS.items():
+                self.stdout.write(self.benchmark_sort(sort, ordering, options))
+
+            transaction.set_rollback(bool(options['synthetic']))
+
+    def measure(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    def benchmark_sort(self, sort, ordering, options):
+        page, per_page, repeat = options['page'], options['per_page'], options['repeat']
+        queryset = CatalogListing.objects.order_by(*ordering)
+        paginator = CursorPaginator(queryset, per_page, ordering)
+
+        # Курсор на глубокую страницу строится заранее и не входит в замер
+        last_on_previous_page = queryset[(page - 1) * per_page - 1:(page - 1) * per_page].first()
+        if last_on_previous_page is None:
+            return f'{sort:<12}недостаточно товаров для страницы {page}'
+        cursor = paginator.encode_cursor(last_on_previous_page, page, backwards=False)
+
+        def offset_page(number):
+            def fetch():
+                offset_paginator = Paginator(queryset, per_page)
+                return offset_paginator.num_pages, list(offset_paginator.page(number))
+            return fetch
+
+        results = [
+            self.measure(offset_page(1), repeat),
+            self.measure(offset_page(page), repeat),
+            self.measure(lambda: paginator.get_page(), repeat),
+            self.measure(lambda: paginator.get_page(cursor), repeat),
+        ]
+        return f'{sort:<12}' + ''.join(f'{result:>10.2f}ms' for result in results)
+
+    def create_synthetic_listing(self, count):
+        user = get_user_model().objects.create_user(
+            username='benchmark',
+            email='benchmark@example.com',
+            password=None,
+        )
+        seller = Seller.objects.create(user=user, name='benchmark')
+        category = Category.objects.create(name='benchmark')
+        product = Product.objects.create(name='benchmark', category=category)
+        SellerProduct.objects.bulk_create(
+            SellerProduct(
+                seller=seller,
+                product=product,
+                price=Decimal(index % 1000),
+                quantity=index % 7,
+            )
+            for index in range(count)
+        )
+        refresh_catalog_listing(SellerProduct.objects.filter(seller=seller))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.catalog import refresh_catalog_listing
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает денормализованную витрину каталога (CatalogListing)'
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        count = refresh_catalog_listing()
+        self.stdout.write(self.style.SUCCESS(f'Витрина каталога перестроена: {count} записей'))
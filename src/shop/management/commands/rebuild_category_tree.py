@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.catalog import rebuild_category_tree
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает материализованные пути дерева категорий (Category.path)'
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        count = rebuild_category_tree()
+        self.stdout.write(self.style.SUCCESS(f'Дерево категорий перестроено: {count} категорий'))
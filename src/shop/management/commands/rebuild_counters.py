@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.cart import rebuild_cart_totals
+from shop.catalog import rebuild_sales_counts
+from shop.reviews import rebuild_review_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет денормализованные счётчики (продажи, статистика отзывов, итоги корзин) '
+        'с исходными таблицами, выводит расхождения и исправляет их'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только вывести расхождения, ничего не изменяя',
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        sales_drift = rebuild_sales_counts(dry_run=dry_run)
+        for model_name, pk, stored, actual in sales_drift:
+            self.stdout.write(f'{model_name} #{pk}: продаж {stored}, фактически {actual}')
+
+        review_drift = rebuild_review_stats(dry_run=dry_run)
+        for pk, stored, actual in review_drift:
+            self.stdout.write(f'Product #{pk}: отзывов {stored}, фактически {actual}')
+
+        cart_drift = rebuild_cart_totals(dry_run=dry_run)
+        for pk, stored, actual in cart_drift:
+            self.stdout.write(f'Cart #{pk}: итоги {stored}, фактически {actual}')
+
+        total = len(sales_drift) + len(review_drift) + len(cart_drift)
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f'Найдено расхождений: {total}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Счётчики пересчитаны, исправлено расхождений: {total}'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from shop.warmup import warm_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет кэш после деплоя или сброса: сначала общие данные '
+        '(категории, настройки, баннеры, блоки главной), затем снимки страниц товаров'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=None, help='Сколько снимков товаров построить (по умолчанию - все)')
+        parser.add_argument('--batch-size', type=int, default=50, help='Товаров в одной пачке')
+        parser.add_argument('--workers', type=int, default=4, help='Количество параллельных потоков')
+        parser.add_argument('--skip-products', action='store_true', help='Не строить снимки страниц товаров')
+
+    def progress(self, step, done, total):
+        self.stdout.write(f'{step}: {done}/{total}')
+
+    def handle(self, *args, **options):
+        result = warm_cache(
+            product_limit=0 if options['skip_products'] else options['products'],
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            progress=self.progress,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Кэш прогрет, построено снимков товаров: {result["product"]}'))
@@ -0,0 +1,145 @@
+import functools
+import math
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache_keys import LOCAL_NAMESPACES, make_key
+from .local_cache import (MISSING, get_local_timeout, local_cache,
+                          record)
+
+# Сколько ждать, пока другой процесс вычисляет отсутствующее значение
+MISS_WAIT_TIMEOUT = 5
+MISS_WAIT_INTERVAL = 0.05
+
+
+@contextmanager
+def single_flight(key, timeout):
+    """
+    Блокировка на время вычисления значения: через Redis lock, если бэкенд кэша
+    его поддерживает (django_redis), иначе через атомарный cache.add.
+    Возвращает True, если блокировку удалось получить.
+    """
+
+    lock_key = f'lock:{key}'
+    if hasattr(cache, 'lock'):
+        lock = cache.lock(lock_key, timeout=timeout)
+        acquired = lock.acquire(blocking=False)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+    else:
+        acquired = cache.add(lock_key, 1, timeout)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                cache.delete(lock_key)
+
+
+def should_recompute(delta, expiry, beta):
+    """
+    Вероятностный досрочный пересчёт (XFetch): чем ближе срок и чем дольше
+    вычисляется значение, тем вероятнее, что один из запросов пересчитает его заранее.
+    """
+
+    return time.time() - delta * beta * math.log(1 - random.random()) >= expiry
+
+
+def compute_on_miss(key, lock_timeout, compute):
+    """
+    При промахе значение вычисляет один процесс, остальные ждут его результата
+    """
+
+    deadline = time.time() + MISS_WAIT_TIMEOUT
+    while True:
+        with single_flight(key, lock_timeout) as acquired:
+            if acquired:
+                return compute()
+        time.sleep(MISS_WAIT_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+        if time.time() >= deadline:
+            # Вычисляющий процесс не успел - считаем сами
+            return compute()
+
+
+def get_shared(key, compute, beta, lock_timeout):
+    """
+    Чтение из общего кэша (Redis) с досрочным пересчётом и отдачей устаревшего значения
+    """
+
+    entry = cache.get(key)
+    record('redis', entry is not None)
+
+    if entry is not None:
+        value, delta, expiry = entry
+        if not should_recompute(delta, expiry, beta):
+            return value
+        with single_flight(key, lock_timeout) as acquired:
+            if acquired:
+                return compute()
+        # Значение уже пересчитывает другой процесс - отдаём текущее
+        return value
+
+    return compute_on_miss(key, lock_timeout, compute)
+
+
+def memoize(namespace, timeout=None, stale_timeout=None, beta=1.0, lock_timeout=30):
+    """
+    Декоратор кэширования результата функции в пространстве имён namespace
+    (аргументы функции входят в ключ).
+
+    - значение пересчитывает только процесс, получивший блокировку (single-flight);
+    - незадолго до истечения срока значение пересчитывается досрочно (XFetch);
+    - после истечения срока ещё stale_timeout секунд отдаётся устаревшее значение,
+      пока один процесс вычисляет новое (stale-while-revalidate).
+    """
+
+    def decorator(func):
+        def get_timeouts():
+            fresh_timeout = settings.DEFAULT_CACHE_TIME if timeout is None else timeout
+            return fresh_timeout, fresh_timeout if stale_timeout is None else stale_timeout
+
+        def compute_and_store(key, args, kwargs):
+            fresh_timeout, extra_timeout = get_timeouts()
+            start = time.time()
+            value = func(*args, **kwargs)
+            delta = time.time() - start
+            cache.set(key, (value, delta, time.time() + fresh_timeout), fresh_timeout + extra_timeout)
+            return value
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(namespace, *args, *kwargs.values())
+
+            def compute():
+                return compute_and_store(key, args, kwargs)
+
+            if namespace not in LOCAL_NAMESPACES:
+                return get_shared(key, compute, beta, lock_timeout)
+
+            value = local_cache.get(key)
+            record('local', value is not MISSING)
+            if value is MISSING:
+                value = get_shared(key, compute, beta, lock_timeout)
+                local_cache.set(key, value, get_local_timeout())
+            return value
+
+        def refresh(*args, **kwargs):
+            """
+            Принудительно пересчитывает и сохраняет значение
+            """
+
+            return compute_and_store(make_key(namespace, *args, *kwargs.values()), args, kwargs)
+
+        wrapper.refresh = refresh
+        return wrapper
+
+    return decorator
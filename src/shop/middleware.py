@@ -0,0 +1,28 @@
+VISITOR_VERSION_SESSION_KEY = 'visitor_version'
+UNSAFE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+
+def get_visitor_version(request):
+    """
+    Номер версии состояния посетителя (корзина, сравнение, сообщения).
+    Входит в ETag страниц вместо самих данных корзины.
+    """
+
+    return request.session.get(VISITOR_VERSION_SESSION_KEY, 0)
+
+
+class VisitorVersionMiddleware:
+    """
+    Увеличивает версию состояния посетителя после каждого успешного изменяющего запроса:
+    корзина, сравнение и сообщения меняются только POST-запросами, поэтому
+    закэшированные браузером страницы после них не считаются актуальными.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method in UNSAFE_METHODS and response.status_code < 400:
+            request.session[VISITOR_VERSION_SESSION_KEY] = get_visitor_version(request) + 1
+        return response
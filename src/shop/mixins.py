@@ -1,5 +1,12 @@
+import hashlib
+
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import never_cache
+from django.utils.translation import get_language
+from django.views.decorators.cache import cache_control, never_cache
+from django.views.decorators.http import condition
+
+from shop.cache_keys import get_version
+from shop.middleware import get_visitor_version
 
 
 class NonCachingMixin:
@@ -12,3 +19,42 @@ class NonCachingMixin:
     @method_decorator(never_cache)
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
+
+
+class ConditionalGetMixin:
+    """
+    Миксин 'ConditionalGetMixin' отдаёт ETag и Last-Modified и отвечает 304,
+    если страница не изменилась. Браузер обязан перепроверять страницу при каждом
+    показе (max-age=0, must-revalidate), но при совпадении отпечатка HTML не передаётся.
+
+    Представление возвращает отпечаток содержимого (get_content_fingerprint)
+    и время последнего изменения (get_last_modified) по меткам updated_at моделей.
+    В ETag дополнительно входят язык, путь с параметрами запроса, пользователь
+    и версия состояния посетителя; данные корзины в отпечаток не входят.
+    """
+
+    def get_content_fingerprint(self):
+        raise NotImplementedError
+
+    def get_last_modified(self):
+        return None
+
+    def get_etag(self):
+        parts = (
+            get_language(),
+            self.request.get_full_path(),
+            self.request.user.pk,
+            get_visitor_version(self.request),
+            # Меню категорий выводится на каждой странице
+            get_version('categories'),
+            *self.get_content_fingerprint(),
+        )
+        return hashlib.md5(repr(parts).encode()).hexdigest()
+
+    @method_decorator(cache_control(max_age=0, must_revalidate=True, private=True))
+    def dispatch(self, request, *args, **kwargs):
+        handler = condition(
+            etag_func=lambda *args, **kwargs: self.get_etag(),
+            last_modified_func=lambda *args, **kwargs: self.get_last_modified(),
+        )(super().dispatch)
+        return handler(request, *args, **kwargs)
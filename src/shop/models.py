@@ -1,7 +1,12 @@
+from decimal import Decimal
+
 from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator
-from django.db import models
-from django.db.models import DecimalField, F, Sum
+from django.db import connections, models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
 from django.urls import reverse
 from taggit.managers import TaggableManager
 
@@ -13,6 +18,26 @@ def product_preview_directory_path(instance: "Product", filename: str) -> str:
     )
 
 
+class CounterFieldsMixin:
+    """
+    Счётчики из counter_fields меняются только UPDATE'ами с F(),
+    поэтому при сохранении существующего объекта они не перезаписываются
+    значениями, прочитанными до конкурентного увеличения.
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Как и save() Django, отложенные (.only()/.defer()) поля не перезаписываются
+            skipped = {*self.counter_fields, *self.get_deferred_fields()}
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in skipped and field.name not in skipped
+            ]
+        super().save(*args, **kwargs)
+
+
 def seller_thumbnail_directory_path(instance: "Seller", filename: str) -> str:
     return f"shop/seller_thumbnails/seller_{instance.pk}/{filename}"
 
@@ -54,6 +79,9 @@ def category_icon_directory_path(instance: "Category", filename: str):
     )
 
 
+CATEGORY_CYCLE_ERROR = 'Категория не может быть вложена в саму себя или в своего потомка'
+
+
 class Category(models.Model):
     """
       Модель Category представляет категорию
@@ -68,12 +96,84 @@ class Category(models.Model):
     name = models.CharField(max_length=100, db_index=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, related_name='children', null=True, blank=True)
     icon = models.ImageField(null=True, blank=True, upload_to=category_icon_directory_path)
+    # Материализованный путь: цепочка id от корня до самой категории вида '1/5/'.
+    # Потомки категории - все категории, путь которых начинается с её пути.
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
 
-
-class Product(models.Model):
+    @property
+    def ancestor_ids(self):
+        return [int(pk) for pk in self.path.split('/') if pk]
+
+    def get_path(self):
+        """
+        Материализованный путь категории. Если путь ещё не построен (категория создана
+        до появления путей), он строится по цепочке родителей и сохраняется.
+        """
+
+        if not self.path and self.pk:
+            category_ids = [self.pk]
+            parent_id = self.parent_id
+            while parent_id:
+                if parent_id in category_ids:
+                    raise ValidationError({'parent': CATEGORY_CYCLE_ERROR})
+                category_ids.append(parent_id)
+                parent_id = Category.objects.filter(pk=parent_id).values_list('parent_id', flat=True).first()
+            self.path = ''.join(f'{pk}/' for pk in reversed(category_ids))
+            self.depth = len(category_ids) - 1
+            Category.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+        return self.path
+
+    def build_path(self):
+        parent_path = self.parent.get_path() if self.parent_id else ''
+        return f'{parent_path}{self.pk}/'
+
+    def clean(self):
+        if self.pk and self.parent_id:
+            self.parent.get_path()
+            if self.pk in self.parent.ancestor_ids:
+                raise ValidationError({'parent': CATEGORY_CYCLE_ERROR})
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            if self.pk is None:
+                super().save(*args, **kwargs)
+                self.path = self.build_path()
+                self.depth = len(self.ancestor_ids) - 1
+                Category.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+                return
+
+            # Цикл в дереве испортил бы пути всех потомков при их перезаписи ниже
+            self.clean()
+            old_path = Category.objects.filter(pk=self.pk).values_list('path', flat=True).first()
+            self.path = self.build_path()
+            self.depth = len(self.ancestor_ids) - 1
+            if old_path and old_path != self.path:
+                # При переносе категории пути всех потомков переписываются одним запросом
+                Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                    path=Concat(Value(self.path), Substr('path', len(old_path) + 1)),
+                    depth=F('depth') + self.depth - (len(old_path.split('/')) - 2),
+                )
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'path', 'depth'}
+            super().save(*args, **kwargs)
+
+    def get_descendants(self, include_self=True):
+        categories = Category.objects.filter(path__startswith=self.path)
+        if not include_self:
+            categories = categories.exclude(pk=self.pk)
+        return categories
+
+    def get_ancestors(self, include_self=False):
+        ancestor_ids = self.ancestor_ids if include_self else self.ancestor_ids[:-1]
+        return Category.objects.filter(pk__in=ancestor_ids).order_by('depth')
+
+
+class Product(CounterFieldsMixin, models.Model):
     """
       Модель Product представляет товар,
       который можно продавать в интернет-магазине.
@@ -90,6 +190,16 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     available = models.BooleanField(default=True)
     tags = TaggableManager(blank=True)
+    # Число позиций заказов по всем предложениям продавцов, поддерживается shop.catalog.update_sales_count
+    sales_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)
+    # Статистика отзывов, поддерживается функциями shop.reviews
+    review_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)
+    last_review_at = models.DateTimeField(null=True, blank=True, editable=False)
+    rating_avg = models.DecimalField(max_digits=3, decimal_places=2, null=True, blank=True, editable=False)
+    # Метка изменения для ETag/Last-Modified страницы товара
+    updated_at = models.DateTimeField(auto_now=True)
+
+    counter_fields = ('sales_count', 'review_count', 'last_review_at', 'rating_avg')
 
     def __str__(self):
         return self.name
@@ -122,6 +232,9 @@ class Review(models.Model):
     created_at = models.DateTimeField(
         auto_now_add=True,
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+    )
 
     class Meta:
         ordering = ['-created_at']
@@ -203,7 +316,7 @@ class Seller(models.Model):
         return reverse("seller_details", kwargs={"pk": self.pk})
 
 
-class SellerProduct(models.Model):
+class SellerProduct(CounterFieldsMixin, models.Model):
     """
     Модель SellerProduct представляет товар, который продает конкретный продавец (Seller).
     Эта модель связана с Product и отличается ценой и количеством от продавца к продавцу.
@@ -216,48 +329,177 @@ class SellerProduct(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     free_delivery = models.BooleanField(default=False)
     is_limited = models.BooleanField(default=False)
+    # Число позиций заказов с этим предложением, поддерживается shop.catalog.update_sales_count
+    sales_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    counter_fields = ('sales_count',)
 
     def __str__(self):
         return self.product.name
 
 
+class CatalogListing(models.Model):
+    """
+    Модель CatalogListing - денормализованная витрина каталога.
+    Одна запись на каждый SellerProduct: в ней хранятся все данные карточки каталога,
+    поэтому сортировка и фильтрация выполняются по одной таблице без JOIN'ов.
+    Записи поддерживаются в актуальном состоянии сигналами (shop.signals)
+    и полностью перестраиваются командой rebuild_catalog_listing.
+    """
+
+    class Meta:
+        ordering = ['pk']
+        indexes = [
+            models.Index(fields=['category_path', 'price']),
+            models.Index(fields=['price', 'seller_product']),
+            models.Index(fields=['created_at', 'seller_product']),
+            models.Index(fields=['review_count', 'seller_product']),
+            models.Index(fields=['sales_count', 'seller_product']),
+        ]
+
+    seller_product = models.OneToOneField(
+        SellerProduct,
+        primary_key=True,
+        related_name='listing',
+        on_delete=models.CASCADE,
+    )
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, related_name='+', on_delete=models.CASCADE)
+    name = models.CharField(max_length=100, db_index=True)
+    preview = models.CharField(max_length=255, blank=True, default='')
+    category_name = models.CharField(max_length=100)
+    category_path = models.CharField(max_length=255, db_index=True)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    in_stock = models.BooleanField(default=False)
+    free_delivery = models.BooleanField(default=False)
+    review_count = models.PositiveIntegerField(default=0)
+    sales_count = models.PositiveIntegerField(default=0)
+    tag_slugs = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def preview_url(self):
+        if not self.preview:
+            return ''
+        return default_storage.url(self.preview)
+
+
 class Cart(models.Model):
     """
     Модель Cart представляет корзину, в которую можно добавлять товары.
+    Итоги корзины хранятся в самой корзине и меняются атомарно вместе с позициями,
+    поэтому шапка сайта читает их одним запросом без агрегатов.
     """
     user = models.OneToOneField('accounts.User', on_delete=models.CASCADE)
     discount = models.ForeignKey('discounts.CartDiscount', on_delete=models.SET_NULL, related_name='carts', null=True, blank=True)
+    quantity_total = models.PositiveIntegerField(default=0)
+    price_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
 
     def __str__(self):
         return f"Cart number {self.id} -- User: {self.user.email} -- Total price: {self.total_price()}"
 
     def total_price(self):
-        total = self.cart_items.aggregate(
-            total=Sum(F('price') * F('quantity'), output_field=DecimalField())
-        )['total'] or 0
-        return total
+        return self.price_total
 
     def add_product(self, product, quantity=1):
-        cart_item, created = CartItem.objects.get_or_create(product=product, cart=self)
-        if created:
-            cart_item.quantity = quantity
-            cart_item.price = product.price
-        else:
-            cart_item.quantity += quantity
-        cart_item.save()
+        self.add_products([(product, quantity)])
+
+    def add_products(self, items):
+        """
+        Добавляет в корзину товары: items - пары (товар продавца, количество).
+        Все позиции записываются одним атомарным upsert-запросом
+        (quantity = quantity + добавленное), поэтому одновременные добавления не теряются.
+        """
+
+        quantities = {}
+        for product, quantity in items:
+            if not isinstance(quantity, int) or quantity <= 0:
+                raise ValueError(f"Некорректное количество товара {product.pk}: {quantity!r}")
+            quantities.setdefault(product, 0)
+            quantities[product] += quantity
+        if not quantities:
+            return
+
+        with transaction.atomic():
+            prices = CartItem.objects.add_quantities(self, quantities.items())
+            self.update_totals(
+                sum(quantities.values()),
+                sum(prices[product.pk] * quantity for product, quantity in quantities.items()),
+            )
 
     def delete_product(self, cart_item):
-        cart_item.delete()
+        # Позиция перечитывается при удалении, итоги уменьшает обработчик post_delete (shop.signals)
+        with transaction.atomic():
+            deleted = CartItem.objects.select_for_update().filter(pk=cart_item.pk).values_list(
+                'quantity', 'price'
+            ).first()
+            CartItem.objects.filter(pk=cart_item.pk).delete()
+        if deleted:
+            quantity, price = deleted
+            self.quantity_total -= quantity
+            self.price_total -= price * quantity
 
     def update_product(self, cart_item, quantity):
-        if quantity > 0:
-            cart_item.quantity = quantity
-            cart_item.save()
-        else:
+        if quantity <= 0:
             self.delete_product(cart_item)
+            return
+
+        with transaction.atomic():
+            # Блокировка строки: разница считается от текущего количества, а не от прочитанного ранее
+            current = CartItem.objects.select_for_update().filter(pk=cart_item.pk).values_list(
+                'quantity', 'price'
+            ).first()
+            if current is None:
+                return
+            current_quantity, price = current
+            CartItem.objects.filter(pk=cart_item.pk).update(quantity=quantity)
+            self.update_totals(quantity - current_quantity, price * (quantity - current_quantity))
+        cart_item.quantity = quantity
 
     def total_quantity(self):
-        return self.cart_items.aggregate(total_quantity=Sum('quantity'))['total_quantity'] or 0
+        return self.quantity_total
+
+    def update_totals(self, quantity_delta, price_delta):
+        """
+        Меняет итоги корзины выражением F() на стороне базы, без гонок между запросами.
+        Значения в объекте меняются на ту же разницу.
+        """
+
+        Cart.objects.filter(pk=self.pk).update(
+            quantity_total=F('quantity_total') + quantity_delta,
+            price_total=F('price_total') + price_delta,
+        )
+        self.quantity_total += quantity_delta
+        self.price_total += price_delta
+
+
+class CartItemManager(models.Manager):
+    def add_quantities(self, cart, items):
+        """
+        Атомарно добавляет количества к позициям корзины одним запросом
+        INSERT ... ON CONFLICT (cart, product) DO UPDATE SET quantity = quantity + excluded.quantity.
+        Новая позиция получает текущую цену товара, у существующей цена не меняется.
+        Возвращает {id товара продавца: цена позиции}.
+        """
+
+        items = list(items)
+        table = connections[self.db].ops.quote_name(self.model._meta.db_table)
+        values = ', '.join(['(%s, %s, %s, %s)'] * len(items))
+        params = [value for product, quantity in items for value in (cart.pk, product.pk, quantity, product.price)]
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (cart_id, product_id, quantity, price) VALUES {values} '
+                f'ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {table}.quantity + EXCLUDED.quantity '
+                f'RETURNING product_id, price',
+                params,
+            )
+            # SQLite возвращает цену числом с плавающей точкой
+            return {product_id: Decimal(str(price)) for product_id, price in cursor.fetchall()}
 
 
 class CartItem(models.Model):
@@ -270,6 +512,13 @@ class CartItem(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
+    objects = CartItemManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
+
     def __str__(self):
         return f"id: {self.id}. Name: {self.product.product.name} -- Cart# {self.cart.id} -- Quantity: {self.quantity} -- Price: {self.price}"
 
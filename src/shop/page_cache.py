@@ -0,0 +1,102 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.formats import localize
+from django.utils.translation import get_language
+
+from .cache_keys import make_key
+from .cart import get_cart
+
+# Персональные части страницы в закэшированном HTML заменены метками,
+# которые подставляются заново при каждом запросе
+CSRF_TOKEN_PLACEHOLDER = '__page_cache_csrf_token__'
+CART_QUANTITY_PLACEHOLDER = '__page_cache_cart_quantity__'
+CART_PRICE_PLACEHOLDER = '__page_cache_cart_price__'
+
+
+def is_rendering_for_cache(request):
+    return getattr(request, 'page_cache_rendering', False)
+
+
+def has_pending_messages(request):
+    storage = get_messages(request)
+    # Перебор хранилища помечает сообщения показанными, поэтому флаг used восстанавливается
+    used = storage.used
+    has_messages = any(True for message in storage)
+    storage.used = used
+    return has_messages
+
+
+def is_cacheable(request):
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    return not has_pending_messages(request)
+
+
+def get_page_cache_key(request):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return make_key('pages', get_language(), path)
+
+
+def fill_placeholders(request, content):
+    """
+    Подставляет в HTML данные текущего посетителя: CSRF-токен и итоги корзины
+    """
+
+    total_quantity, total_price = get_cart(request).get_totals()
+    # Значения форматируются так же, как в шаблоне шапки: {{ total_price|default:"0.00" }}
+    replacements = {
+        CSRF_TOKEN_PLACEHOLDER: get_token(request),
+        CART_QUANTITY_PLACEHOLDER: localize(total_quantity or 0),
+        CART_PRICE_PLACEHOLDER: localize(total_price or '0.00'),
+    }
+    for placeholder, value in replacements.items():
+        content = content.replace(placeholder.encode(), value.encode())
+    return content
+
+
+def render_for_cache(view_func, request, *args, **kwargs):
+    request.page_cache_rendering = True
+    try:
+        response = view_func(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+    finally:
+        request.page_cache_rendering = False
+    return response
+
+
+def cache_anonymous_page(view_func):
+    """
+    Кэширует страницу целиком для анонимных посетителей по языку, пути и параметрам запроса.
+    Корзина и CSRF-токен в кэш не попадают: вместо них в HTML остаются метки,
+    которые заполняются после чтения из кэша. Страницы с ожидающими показа
+    сообщениями не кэшируются и не читаются из кэша.
+    """
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if not is_cacheable(request):
+            return view_func(request, *args, **kwargs)
+
+        cache_key = get_page_cache_key(request)
+        cached = cache.get(cache_key)
+        if cached is None:
+            response = render_for_cache(view_func, request, *args, **kwargs)
+            if response.streaming:
+                return response
+            if response.status_code != 200:
+                response.content = fill_placeholders(request, response.content)
+                return response
+            cached = (response.content, response['Content-Type'])
+            cache.set(cache_key, cached, settings.PAGE_CACHE_TIMEOUT)
+
+        content, content_type = cached
+        return HttpResponse(fill_placeholders(request, content), content_type=content_type)
+
+    return wrapper
@@ -0,0 +1,166 @@
+import base64
+import binascii
+import copy
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.http import QueryDict
+
+
+def parse_ordering(queryset, ordering):
+    """
+    Превращает ordering вида ('-price', 'pk') в список (имя, поле, по убыванию).
+    Помимо полей модели поддерживаются аннотации queryset.
+    """
+
+    fields = []
+    for name in ordering:
+        descending = name.startswith('-')
+        name = name.lstrip('-')
+        if name in queryset.query.annotations:
+            field = copy.copy(queryset.query.annotations[name].output_field)
+            field.set_attributes_from_name(name)
+        elif name == 'pk':
+            field = queryset.model._meta.pk
+        else:
+            field = queryset.model._meta.get_field(name)
+        fields.append((name, field, descending))
+    return fields
+
+
+class CursorPage:
+    """
+    Страница курсорной (keyset) пагинации. Повторяет интерфейс django.core.paginator.Page,
+    который используется в шаблонах, но не знает общего количества страниц.
+    """
+
+    def __init__(self, object_list, number, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+    @property
+    def next_url(self):
+        if not self._has_next:
+            return ''
+        return self.paginator.get_url(self.object_list[-1], self.number + 1, backwards=False)
+
+    @property
+    def previous_url(self):
+        if not self._has_previous:
+            return ''
+        if self.number == 2:
+            return self.paginator.get_url(None, 1)
+        return self.paginator.get_url(self.object_list[0], self.number - 1, backwards=True)
+
+
+class CursorPaginator:
+    """
+    Курсорная (keyset) пагинация: следующая страница выбирается условием
+    WHERE (поле, pk) > (последнее значение), а не OFFSET, поэтому время выборки
+    не зависит от номера страницы, а COUNT по всей выборке не выполняется.
+    Последнее поле в ordering должно быть уникальным (pk) - это стабильный tiebreaker.
+    """
+
+    cursor_mode = True
+    cursor_param = 'cursor'
+
+    def __init__(self, queryset, per_page, ordering, query_dict=None):
+        self.ordering = parse_ordering(queryset, ordering)
+        self.queryset = queryset.order_by(*ordering)
+        self.per_page = per_page
+        self.query_dict = query_dict.copy() if query_dict is not None else QueryDict(mutable=True)
+
+    def encode_cursor(self, obj, number, backwards):
+        values = [field.value_to_string(obj) for name, field, descending in self.ordering]
+        data = {'v': values, 'n': number, 'b': backwards}
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values = [
+                field.to_python(value)
+                for (name, field, descending), value in zip(self.ordering, data['v'], strict=True)
+            ]
+            return values, int(data['n']), bool(data['b'])
+        except (binascii.Error, ValueError, KeyError, TypeError, ValidationError, FieldDoesNotExist):
+            return None
+
+    def get_url(self, obj, number, backwards=False):
+        query_dict = self.query_dict.copy()
+        query_dict.pop(self.cursor_param, None)
+        query_dict.pop('page', None)
+        if obj is not None:
+            query_dict[self.cursor_param] = self.encode_cursor(obj, number, backwards)
+        return f'?{query_dict.urlencode()}'
+
+    def seek_filter(self, values, backwards):
+        """
+        Строит условие "строго после курсора" для составного ключа сортировки:
+        (f1 > v1) OR (f1 = v1 AND f2 > v2) OR ...
+        """
+
+        condition = Q()
+        equal = {}
+        for (name, field, descending), value in zip(self.ordering, values):
+            lookup = 'lt' if descending != backwards else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def get_page(self, cursor=None):
+        decoded = self.decode_cursor(cursor) if cursor else None
+        if decoded is None:
+            object_list = list(self.queryset[:self.per_page + 1])
+            has_next = len(object_list) > self.per_page
+            return CursorPage(object_list[:self.per_page], 1, self, has_next, False)
+
+        values, number, backwards = decoded
+        queryset = self.queryset.filter(self.seek_filter(values, backwards))
+        if backwards:
+            queryset = queryset.reverse()
+        object_list = list(queryset[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+
+        if backwards:
+            object_list.reverse()
+            return CursorPage(object_list, number, self, True, has_more)
+        return CursorPage(object_list, number, self, has_more, True)
+
+
+class KnownCountPaginator(Paginator):
+    """
+    Обычный Paginator, которому общее число объектов передаётся заранее
+    (например, из денормализованного счётчика), поэтому COUNT не выполняется.
+    """
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count = count
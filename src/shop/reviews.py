@@ -0,0 +1,95 @@
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Now
+
+from .models import CatalogListing, Product, Review
+from .snapshots import invalidate_product_snapshots
+
+
+def add_review(review):
+    """
+    Сохраняет новый отзыв. Счётчик отзывов товара и его записей витрины
+    увеличивается в той же транзакции обработчиком post_save (shop.signals).
+    """
+
+    with transaction.atomic():
+        review.save()
+    return review
+
+
+def update_review_count(product_id, delta):
+    """
+    Меняет счётчик отзывов товара и его записей витрины на delta
+    UPDATE'ами с F(), дата последнего отзыва берётся из таблицы отзывов.
+    Вызывается и вне add_review/delete_reviews (обычный save(), каскадное удаление),
+    поэтому сама открывает транзакцию и блокирует строку товара.
+    """
+
+    with transaction.atomic():
+        list(Product.objects.select_for_update().filter(pk=product_id).values_list('pk', flat=True))
+        Product.objects.filter(pk=product_id).update(
+            review_count=F('review_count') + delta,
+            last_review_at=get_actual_review_stats()['last_review_at'],
+            updated_at=Now(),
+        )
+        CatalogListing.objects.filter(product_id=product_id).update(
+            review_count=F('review_count') + delta, updated_at=Now()
+        )
+    invalidate_product_snapshots([product_id])
+
+
+def get_actual_review_stats():
+    """
+    Подзапросы с фактической статистикой отзывов товара
+    """
+
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    return {
+        'review_count': Coalesce(Subquery(reviews.annotate(count=Count('pk')).values('count')), 0),
+        'last_review_at': Subquery(reviews.annotate(last=Max('created_at')).values('last')),
+    }
+
+
+def update_review_stats(product_ids):
+    """
+    Пересчитывает статистику отзывов переданных товаров одним UPDATE
+    и переносит счётчики в витрину каталога.
+    """
+
+    product_ids = list(product_ids)
+    with transaction.atomic():
+        Product.objects.filter(pk__in=product_ids).update(**get_actual_review_stats(), updated_at=Now())
+        CatalogListing.objects.filter(product_id__in=product_ids).update(
+            review_count=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('review_count')),
+            updated_at=Now(),
+        )
+    invalidate_product_snapshots(product_ids)
+
+
+def delete_reviews(reviews):
+    """
+    Удаляет отзывы queryset'а одной транзакцией,
+    статистику их товаров уменьшает обработчик post_delete (shop.signals).
+    """
+
+    with transaction.atomic():
+        reviews.delete()
+
+
+def rebuild_review_stats(dry_run=False):
+    """
+    Сверяет статистику отзывов с таблицей отзывов и исправляет расхождения.
+    Возвращает список расхождений (id товара, сохранённое число отзывов, фактическое).
+    """
+
+    products = Product.objects.annotate(
+        **{f'actual_{name}': value for name, value in get_actual_review_stats().items()}
+    ).values_list('pk', 'review_count', 'actual_review_count', 'last_review_at', 'actual_last_review_at')
+    drift = [
+        (pk, review_count, actual_review_count)
+        for pk, review_count, actual_review_count, last_review_at, actual_last_review_at in products
+        if (review_count, last_review_at) != (actual_review_count, actual_last_review_at)
+    ]
+    if drift and not dry_run:
+        update_review_stats(pk for pk, _, _ in drift)
+    return drift
@@ -0,0 +1,216 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import Product
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def split_words(query):
+    return WORD_RE.findall(query.lower())
+
+
+def product_tags_text(product):
+    return ' '.join(f'{tag.name} {tag.slug}' for tag in product.tags.all())
+
+
+class BaseSearchBackend:
+    """
+    Базовый класс поискового бэкенда по товарам.
+    Индекс содержит название, теги и описание товара и обновляется инкрементально
+    сигналами при изменении Product и его тегов.
+    """
+
+    @property
+    def limit(self):
+        # Наибольшее число результатов поиска; каталог показывает, что выдача обрезана
+        return settings.SEARCH_RESULTS_LIMIT
+
+    def setup(self):
+        """
+        Создаёт хранилище индекса, если его ещё нет
+        """
+
+    def index_products(self, products):
+        raise NotImplementedError
+
+    def remove_products(self, product_ids):
+        raise NotImplementedError
+
+    def search(self, query, limit=None):
+        """
+        Возвращает список id товаров, упорядоченный по релевантности,
+        не длиннее limit (по умолчанию - настройки SEARCH_RESULTS_LIMIT)
+        """
+
+        raise NotImplementedError
+
+    def rebuild(self):
+        self.setup()
+        products = Product.objects.prefetch_related('tags')
+        self.remove_products(None)
+        self.index_products(products)
+        return len(products)
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    """
+    Запасной бэкенд без индекса: поиск через LIKE по полям товара
+    """
+
+    def index_products(self, products):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def search(self, query, limit=None):
+        condition = Q()
+        for word in split_words(query):
+            condition &= (
+                Q(name__icontains=word) | Q(description__icontains=word) | Q(tags__name__icontains=word)
+            )
+        return list(
+            Product.objects.filter(condition).order_by('name').values_list('id', flat=True).distinct()[:limit or self.limit]
+        )
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Бэкенд для PostgreSQL: tsvector с весами (название > теги > описание) и GIN-индекс.
+    Ранжирование - ts_rank.
+    """
+
+    table = 'shop_product_search'
+
+    @property
+    def config(self):
+        return getattr(settings, 'SEARCH_CONFIG', 'russian')
+
+    def setup(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.table} ('
+                f'product_id bigint PRIMARY KEY REFERENCES {Product._meta.db_table} (id) ON DELETE CASCADE, '
+                f'document tsvector NOT NULL)'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {self.table}_document_gin ON {self.table} USING GIN (document)'
+            )
+
+    def index_products(self, products):
+        rows = [
+            (product.pk, product.name, product_tags_text(product), product.description or '')
+            for product in products
+        ]
+        if not rows:
+            return
+        document = (
+            "setweight(to_tsvector(%s::regconfig, %s), 'A') || "
+            "setweight(to_tsvector(%s::regconfig, %s), 'B') || "
+            "setweight(to_tsvector(%s::regconfig, %s), 'C')"
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {self.table} (product_id, document) VALUES (%s, {document}) '
+                f'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document',
+                [
+                    (pk, self.config, name, self.config, tags, self.config, description)
+                    for pk, name, tags, description in rows
+                ],
+            )
+
+    def remove_products(self, product_ids):
+        with connection.cursor() as cursor:
+            if product_ids is None:
+                cursor.execute(f'DELETE FROM {self.table}')
+            else:
+                cursor.execute(f'DELETE FROM {self.table} WHERE product_id = ANY(%s)', [list(product_ids)])
+
+    def search(self, query, limit=None):
+        words = split_words(query)
+        if not words:
+            return []
+        # Каждое слово ищется как префикс, чтобы поиск работал по мере ввода
+        ts_query = ' & '.join(f'{word}:*' for word in words)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT product_id FROM {self.table}, to_tsquery(%s::regconfig, %s) query '
+                f'WHERE document @@ query ORDER BY ts_rank(document, query) DESC, product_id LIMIT %s',
+                [self.config, ts_query, limit or self.limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    Бэкенд для локальной разработки на SQLite: виртуальная таблица FTS5,
+    rowid которой совпадает с id товара. Ранжирование - bm25 с весами колонок.
+    """
+
+    table = 'shop_product_fts'
+
+    def setup(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} '
+                f"USING fts5(name, tags, description, tokenize='unicode61 remove_diacritics 2')"
+            )
+
+    def index_products(self, products):
+        rows = [
+            (product.pk, product.name, product_tags_text(product), product.description or '')
+            for product in products
+        ]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, name, tags, description) VALUES (%s, %s, %s, %s)',
+                rows,
+            )
+
+    def remove_products(self, product_ids):
+        with connection.cursor() as cursor:
+            if product_ids is None:
+                cursor.execute(f'DELETE FROM {self.table}')
+            else:
+                cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+    def search(self, query, limit=None):
+        words = split_words(query)
+        if not words:
+            return []
+        match = ' '.join(f'"{word}"*' for word in words)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s '
+                f'ORDER BY bm25({self.table}, 10.0, 5.0, 1.0), rowid LIMIT %s',
+                [match, limit or self.limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+VENDOR_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    """
+    Возвращает поисковый бэкенд: класс из настройки SEARCH_BACKEND
+    или бэкенд, подходящий для используемой базы данных.
+    """
+
+    backend_path = getattr(settings, 'SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    return VENDOR_BACKENDS.get(connection.vendor, SimpleSearchBackend)()
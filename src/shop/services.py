@@ -3,12 +3,35 @@ import json
 import logging
 import os
 import shutil
+import threading
+from contextlib import contextmanager
 
 from django.conf import settings
 from django.core.cache import cache
-from django.db.models import Count
+from django.db import transaction
+from django.db.models import Count, Max, Min
 
-from .models import Category, Product, Seller, SellerProduct
+from .cache_keys import invalidate, make_key
+from .facets import defer_facet_updates
+from .memoize import memoize
+from .models import (CatalogListing, Category, Product, Seller,
+                     SellerProduct, SiteSettings)
+
+
+class PriceBoundsState(threading.local):
+    """
+    Отложенные пересчёты границ цен в текущем потоке: deferred - пути внутри
+    defer_price_bounds_refresh() (depth - глубина вложенности блоков),
+    pending - пути, ожидающие фиксации транзакции
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.deferred = set()
+        self.pending = set()
+
+
+price_bounds_state = PriceBoundsState()
 
 
 def setup_logger(name, log_dir, log_file, level=logging.INFO):
@@ -42,38 +65,40 @@ def import_seller_products(import_file_path):
         logger.error(f'Ошибка декодирования JSON из файла {import_file_path}.')
         return
 
-    for item in import_data:
-        try:
-            seller = Seller.objects.get(id=item['seller_id'])
-            product = Product.objects.get(id=item['product_id'])
-            price = item['price']
-            quantity = item['quantity']
-            created_at = item['created_at']
-
-            seller_product = SellerProduct(
-                seller=seller,
-                product=product,
-                price=price,
-                quantity=quantity,
-                created_at=created_at,
-            )
-            seller_product.save()
-            logger.info(f'Продукт {product} успешно импортирован.')
-        except Seller.DoesNotExist:
-            logger.error(f"Продавец с ID {item['seller_id']} не найден.")
-            import_successful = False
-        except Product.DoesNotExist:
-            logger.error(f"Продукт с ID {item['product_id']} не найден.")
-            import_successful = False
-        except KeyError as e:
-            logger.error(f"Отсутствует ключ {e} в данных: {item}")
-            import_successful = False
-        except Exception as e:
-            logger.error(f"Неизвестная ошибка при импорте продукта: {e}")
-            import_successful = False
-
-        successful_imports_dir = os.path.join(settings.BASE_DIR, 'successful_imports')
-        failed_imports_dir = os.path.join(settings.BASE_DIR, 'failed_imports')
+    # Границы цен и сводки фасетов обновляются один раз после импорта, а не на каждый товар
+    with defer_price_bounds_refresh(), defer_facet_updates():
+        for item in import_data:
+            try:
+                seller = Seller.objects.get(id=item['seller_id'])
+                product = Product.objects.get(id=item['product_id'])
+                price = item['price']
+                quantity = item['quantity']
+                created_at = item['created_at']
+
+                seller_product = SellerProduct(
+                    seller=seller,
+                    product=product,
+                    price=price,
+                    quantity=quantity,
+                    created_at=created_at,
+                )
+                seller_product.save()
+                logger.info(f'Продукт {product} успешно импортирован.')
+            except Seller.DoesNotExist:
+                logger.error(f"Продавец с ID {item['seller_id']} не найден.")
+                import_successful = False
+            except Product.DoesNotExist:
+                logger.error(f"Продукт с ID {item['product_id']} не найден.")
+                import_successful = False
+            except KeyError as e:
+                logger.error(f"Отсутствует ключ {e} в данных: {item}")
+                import_successful = False
+            except Exception as e:
+                logger.error(f"Неизвестная ошибка при импорте продукта: {e}")
+                import_successful = False
+
+            successful_imports_dir = os.path.join(settings.BASE_DIR, 'successful_imports')
+            failed_imports_dir = os.path.join(settings.BASE_DIR, 'failed_imports')
 
     if import_successful:
         shutil.move(import_file_path, os.path.join(successful_imports_dir, os.path.basename(import_file_path)))
@@ -81,61 +106,148 @@ def import_seller_products(import_file_path):
         shutil.move(import_file_path, os.path.join(failed_imports_dir, os.path.basename(import_file_path)))
 
 
+@memoize('categories')
 def get_cached_categories():
-    cache_key = 'categories'
-    categories = cache.get(cache_key)
-    if categories is None:
-        # Получаем категории через связь Product
-        categories = Category.objects.filter(
-            id__in=SellerProduct.objects.values_list('product__category_id', flat=True)
-        ).distinct()
+    # Пути категорий, в которых есть товары продавцов
+    paths = (
+        Category.objects
+        .filter(products__seller_products__isnull=False)
+        .values_list('path', flat=True)
+        .distinct()
+    )
+
+    # Вместе с ними выводятся все их предки: id предков берутся из путей,
+    # поэтому число запросов не зависит от глубины дерева
+    category_ids = {int(pk) for path in paths for pk in path.split('/') if pk}
+    return list(Category.objects.filter(id__in=category_ids).prefetch_related('children'))
 
-        # Добавляем родительские категории
-        parent_categories = Category.objects.filter(
-            id__in=categories.values_list('parent_id', flat=True)
-        ).distinct()
 
-        # Объединяем два QuerySet
-        categories = categories | parent_categories
-        categories = categories.distinct()
+@memoize('products')
+def get_cached_products():
+    return list(SellerProduct.objects.all())
 
-        # Кэшируем результат
-        cache.set(cache_key, categories, settings.DEFAULT_CACHE_TIME)
-    return categories
 
+@memoize('site_settings')
+def get_site_settings():
+    return SiteSettings.objects.first() or SiteSettings()
 
-def get_cached_products():
-    cache_key = 'products'
-    products = cache.get(cache_key)
-    if products is None:
 
-        products = SellerProduct.objects.all()
+@memoize('popular')
+def get_cached_popular_products():
+    count = get_site_settings().popular_products_count_on_main_page
+    # Индексированная выборка по счётчику продаж вместо сортировки всей таблицы
+    return list(
+        SellerProduct.objects.select_related('product__category').order_by('-sales_count', 'pk')[:count]
+    )
+
+
+@memoize('popular_categories')
+def get_popular_categories():
+    return list(
+        Category.objects
+        .annotate(
+            product_count=Count('products'),
+            min_price=Min('products__seller_products__price')
+        )
+        .order_by('-product_count')[:3]
+    )
+
+
+@memoize('limited')
+def get_limited_products():
+    return list(SellerProduct.objects.filter(is_limited=True).select_related('product__category')[:16])
 
-        cache.set(cache_key, products, settings.DEFAULT_CACHE_TIME)
 
-    return products
+def get_price_bounds_cache_key(category_path):
+    category_id = category_path.rstrip('/').rsplit('/', 1)[-1] if category_path else 'all'
+    return make_key('price_bounds', category_id)
 
 
-def get_cached_popular_products():
-    cache_key = 'popular_products'
-    popular_products = cache.get(cache_key)
+def calculate_price_bounds(category_path=None):
+    listings = CatalogListing.objects.all()
+    if category_path:
+        listings = listings.filter(category_path__startswith=category_path)
+    prices = listings.aggregate(Min('price'), Max('price'))
+    return prices['price__min'], prices['price__max']
 
-    if popular_products is None:
-        product_sales = SellerProduct.objects.annotate(total_sales=Count('order_items'))
 
-        popular_products = sorted(product_sales, key=lambda p: p.total_sales, reverse=True)[:8]
+def get_category_price_bounds(category_path=None):
+    """
+    Возвращает (минимальная цена, максимальная цена) товаров категории с путём
+    category_path, включая дочерние категории, или всего каталога.
+    Значения хранятся в кэше и обновляются при изменении цен.
+    """
 
-        cache.set(cache_key, popular_products, settings.DEFAULT_CACHE_TIME)
+    cache_key = get_price_bounds_cache_key(category_path)
+    bounds = cache.get(cache_key)
+    if bounds is None:
+        bounds = calculate_price_bounds(category_path)
+        cache.set(cache_key, bounds, settings.DEFAULT_CACHE_TIME)
+    return bounds
 
-    return popular_products
 
+def recalculate_price_bounds(category_paths):
+    """
+    Пересчитывает границы цен для категорий, всех их предков и всего каталога:
+    каждая категория считается один раз, даже если входит в несколько путей.
+    """
 
-def get_limited_products():
-    cache_key = 'limited_products'
-    limited_products = cache.get(cache_key)
+    paths = {None}
+    for category_path in category_paths:
+        parts = [part for part in category_path.split('/') if part]
+        paths.update('/'.join(parts[:index]) + '/' for index in range(1, len(parts) + 1))
+    cache.set_many(
+        {get_price_bounds_cache_key(path): calculate_price_bounds(path) for path in paths},
+        settings.DEFAULT_CACHE_TIME,
+    )
 
-    if limited_products is None:
-        limited_products = SellerProduct.objects.filter(is_limited=True)[:16]
-        cache.set(cache_key, limited_products, settings.DEFAULT_CACHE_TIME)
 
-    return limited_products
+def flush_pending_price_bounds():
+    category_paths, price_bounds_state.pending = price_bounds_state.pending, set()
+    if category_paths:
+        recalculate_price_bounds(category_paths)
+
+
+def refresh_price_bounds(*category_paths):
+    """
+    Запрашивает пересчёт границ цен для категорий, их предков и всего каталога.
+    Внутри defer_price_bounds_refresh() пересчёт откладывается до выхода из блока,
+    иначе - до фиксации транзакции; все запросы транзакции пересчитываются вместе.
+    """
+
+    if not category_paths:
+        return
+    if price_bounds_state.depth:
+        price_bounds_state.deferred.update(category_paths)
+        return
+    price_bounds_state.pending.update(category_paths)
+    # Первый выполненный обработчик пересчитывает все накопленные пути, остальные ничего не делают
+    transaction.on_commit(flush_pending_price_bounds)
+
+
+def reset_price_bounds():
+    """
+    Сбрасывает границы цен всех категорий (например, при изменении дерева категорий)
+    """
+
+    invalidate('price_bounds')
+
+
+@contextmanager
+def defer_price_bounds_refresh():
+    """
+    Контекстный менеджер для массового импорта: границы цен каждой затронутой
+    категории пересчитываются один раз после завершения блока.
+    """
+
+    depth = price_bounds_state.depth
+    # Вложенные блоки продолжают копить пути внешнего, пересчёт - при выходе из внешнего
+    price_bounds_state.depth = depth + 1
+    try:
+        yield
+    finally:
+        price_bounds_state.depth = depth
+        if not depth:
+            category_paths, price_bounds_state.deferred = price_bounds_state.deferred, set()
+            if category_paths:
+                recalculate_price_bounds(category_paths)
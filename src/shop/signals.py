@@ -1,42 +1,214 @@
 from django.contrib.auth.signals import user_logged_in
-from django.core.cache import cache
-from django.db.models.signals import post_delete, post_save
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_migrate,
+                                      post_save)
 from django.dispatch import receiver
+from taggit.models import Tag
 
-from shop.utils import clear_session_cart, get_cart_from_session
+from shop.cache_keys import invalidate
+from shop.cart import get_cart, rebuild_cart_totals
+from shop.catalog import (rebuild_category_tree, refresh_catalog_listing,
+                          refresh_category_listing, refresh_product_listing,
+                          refresh_seller_product_listing, update_sales_count)
+from shop.facets import reset_facet_summaries, update_facet_summaries
+from shop.reviews import update_review_count
+from shop.search import get_search_backend
+from shop.services import refresh_price_bounds, reset_price_bounds
+from shop.snapshots import invalidate_product_snapshots
+from shop.tags import reset_tag_index, update_product_tags
 
-from .models import Cart, Category, Product, SellerProduct
+from .models import (Cart, CartItem, CatalogListing, Category, Product,
+                     ProductAttribute, Review, Seller, SellerProduct,
+                     SiteSettings)
 
 
 @receiver(signal=post_save, sender=Category)
 @receiver(signal=post_delete, sender=Category)
 def clear_menu_cache(sender, **kwargs):
-    cache.delete('categories')
+    # Название категории входит в снимки страниц товаров, дерево категорий - в индекс скидок на наборы
+    invalidate('categories', 'popular_categories', 'product', 'pages', 'discounts')
 
 
 @receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
 def reset_cache(sender, instance, **kwargs):
-    cache.delete('product_cache_key')
+    invalidate_product_snapshots([instance.pk])
+    invalidate('popular_categories')
 
 
 @receiver(post_save, sender=SellerProduct)
 @receiver(post_delete, sender=SellerProduct)
-def clear_product_cache(sender, **kwargs):
-    cache.delete('products')
+def clear_product_cache(sender, instance, **kwargs):
+    invalidate_product_snapshots([instance.product_id])
+    # Меню показывает только категории, в которых есть предложения продавцов
+    invalidate('products', 'categories')
+
+
+@receiver(post_save, sender=SiteSettings)
+def clear_site_settings_cache(sender, **kwargs):
+    invalidate('site_settings', 'popular', 'pages')
+
+
+@receiver(post_save, sender=Seller)
+def clear_seller_product_snapshots(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_product_snapshots(instance.products.values_list('product_id', flat=True))
+
+
+@receiver(post_save, sender=ProductAttribute)
+@receiver(post_delete, sender=ProductAttribute)
+def clear_attribute_product_snapshot(sender, instance, **kwargs):
+    invalidate_product_snapshots([instance.product_id])
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def update_product_review_count(sender, instance, signal, created=False, origin=None, raw=False, **kwargs):
+    if raw or (signal is post_save and not created):
+        return
+    # Вместе с товаром удаляются и его отзывы, и записи витрины
+    if getattr(origin, 'model', type(origin)) in (Category, Product):
+        return
+    update_review_count(instance.product_id, -1 if signal is post_delete else 1)
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def clear_tags_product_snapshot(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Product):
+        invalidate_product_snapshots([instance.pk])
 
 
 @receiver(post_save, sender=SellerProduct)
 @receiver(post_delete, sender=SellerProduct)
 def clear_popular_product_cache(sender, **kwargs):
-    cache.delete('popular_products')
+    invalidate('popular', 'popular_categories', 'limited')
+
+
+def is_catalog_cascade(origin):
+    """
+    Проверяет, вызвано ли удаление каскадом от удаления товара или категории:
+    в этом случае записи витрины будут удалены вместе с ними.
+    """
+
+    model = getattr(origin, 'model', type(origin))
+    return model in (Category, Product, SellerProduct)
+
+
+@receiver(post_save, sender=SellerProduct)
+def update_seller_product_listing(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_seller_product_listing(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def update_product_listing(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_product_listing(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def update_category_listing(sender, instance, created=False, raw=False, **kwargs):
+    # У новой категории ещё нет ни товаров, ни дочерних категорий
+    if not raw and not created:
+        refresh_category_listing(instance.path)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def reset_category_facets(sender, raw=False, **kwargs):
+    if not raw:
+        reset_facet_summaries()
+        reset_price_bounds()
+
+
+@receiver(post_delete, sender=CatalogListing)
+def remove_listing_facets(sender, instance, **kwargs):
+    update_facet_summaries(removed=[instance])
+    refresh_price_bounds(instance.category_path)
+
+
+@receiver(post_save, sender='orders.OrderItem')
+@receiver(post_delete, sender='orders.OrderItem')
+def update_order_item_sales_count(sender, instance, signal, created=False, origin=None, raw=False, **kwargs):
+    if raw or (signal is post_save and not created):
+        return
+    # При удалении предложения продавца счётчик товара всё равно нужно уменьшить
+    if getattr(origin, 'model', type(origin)) in (Category, Product):
+        return
+    update_sales_count(instance.seller_product_id, -1 if signal is post_delete else 1)
+    invalidate('popular')
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def update_tags_listing(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Product):
+        refresh_product_listing(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        get_search_backend().index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    get_search_backend().remove_products([instance.pk])
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def update_tags_search_index(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Product):
+        get_search_backend().index_products([instance])
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def update_product_tag_index(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Product):
+        update_product_tags(instance.pk, instance.tags.values_list('slug', 'name'))
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_tag_index(sender, instance, **kwargs):
+    update_product_tags(instance.pk)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def reset_tag_index_on_tag_change(sender, raw=False, **kwargs):
+    if not raw:
+        reset_tag_index()
+
+
+@receiver(post_delete, sender=CartItem)
+def remove_cart_item_from_totals(sender, instance, **kwargs):
+    # Срабатывает и при каскадном удалении позиций вместе с товаром продавца
+    Cart.objects.filter(pk=instance.cart_id).update(
+        quantity_total=F('quantity_total') - instance.quantity,
+        price_total=F('price_total') - instance.price * instance.quantity,
+    )
 
 
 @receiver(user_logged_in)
 def merge_carts(sender, user, request, **kwargs):
-    session_cart = get_cart_from_session(request)
+    get_cart(request, user).merge_anonymous_cart()
+
+
+@receiver(post_migrate)
+def backfill_category_paths(sender, **kwargs):
+    # Категории, созданные до появления материализованных путей, получают пути сразу после миграции
+    if sender.label == 'shop' and Category.objects.filter(path='').exists():
+        rebuild_category_tree()
+        refresh_catalog_listing()
+        invalidate('categories', 'facets', 'price_bounds', 'pages')
 
-    user_cart, created = Cart.objects.get_or_create(user=user)
 
-    for item in session_cart:
-        user_cart.add_product(item.product, item.quantity)
-    clear_session_cart(request)
+@receiver(post_migrate)
+def backfill_cart_totals(sender, **kwargs):
+    # Корзины, созданные до появления хранимых итогов, получают их сразу после миграции.
+    # Пересчитываются только корзины с позициями, но без итогов; остальное сверяет rebuild_counters
+    if sender.label != 'shop':
+        return
+    unfilled = Cart.objects.filter(quantity_total=0, pk__in=CartItem.objects.values('cart_id'))
+    if unfilled.exists():
+        rebuild_cart_totals(queryset=unfilled)
@@ -0,0 +1,179 @@
+import pickle
+from decimal import ROUND_HALF_UP, Decimal
+from typing import NamedTuple, Optional
+
+from django.core.cache import cache
+from django.shortcuts import get_object_or_404
+
+from .cache_keys import invalidate, make_key
+from .memoize import memoize
+from .models import Product
+
+# Версия схемы снимка: при изменении состава полей её нужно увеличить,
+# тогда снимки старого формата будут считаться промахом и перестроятся
+SCHEMA_VERSION = 3
+REVIEWS_PER_PAGE = 3
+
+
+class OfferSnapshot(NamedTuple):
+    pk: int
+    price: Decimal
+    # Цена со скидкой из EffectivePrice (без скидки совпадает с price)
+    discounted_price: Decimal
+    free_delivery: bool
+    seller_name: str
+    seller_thumbnail_url: Optional[str]
+
+
+class ReviewSnapshot(NamedTuple):
+    text: str
+    created_at: object
+    author_name: str
+    author_avatar_url: Optional[str]
+
+
+class ProductSnapshot(NamedTuple):
+    """
+    Снимок страницы товара: всё, что нужно шаблону, без обращений к базе
+    """
+
+    pk: int
+    name: str
+    description: str
+    preview_url: Optional[str]
+    category_name: str
+    tags: tuple
+    attributes: tuple
+    review_count: int
+    offers: tuple
+    average_price: Decimal
+    min_price_id: Optional[int]
+    reviews: tuple
+    # Последнее изменение товара, его предложений и отзывов (для Last-Modified)
+    modified_at: object
+
+
+def file_url(file):
+    return file.url if file else None
+
+
+def build_review_snapshot(review):
+    return ReviewSnapshot(
+        text=review.text,
+        created_at=review.created_at,
+        author_name=review.author.get_full_name(),
+        author_avatar_url=file_url(review.author.avatar),
+    )
+
+
+def build_product_snapshot(product_id):
+    product = get_object_or_404(
+        Product.objects.select_related('category').prefetch_related('tags'),
+        pk=product_id,
+    )
+    # Импорт внутри функции: модуль скидок сам зависит от моделей и кэша магазина
+    from discounts.services import get_discounted_prices
+
+    seller_products = list(product.seller_products.select_related('seller').order_by('pk'))
+    discounted_prices = get_discounted_prices(seller_products)
+    offers = tuple(
+        OfferSnapshot(
+            pk=seller_product.pk,
+            price=seller_product.price,
+            discounted_price=discounted_prices[seller_product.pk][0],
+            free_delivery=seller_product.free_delivery,
+            seller_name=seller_product.seller.name,
+            seller_thumbnail_url=file_url(seller_product.seller.thumbnail),
+        )
+        for seller_product in seller_products
+    )
+    average_price = Decimal(0)
+    min_price_id = None
+    if offers:
+        average_price = (sum(offer.discounted_price for offer in offers) / len(offers)).quantize(
+            Decimal('0.00'), rounding=ROUND_HALF_UP
+        )
+        min_price_id = min(offers, key=lambda offer: offer.discounted_price).pk
+
+    return ProductSnapshot(
+        pk=product.pk,
+        name=product.name,
+        description=product.description or '',
+        preview_url=file_url(product.preview),
+        category_name=product.category.name,
+        tags=tuple(tag.name for tag in product.tags.all()),
+        attributes=tuple(
+            (attribute.attribute.name, attribute.value)
+            for attribute in product.attributes.select_related('attribute')
+        ),
+        review_count=product.review_count,
+        offers=offers,
+        average_price=average_price,
+        min_price_id=min_price_id,
+        reviews=tuple(
+            build_review_snapshot(review)
+            for review in product.reviews.select_related('author')[:REVIEWS_PER_PAGE]
+        ),
+        modified_at=max(
+            stamp
+            for stamp in [product.updated_at, product.last_review_at, *(sp.updated_at for sp in seller_products)]
+            if stamp is not None
+        ),
+    )
+
+
+def encode_snapshot(snapshot):
+    """
+    Компактное бинарное представление: байт версии схемы и pickle из простых кортежей
+    (без ссылок на классы снимков, поэтому переименование классов не ломает кэш)
+    """
+
+    data = (
+        *snapshot[:8],
+        tuple(tuple(offer) for offer in snapshot.offers),
+        snapshot.average_price,
+        snapshot.min_price_id,
+        tuple(tuple(review) for review in snapshot.reviews),
+        snapshot.modified_at,
+    )
+    return bytes([SCHEMA_VERSION]) + pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def decode_snapshot(data):
+    if not data or data[0] != SCHEMA_VERSION:
+        return None
+    fields = pickle.loads(data[1:])
+    return ProductSnapshot(
+        *fields[:8],
+        tuple(OfferSnapshot(*offer) for offer in fields[8]),
+        *fields[9:11],
+        tuple(ReviewSnapshot(*review) for review in fields[11]),
+        fields[12],
+    )
+
+
+@memoize('product')
+def get_encoded_product_snapshot(product_id):
+    return encode_snapshot(build_product_snapshot(product_id))
+
+
+def get_product_snapshot(product_id):
+    """
+    Возвращает снимок страницы товара из кэша, при промахе строит и сохраняет его
+    """
+
+    snapshot = decode_snapshot(get_encoded_product_snapshot(product_id))
+    if snapshot is None:
+        # Снимок старой версии схемы
+        snapshot = decode_snapshot(get_encoded_product_snapshot.refresh(product_id))
+    return snapshot
+
+
+def invalidate_product_snapshots(product_ids):
+    """
+    Удаляет снимки товаров; следующий запрос страницы построит их заново.
+    Товар выводится и в каталоге, и на главной, поэтому сбрасывается и кэш страниц целиком.
+    """
+
+    cache.delete_many([make_key('product', product_id) for product_id in product_ids])
+    invalidate('pages')
@@ -0,0 +1,100 @@
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from taggit.models import TaggedItem
+
+from .cache_keys import invalidate, make_key
+from .memoize import single_flight
+from .models import Product
+
+TAGS_LOCK_TIMEOUT = 30
+
+
+def build_tag_index():
+    """
+    Строит индекс тегов товаров одним запросом к таблицам taggit:
+    {slug: (название, отсортированный список id товаров)}
+    """
+
+    index = {}
+    tagged_items = (
+        TaggedItem.objects
+        .filter(content_type=ContentType.objects.get_for_model(Product))
+        .order_by('object_id')
+        .values_list('tag__slug', 'tag__name', 'object_id')
+    )
+    for slug, name, product_id in tagged_items:
+        index.setdefault(slug, (name, []))[1].append(product_id)
+    return index
+
+
+def get_tag_index():
+    index = cache.get(make_key('tags'))
+    if index is None:
+        index = build_tag_index()
+        cache.set(make_key('tags'), index, settings.DEFAULT_CACHE_TIME)
+    return index
+
+
+def get_tag_cloud():
+    """
+    Возвращает теги, упорядоченные по числу товаров: [{'slug', 'name', 'count'}]
+    """
+
+    cloud = [
+        {'slug': slug, 'name': name, 'count': len(product_ids)}
+        for slug, (name, product_ids) in get_tag_index().items()
+    ]
+    return sorted(cloud, key=lambda tag: (-tag['count'], tag['name']))
+
+
+def get_tagged_product_ids(slugs, mode='and'):
+    """
+    Возвращает множество id товаров, у которых есть все (mode='and')
+    или хотя бы один (mode='or') из тегов slugs. Теги сравниваются точно.
+    """
+
+    index = get_tag_index()
+    id_sets = [set(index[slug][1]) if slug in index else set() for slug in slugs]
+    if not id_sets:
+        return set()
+    if mode == 'or':
+        return set().union(*id_sets)
+    return set.intersection(*id_sets)
+
+
+def update_product_tags(product_id, tags=()):
+    """
+    Инкрементально обновляет закэшированный индекс: убирает товар из всех тегов
+    и добавляет в переданные tags [(slug, название)]. Незакэшированный индекс
+    будет построен при первом обращении. Чтение и запись индекса выполняются
+    под блокировкой, а если её держит другой процесс, индекс сбрасывается.
+    """
+
+    with single_flight('tags:update', TAGS_LOCK_TIMEOUT) as acquired:
+        if acquired:
+            apply_product_tags(product_id, tags)
+            return
+    invalidate('tags')
+
+
+def apply_product_tags(product_id, tags):
+    index = cache.get(make_key('tags'))
+    if index is None:
+        return
+
+    for slug, (name, product_ids) in list(index.items()):
+        position = bisect_left(product_ids, product_id)
+        if position < len(product_ids) and product_ids[position] == product_id:
+            del product_ids[position]
+            if not product_ids:
+                del index[slug]
+    for slug, name in tags:
+        insort(index.setdefault(slug, (name, []))[1], product_id)
+    cache.set(make_key('tags'), index, settings.DEFAULT_CACHE_TIME)
+
+
+def reset_tag_index():
+    invalidate('tags')
@@ -0,0 +1,36 @@
+from celery import shared_task
+
+from shop.cart_redis import flush_dirty_carts
+from shop.catalog import refresh_catalog_listing
+from shop.warmup import warm_cache as warm_cache_steps
+
+
+@shared_task
+def rebuild_catalog_listing():
+    """
+    Фоновая задача: полностью перестраивает витрину каталога (CatalogListing)
+    """
+
+    return refresh_catalog_listing()
+
+
+@shared_task(bind=True)
+def warm_cache(self, product_limit=None):
+    """
+    Фоновая задача: прогрев кэша после деплоя или сброса.
+    Ход выполнения доступен в состоянии задачи (PROGRESS).
+    """
+
+    def progress(step, done, total):
+        self.update_state(state='PROGRESS', meta={'step': step, 'done': done, 'total': total})
+
+    return warm_cache_steps(product_limit=product_limit, progress=progress)
+
+
+@shared_task
+def flush_carts():
+    """
+    Фоновая задача: записывает в базу корзины, изменённые в Redis (RedisCartBackend)
+    """
+
+    return flush_dirty_carts()
@@ -1,3 +1,1275 @@
-from django.test import TestCase
+import time
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib import admin, messages
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import DatabaseError, connection, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.formats import localize
+
+from banners.models import Banner
+from banners.services import get_active_banners
+from orders.models import Order, OrderItem
+from shop.cache_keys import get_version, make_key
+from shop.cache_metrics import get_cache_metrics, reset_cache_metrics
+from shop.local_cache import (MISSING, LocalCache, get_tier_stats,
+                              handle_invalidation, local_cache)
+from shop.memoize import memoize
+from shop.admin import CartItemAdmin
+from shop.models import (Cart, CartItem, CatalogListing, Category, HistoryProduct,
+                         Product, Review, Seller, SellerProduct)
+from shop.cart import DatabaseCartBackend, get_cart, rebuild_cart_totals
+from shop.cart_redis import DIRTY_CARTS_KEY, flush_dirty_carts
+from shop.catalog import rebuild_sales_counts
+from shop.context_processors import info_cart
+from shop.facets import (compute_facets, defer_facet_updates,
+                         flush_pending_facet_summaries, get_facet_summary)
+from shop.page_cache import is_cacheable
+from shop.paginator import CursorPaginator
+from shop.reviews import (add_review, delete_reviews, rebuild_review_stats,
+                          update_review_count)
+from shop.search import get_search_backend
+from shop.signals import backfill_cart_totals, backfill_category_paths
+from shop.snapshots import (decode_snapshot, encode_snapshot,
+                            get_product_snapshot)
+from shop.services import (defer_price_bounds_refresh, flush_pending_price_bounds,
+                           get_cached_categories,
+                           get_cached_popular_products,
+                           get_category_price_bounds)
+from shop.tags import get_tag_cloud, get_tag_index, get_tagged_product_ids
+from shop.tasks import flush_carts
+from shop.views import ProductDetailView
+from shop.warmup import get_products_by_recent_views, warm_cache
+
+User = get_user_model()
+
+
+class FakeRedis:
+    """
+    Соединение Redis в памяти с командами, которые использует корзина (shop.cart_redis):
+    хэши и множества, значения возвращаются байтами, пустые ключи удаляются
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def hgetall(self, key):
+        return {field.encode(): value.encode() for field, value in self.data.get(key, {}).items()}
+
+    def hset(self, key, field, value):
+        self.data.setdefault(key, {})[field] = str(value)
+
+    def hsetnx(self, key, field, value):
+        if field in self.data.get(key, {}):
+            return 0
+        self.hset(key, field, value)
+        return 1
+
+    def hincrby(self, key, field, amount):
+        self.hset(key, field, int(self.data.get(key, {}).get(field, 0)) + amount)
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self.data.get(key, {}).pop(field, None)
+        if not self.data.get(key):
+            self.data.pop(key, None)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def expire(self, key, timeout):
+        pass
+
+    def sadd(self, key, *members):
+        self.data.setdefault(key, set()).update(
+            member if isinstance(member, bytes) else str(member).encode() for member in members
+        )
+
+    def srem(self, key, *members):
+        self.data.get(key, set()).difference_update(str(member).encode() for member in members)
+
+    def spop(self, key, count):
+        members = self.data.get(key, set())
+        return [members.pop() for _ in range(min(count, len(members)))]
+
+
+class FakePipeline:
+    def __init__(self, connection):
+        self.connection = connection
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((getattr(self.connection, name), args))
+
+    def execute(self):
+        return [command(*args) for command, args in self.commands]
+
+
+class ShopTestMixin:
+    """
+    Общие данные для тестов магазина: продавец, категории и товары
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='seller',
+            email='seller@example.com',
+            password='testpassword'
+        )
+        self.seller = Seller.objects.create(
+            user=self.user,
+            name='Seller',
+            email='seller@example.com',
+            phone='89999999999',
+            address='Address',
+        )
+        self.category = Category.objects.create(name='Электроника')
+        self.child_category = Category.objects.create(name='Телевизоры', parent=self.category)
+        self.product = Product.objects.create(name='Телевизор', category=self.child_category)
+        self.seller_product = SellerProduct.objects.create(
+            seller=self.seller,
+            product=self.product,
+            price=Decimal('100.00'),
+            quantity=5,
+        )
+
+
+class CatalogListingTests(ShopTestMixin, TestCase):
+
+    def test_listing_created_with_seller_product(self):
+        """
+        Проверяем, что при создании SellerProduct появляется запись витрины
+        """
+        listing = CatalogListing.objects.get(pk=self.seller_product.pk)
+        self.assertEqual(listing.name, 'Телевизор')
+        self.assertEqual(listing.category_name, 'Телевизоры')
+        self.assertEqual(listing.category_path, f'{self.category.pk}/{self.child_category.pk}/')
+        self.assertEqual(listing.price, Decimal('100.00'))
+        self.assertTrue(listing.in_stock)
+
+    def test_listing_follows_changes(self):
+        """
+        Проверяем, что изменения товара, тегов, отзывов и продаж попадают в витрину
+        """
+        self.product.name = 'Новый телевизор'
+        self.product.save()
+        self.product.tags.add('smart-tv')
+        add_review(Review(product=self.product, author=self.user, text='Отличный'))
+        order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=order, seller_product=self.seller_product, quantity=1)
+
+        listing = CatalogListing.objects.get(pk=self.seller_product.pk)
+        self.assertEqual(listing.name, 'Новый телевизор')
+        self.assertEqual(listing.tag_slugs, ',smart-tv,')
+        self.assertEqual(listing.review_count, 1)
+        self.assertEqual(listing.sales_count, 1)
+
+    def test_catalog_reads_from_listing(self):
+        """
+        Проверяем, что каталог родительской категории показывает товары дочерних категорий
+        """
+        response = self.client.get(reverse('shop:catalog_products_list', args=[self.category.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['products']), [CatalogListing.objects.get()])
+        self.assertContains(response, 'Телевизор')
+
+
+class CursorPaginationTests(ShopTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        for price in [50, 50, 50, 70, 10, 30, 30, 90, 20]:
+            SellerProduct.objects.create(seller=self.seller, product=self.product, price=price, quantity=1)
+
+    def test_pages_cover_listing_in_order(self):
+        """
+        Проверяем, что при переходе вперёд и назад товары не теряются и не повторяются
+        """
+        ordering = ('-price', '-pk')
+        queryset = CatalogListing.objects.all()
+        expected = list(queryset.order_by(*ordering))
+        paginator = CursorPaginator(queryset, 3, ordering)
+
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            last = pages[-1].object_list[-1]
+            pages.append(paginator.get_page(paginator.encode_cursor(last, pages[-1].number + 1, False)))
+        self.assertEqual([item for page in pages for item in page], expected)
+        self.assertEqual([page.number for page in pages], [1, 2, 3, 4])
+
+        first = pages[-1].object_list[0]
+        previous = paginator.get_page(paginator.encode_cursor(first, 3, True))
+        self.assertEqual(previous.object_list, pages[2].object_list)
+        self.assertTrue(previous.has_previous())
+
+    @override_settings(CATALOG_PAGINATION_MODE='keyset')
+    def test_catalog_keyset_mode(self):
+        """
+        Проверяем, что каталог в режиме keyset не выполняет COUNT и отдаёт ссылку на следующую страницу
+        """
+        response = self.client.get(reverse('shop:product_list'), {'sort': 'price'})
+        page = response.context['page_obj']
+        self.assertEqual(len(page.object_list), 8)
+        self.assertTrue(page.has_next())
+        self.assertContains(response, 'cursor=')
+
+        response = self.client.get(reverse('shop:product_list') + page.next_url)
+        self.assertEqual(response.context['page_obj'].number, 2)
+        self.assertEqual(len(response.context['page_obj'].object_list), 2)
+
+
+class SearchBackendTests(ShopTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.other_product = Product.objects.create(
+            name='Пылесос',
+            description='Моющий пылесос, подходит к телевизору по цвету',
+            category=self.category,
+        )
+        SellerProduct.objects.create(seller=self.seller, product=self.other_product, price=10, quantity=1)
+
+    def test_search_ranks_title_first(self):
+        """
+        Проверяем, что совпадение в названии ранжируется выше совпадения в описании
+        """
+        self.assertEqual(get_search_backend().search('телев'), [self.product.pk, self.other_product.pk])
+
+    def test_index_follows_tags_and_deletion(self):
+        """
+        Проверяем инкрементальное обновление индекса при изменении тегов и удалении товара
+        """
+        self.other_product.tags.add('robot')
+        self.assertEqual(get_search_backend().search('robot'), [self.other_product.pk])
+        self.other_product.delete()
+        self.assertEqual(get_search_backend().search('robot'), [])
+
+    def test_catalog_title_filter_uses_search(self):
+        """
+        Проверяем, что фильтр по названию в каталоге выдаёт товары в порядке релевантности
+        """
+        response = self.client.get(reverse('shop:product_list'), {'title': 'телевизор', 'price': '0;1000'})
+        self.assertEqual(
+            [listing.product_id for listing in response.context['products']],
+            [self.product.pk, self.other_product.pk],
+        )
+        self.assertFalse(response.context['search_truncated'])
+
+    @override_settings(SEARCH_RESULTS_LIMIT=1)
+    def test_catalog_reports_truncated_search(self):
+        """
+        Проверяем, что выдача, обрезанная настройкой SEARCH_RESULTS_LIMIT, отмечается в каталоге
+        """
+        response = self.client.get(reverse('shop:product_list'), {'title': 'телевизор', 'price': '0;1000'})
+        self.assertEqual([listing.product_id for listing in response.context['products']], [self.product.pk])
+        self.assertTrue(response.context['search_truncated'])
+        self.assertContains(response, 'уточните запрос')
+
+
+class FacetTests(ShopTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.product.tags.add('smart-tv')
+        other_product = Product.objects.create(name='Пылесос', category=self.category)
+        other_product.tags.add('robot')
+        SellerProduct.objects.create(
+            seller=self.seller, product=other_product, price=300, quantity=0, free_delivery=True
+        )
+        # Обработчики on_commit в TestCase не выполняются, сводки обновляются вызовом flush
+        flush_pending_facet_summaries()
+
+    def test_counts_exclude_own_filter(self):
+        """
+        Проверяем, что счётчик фасета учитывает все фильтры, кроме собственного
+        """
+        facets = compute_facets(get_facet_summary(), in_stock=True)
+        self.assertEqual(facets['total'], 1)
+        self.assertEqual(facets['tags'], {'smart-tv': 1})
+        self.assertEqual(facets['in_stock'], 1)
+        self.assertEqual(facets['free_delivery'], 0)
+        self.assertEqual(sum(bucket['count'] for bucket in facets['price_histogram']), 1)
+
+    def test_cached_summary_updated_incrementally(self):
+        """
+        Проверяем, что закэшированная сводка категории обновляется при изменении и удалении товара
+        """
+        category_path = f'{self.category.pk}/'
+        child_path = f'{self.category.pk}/{self.child_category.pk}/'
+        self.assertEqual(len(get_facet_summary(category_path)), 2)
+        self.assertEqual(len(get_facet_summary(child_path)), 1)
+
+        self.seller_product.quantity = 0
+        self.seller_product.save()
+        # До фиксации транзакции закэшированная сводка не меняется
+        self.assertEqual(compute_facets(get_facet_summary(category_path))['in_stock'], 1)
+        flush_pending_facet_summaries()
+        self.assertEqual(compute_facets(get_facet_summary(category_path))['in_stock'], 0)
+
+        self.seller_product.delete()
+        flush_pending_facet_summaries()
+        self.assertEqual(len(get_facet_summary(category_path)), 1)
+        self.assertEqual(len(get_facet_summary(child_path)), 0)
+
+    def test_moved_product_leaves_old_category_summary(self):
+        """
+        Проверяем, что товар, перенесённый в другую категорию, пропадает из сводок прежней
+        """
+        child_path = f'{self.category.pk}/{self.child_category.pk}/'
+        other_category = Category.objects.create(name='Бытовая техника')
+        self.assertEqual(len(get_facet_summary(child_path)), 1)
+        self.assertEqual(len(get_facet_summary(f'{self.category.pk}/')), 2)
+
+        self.product.category = other_category
+        self.product.save()
+        flush_pending_facet_summaries()
+        self.assertEqual(len(get_facet_summary(child_path)), 0)
+        self.assertEqual(len(get_facet_summary(f'{self.category.pk}/')), 1)
+        self.assertEqual(len(get_facet_summary(f'{other_category.pk}/')), 1)
+        self.assertEqual(len(get_facet_summary()), 2)
+
+    def test_rolled_back_and_bulk_changes(self):
+        """
+        Проверяем, что откаченные изменения не попадают в сводки, а массовые
+        изменения записываются в сводку всего каталога один раз
+        """
+        self.assertEqual(len(get_facet_summary()), 2)
+        try:
+            with transaction.atomic():
+                self.seller_product.delete()
+                raise DatabaseError
+        except DatabaseError:
+            pass
+        flush_pending_facet_summaries()
+        self.assertEqual(len(get_facet_summary()), 2)
+
+        with mock.patch('shop.facets.cache.set_many') as set_many, defer_facet_updates():
+            for price in range(3):
+                SellerProduct.objects.create(seller=self.seller, product=self.product, price=price, quantity=1)
+        set_many.assert_not_called()
+        flush_pending_facet_summaries()
+        self.assertEqual(len(get_facet_summary()), 5)
+
+
+class PriceBoundsTests(ShopTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        other_product = Product.objects.create(name='Пылесос', category=self.category)
+        self.other_seller_product = SellerProduct.objects.create(
+            seller=self.seller, product=other_product, price=300, quantity=1
+        )
+
+    def test_bounds_include_child_categories(self):
+        """
+        Проверяем, что границы цен категории учитывают дочерние категории
+        """
+        category_path = f'{self.category.pk}/'
+        child_path = f'{self.category.pk}/{self.child_category.pk}/'
+        self.assertEqual(get_category_price_bounds(category_path), (Decimal('100.00'), Decimal('300.00')))
+        self.assertEqual(get_category_price_bounds(child_path), (Decimal('100.00'), Decimal('100.00')))
+
+    def test_bounds_refreshed_on_changes(self):
+        """
+        Проверяем, что закэшированные границы обновляются при изменении, удалении и импорте цен
+        """
+        category_path = f'{self.category.pk}/'
+        get_category_price_bounds(category_path)
+
+        # Пересчёт выполняется после фиксации транзакции (flush_pending_price_bounds в on_commit)
+        self.seller_product.price = 50
+        self.seller_product.save()
+        self.assertEqual(get_category_price_bounds(category_path), (Decimal('100.00'), Decimal('300.00')))
+        flush_pending_price_bounds()
+        self.assertEqual(get_category_price_bounds(category_path), (Decimal('50.00'), Decimal('300.00')))
+
+        self.other_seller_product.delete()
+        flush_pending_price_bounds()
+        self.assertEqual(get_category_price_bounds(category_path), (Decimal('50.00'), Decimal('50.00')))
+
+        with defer_price_bounds_refresh():
+            with defer_price_bounds_refresh():
+                SellerProduct.objects.create(seller=self.seller, product=self.product, price=500, quantity=1)
+            # Вложенный блок не пересчитывает границы раньше внешнего
+            self.assertEqual(get_category_price_bounds(), (Decimal('50.00'), Decimal('50.00')))
+        self.assertEqual(get_category_price_bounds(), (Decimal('50.00'), Decimal('500.00')))
+
+        response = self.client.get(reverse('shop:product_list'))
+        self.assertEqual(response.context['data_max'], Decimal('500.00'))
+
+    def test_bounds_refreshed_for_old_category_on_move(self):
+        """
+        Проверяем, что при переносе товара пересчитываются границы и прежней категории
+        """
+        child_path = f'{self.category.pk}/{self.child_category.pk}/'
+        other_category = Category.objects.create(name='Бытовая техника')
+        self.assertEqual(get_category_price_bounds(child_path), (Decimal('100.00'), Decimal('100.00')))
+
+        self.product.category = other_category
+        self.product.save()
+        flush_pending_price_bounds()
+        self.assertEqual(get_category_price_bounds(child_path), (None, None))
+        self.assertEqual(get_category_price_bounds(f'{other_category.pk}/'), (Decimal('100.00'), Decimal('100.00')))
+
+
+class CategoryTreeTests(ShopTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.grandchild_category = Category.objects.create(name='OLED', parent=self.child_category)
+        self.other_category = Category.objects.create(name='Бытовая техника')
+
+    def test_paths_maintained_on_save(self):
+        """
+        Проверяем, что при переносе категории пути её потомков и записи витрины обновляются
+        """
+        self.assertEqual(
+            self.grandchild_category.path,
+            f'{self.category.pk}/{self.child_category.pk}/{self.grandchild_category.pk}/',
+        )
+        self.assertEqual(self.grandchild_category.depth, 2)
+
+        self.child_category.parent = self.other_category
+        self.child_category.save()
+        self.grandchild_category.refresh_from_db()
+        self.assertEqual(
+            self.grandchild_category.path,
+            f'{self.other_category.pk}/{self.child_category.pk}/{self.grandchild_category.pk}/',
+        )
+        self.assertEqual(self.grandchild_category.depth, 2)
+        self.assertEqual(
+            CatalogListing.objects.get().category_path,
+            f'{self.other_category.pk}/{self.child_category.pk}/',
+        )
+
+    def test_tree_queries(self):
+        """
+        Проверяем, что потомки и цепочка предков выбираются одним запросом
+        """
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                set(self.category.get_descendants()),
+                {self.category, self.child_category, self.grandchild_category},
+            )
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                list(self.grandchild_category.get_ancestors()),
+                [self.category, self.child_category],
+            )
+
+    def test_cycle_rejected_on_save(self):
+        """
+        Проверяем, что цикл в дереве нельзя создать и в обход формы
+        """
+        self.category.parent = self.grandchild_category
+        with self.assertRaises(ValidationError):
+            self.category.save()
+        self.grandchild_category.refresh_from_db()
+        self.assertEqual(
+            self.grandchild_category.path,
+            f'{self.category.pk}/{self.child_category.pk}/{self.grandchild_category.pk}/',
+        )
+
+    def test_empty_path_is_not_whole_catalog(self):
+        """
+        Проверяем, что категория без построенного пути не выводит весь каталог,
+        а пути достраиваются после миграции
+        """
+        other_product = Product.objects.create(name='Пылесос', category=self.other_category)
+        SellerProduct.objects.create(seller=self.seller, product=other_product, price=10, quantity=1)
+        Category.objects.update(path='', depth=0)
+        CatalogListing.objects.update(category_path='')
+
+        response = self.client.get(reverse('shop:catalog_products_list', args=[self.child_category.pk]))
+        self.assertNotIn(other_product.pk, [listing.product_id for listing in response.context['products']])
+
+        backfill_category_paths(sender=apps.get_app_config('shop'))
+        self.assertEqual(
+            Category.objects.get(pk=self.grandchild_category.pk).path,
+            f'{self.category.pk}/{self.child_category.pk}/{self.grandchild_category.pk}/',
+        )
+        response = self.client.get(reverse('shop:catalog_products_list', args=[self.child_category.pk]))
+        self.assertEqual([listing.product_id for listing in response.context['products']], [self.product.pk])
+
+    def test_catalog_breadcrumbs(self):
+        """
+        Проверяем, что каталог категории выводит цепочку предков в хлебных крошках
+        """
+        response = self.client.get(reverse('shop:catalog_products_list', args=[self.child_category.pk]))
+        self.assertEqual(list(response.context['breadcrumbs']), [self.category, self.child_category])
+        self.assertContains(response, reverse('shop:catalog_products_list', args=[self.category.pk]))
+
+
+class SalesCountTests(ShopTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.order = Order.objects.create(user=self.user)
+        self.other_seller_product = SellerProduct.objects.create(
+            seller=self.seller, product=self.product, price=200, quantity=1
+        )
+
+    def test_counters_follow_order_items(self):
+        """
+        Проверяем, что счётчики продаж меняются при создании и удалении позиций заказа
+        """
+        OrderItem.objects.create(order=self.order, seller_product=self.seller_product, quantity=1)
+        item = OrderItem.objects.create(order=self.order, seller_product=self.other_seller_product, quantity=2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.sales_count, 2)
+        self.assertEqual(CatalogListing.objects.get(pk=self.other_seller_product.pk).sales_count, 1)
+
+        item.delete()
+        self.product.refresh_from_db()
+        self.other_seller_product.refresh_from_db()
+        self.assertEqual(self.product.sales_count, 1)
+        self.assertEqual(self.other_seller_product.sales_count, 0)
+
+    def test_save_keeps_concurrent_increments(self):
+        """
+        Проверяем, что сохранение ранее загруженного объекта не затирает счётчик продаж
+        """
+        seller_product = SellerProduct.objects.get(pk=self.seller_product.pk)
+        OrderItem.objects.create(order=self.order, seller_product=self.seller_product, quantity=1)
+        seller_product.price = 150
+        seller_product.save()
+        self.product.save()
+        self.seller_product.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual((self.seller_product.price, self.seller_product.sales_count), (150, 1))
+        self.assertEqual(self.product.sales_count, 1)
+        self.assertFalse(SellerProduct._meta.get_field('sales_count').editable)
+
+    def test_popular_products_use_counter(self):
+        """
+        Проверяем, что популярные товары выбираются по счётчику продаж
+        """
+        OrderItem.objects.create(order=self.order, seller_product=self.other_seller_product, quantity=1)
+        SellerProduct.objects.filter(pk=self.seller_product.pk).update(sales_count=5)
+        self.assertEqual(len(rebuild_sales_counts()), 1)
+        self.assertEqual(get_cached_popular_products(), [self.other_seller_product, self.seller_product])
+
+
+class ReviewStatsTests(ShopTestMixin, TestCase):
+
+    def test_stats_follow_reviews(self):
+        """
+        Проверяем, что статистика отзывов обновляется при добавлении и удалении отзывов
+        """
+        first = add_review(Review(product=self.product, author=self.user, text='Первый'))
+        second = add_review(Review(product=self.product, author=self.user, text='Второй'))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 2)
+        self.assertEqual(self.product.last_review_at, second.created_at)
+        self.assertEqual(CatalogListing.objects.get().review_count, 2)
+
+        delete_reviews(Review.objects.filter(pk=second.pk))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 1)
+        self.assertEqual(self.product.last_review_at, first.created_at)
+        self.assertEqual(CatalogListing.objects.get().review_count, 1)
+
+        # Отзывы, созданные и удалённые в обход add_review/delete_reviews, тоже учитываются
+        third = Review.objects.create(product=self.product, author=self.user, text='Третий')
+        first.delete()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.review_count, self.product.last_review_at), (1, third.created_at))
+        self.assertEqual(CatalogListing.objects.get().review_count, 1)
+
+    def test_review_count_update_is_atomic(self):
+        """
+        Проверяем, что счётчики товара и витрины меняются в одной транзакции и при вызове из сигнала
+        """
+        with mock.patch('shop.reviews.CatalogListing') as listing_model:
+            listing_model.objects.filter.side_effect = DatabaseError
+            with self.assertRaises(DatabaseError):
+                update_review_count(self.product.pk, 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 0)
+
+    def test_rebuild_reports_drift(self):
+        """
+        Проверяем, что пересчёт находит и исправляет расхождения
+        """
+        Review.objects.create(product=self.product, author=self.user, text='Без счётчика')
+        Product.objects.filter(pk=self.product.pk).update(review_count=0)
+        self.assertEqual(rebuild_review_stats(dry_run=True), [(self.product.pk, 0, 1)])
+        self.assertEqual(rebuild_review_stats(), [(self.product.pk, 0, 1)])
+        self.assertEqual(rebuild_review_stats(), [])
+
+    def test_product_page_uses_stored_count(self):
+        """
+        Проверяем, что пагинатор отзывов на странице товара берёт число отзывов из товара
+        """
+        add_review(Review(product=self.product, author=self.user, text='Отличный'))
+        response = self.client.get(reverse('shop:product_detail', args=[self.product.pk]))
+        self.assertEqual(response.context['page_obj'].paginator.count, 1)
+        self.assertContains(response, 'Отличный')
+
+
+class TagIndexTests(ShopTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.product.tags.add('smart-tv', '4k')
+        self.other_product = Product.objects.create(name='Монитор', category=self.category)
+        self.other_product.tags.add('4k')
+        SellerProduct.objects.create(seller=self.seller, product=self.other_product, price=200, quantity=1)
+
+    def test_multi_tag_filters(self):
+        """
+        Проверяем фильтрацию по нескольким тегам в режимах AND и OR
+        """
+        self.assertEqual(get_tagged_product_ids(['smart-tv', '4k']), {self.product.pk})
+        self.assertEqual(get_tagged_product_ids(['smart-tv', '4k'], 'or'), {self.product.pk, self.other_product.pk})
+        self.assertEqual(get_tagged_product_ids(['smart']), set())
+
+        response = self.client.get(reverse('shop:product_list'), {'tags': ['4k'], 'tag_mode': 'and'})
+        self.assertEqual(len(response.context['products']), 2)
+        response = self.client.get(reverse('shop:product_list'), {'tags': ['4k', 'smart-tv']})
+        self.assertEqual([listing.product_id for listing in response.context['products']], [self.product.pk])
+
+        # Неизвестные теги отбрасываются, а если известных не осталось, выборка пуста
+        response = self.client.get(reverse('shop:product_list'), {'tags': ['smart-tv', 'missing']})
+        self.assertEqual([listing.product_id for listing in response.context['products']], [self.product.pk])
+        response = self.client.get(reverse('shop:product_list'), {'tags': ['missing']})
+        self.assertEqual(len(response.context['products']), 0)
+
+    def test_cached_index_patched_incrementally(self):
+        """
+        Проверяем, что закэшированный индекс обновляется при изменении тегов и удалении товара
+        """
+        self.assertEqual(get_tag_cloud()[0], {'slug': '4k', 'name': '4k', 'count': 2})
+        self.other_product.tags.remove('4k')
+        self.other_product.tags.add('office')
+        self.assertEqual(get_tag_index()['4k'][1], [self.product.pk])
+        self.assertEqual(get_tag_index()['office'][1], [self.other_product.pk])
+
+        self.other_product.delete()
+        self.assertNotIn('office', get_tag_index())
+
+
+class CacheInvalidationTests(ShopTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='testpassword'
+        )
+
+    def assertInvalidates(self, namespaces, action):
+        versions = {namespace: get_version(namespace) for namespace in namespaces}
+        action()
+        for namespace, version in versions.items():
+            self.assertNotEqual(get_version(namespace), version, namespace)
+
+    def test_product_snapshot_deleted_on_write(self):
+        """
+        Проверяем, что изменение товара и предложения продавца удаляет снимок страницы товара
+        """
+        url = reverse('shop:product_detail', args=[self.product.pk])
+        self.client.get(url)
+        self.assertIsNotNone(cache.get(make_key('product', self.product.pk)))
+
+        self.product.name = 'Новый телевизор'
+        self.product.save()
+        self.assertIsNone(cache.get(make_key('product', self.product.pk)))
+        self.assertContains(self.client.get(url), 'Новый телевизор')
+
+        self.seller_product.price = 150
+        self.seller_product.save()
+        self.assertIsNone(cache.get(make_key('product', self.product.pk)))
+
+    def test_write_paths_invalidate_namespaces(self):
+        """
+        Проверяем, что каждая операция записи сбрасывает свои пространства имён
+        """
+        self.assertInvalidates(['categories'], lambda: Category.objects.create(name='Бытовая техника'))
+        self.assertInvalidates(
+            ['products', 'popular', 'limited', 'categories'],
+            lambda: SellerProduct.objects.create(seller=self.seller, product=self.product, price=1, quantity=1),
+        )
+        self.assertInvalidates(
+            ['popular'],
+            lambda: OrderItem.objects.create(
+                order=Order.objects.create(user=self.user), seller_product=self.seller_product, quantity=1
+            ),
+        )
+        self.assertInvalidates(
+            ['banners'], lambda: Banner.objects.create(product=self.product, text='Скидка')
+        )
+
+    def test_cached_values_follow_writes(self):
+        """
+        Проверяем, что закэшированные меню и баннеры не устаревают после изменений
+        """
+        self.assertEqual(set(get_cached_categories()), {self.category, self.child_category})
+        self.seller_product.delete()
+        self.assertEqual(list(get_cached_categories()), [])
+
+        self.assertEqual(get_active_banners(), [])
+        banner = Banner.objects.create(product=self.product, text='Скидка')
+        self.assertEqual(get_active_banners(), [banner])
+
+    def test_admin_reset_buttons(self):
+        """
+        Проверяем, что кнопки сброса кэша в админке сбрасывают свои пространства имён
+        """
+        self.client.force_login(self.admin)
+        self.assertInvalidates(
+            ['product'], lambda: self.client.post(reverse('admin:reset_cache_products'))
+        )
+        self.assertInvalidates(
+            ['product', 'products', 'popular', 'limited'],
+            lambda: self.client.post(reverse('admin:reset_cache_seller_products')),
+        )
+
+    def test_admin_reset_starts_warmup(self):
+        """
+        Проверяем, что сброс кэша из админки запускает прогрев после фиксации транзакции
+        """
+        self.client.force_login(self.admin)
+        with mock.patch('shop.utils.warm_cache.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('admin:reset_cache_all'))
+        delay.assert_called_once_with()
+
+
+class ProductSnapshotTests(ShopTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        SellerProduct.objects.create(seller=self.seller, product=self.product, price=Decimal('50.00'), quantity=1)
+        self.product.tags.add('smart-tv')
+        add_review(Review(product=self.product, author=self.user, text='Отличный'))
+
+    def test_snapshot_contents_and_encoding(self):
+        """
+        Проверяем содержимое снимка и его кодирование с версией схемы
+        """
+        snapshot = get_product_snapshot(self.product.pk)
+        self.assertEqual(snapshot.average_price, Decimal('75.00'))
+        self.assertEqual(snapshot.min_price_id, SellerProduct.objects.get(price=50).pk)
+        self.assertEqual([offer.seller_name for offer in snapshot.offers], ['Seller', 'Seller'])
+        self.assertEqual(snapshot.tags, ('smart-tv',))
+        self.assertEqual([review.text for review in snapshot.reviews], ['Отличный'])
+
+        data = encode_snapshot(snapshot)
+        self.assertEqual(decode_snapshot(data), snapshot)
+        self.assertIsNone(decode_snapshot(bytes([0]) + data[1:]))
+
+    def test_cached_page_renders_without_queries(self):
+        """
+        Проверяем, что страница товара с закэшированным снимком не обращается к базе
+        """
+        url = reverse('shop:product_detail', args=[self.product.pk])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'Отличный')
+        self.assertContains(response, 'Seller')
+
+    def test_conditional_get(self):
+        """
+        Проверяем, что неизменённая страница товара отдаётся как 304,
+        а изменение предложения или корзины посетителя меняет ETag
+        """
+        url = reverse('shop:product_detail', args=[self.product.pk])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('must-revalidate', response['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        seller_product = self.product.seller_products.first()
+        seller_product.price = Decimal('40.00')
+        seller_product.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        self.client.post(reverse('shop:add_to_cart', args=[seller_product.pk]), {'amount': '1'})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_anonymous_page_cache_fills_cart(self):
+        """
+        Проверяем, что страница из кэша для анонимных посетителей получает
+        итоги корзины и CSRF-токен текущей сессии
+        """
+        url = reverse('shop:product_detail', args=[self.product.pk])
+        self.client.get(url)
+        seller_product = self.product.seller_products.first()
+        self.client.post(reverse('shop:add_to_cart', args=[seller_product.pk]), {'amount': '2'})
+
+        with mock.patch.object(ProductDetailView, 'get_context_data') as get_context_data:
+            response = self.client.get(url)
+        get_context_data.assert_not_called()
+        self.assertNotContains(response, '__page_cache_')
+        self.assertContains(response, localize(seller_product.price * 2))
+        self.assertContains(response, 'name="csrfmiddlewaretoken"')
+
+    def test_pending_messages_disable_page_cache(self):
+        """
+        Проверяем, что страница с ожидающими сообщениями не кэшируется,
+        а сами сообщения после проверки остаются непоказанными
+        """
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        request._messages = CookieStorage(request)
+        self.assertTrue(is_cacheable(request))
+
+        messages.info(request, 'Товар добавлен')
+        self.assertFalse(is_cacheable(request))
+        self.assertFalse(request._messages.used)
+        self.assertEqual([message.message for message in request._messages], ['Товар добавлен'])
+
+    def test_warm_cache_builds_recently_viewed_first(self):
+        """
+        Проверяем, что прогрев строит снимки начиная с недавно просмотренных товаров
+        """
+        other_product = Product.objects.create(name='Пылесос', category=self.category)
+        HistoryProduct.objects.create(user=self.user, product=other_product)
+        self.assertEqual(get_products_by_recent_views(), [other_product.pk, self.product.pk])
+
+        progress = []
+        result = warm_cache(workers=1, batch_size=1, progress=lambda *args: progress.append(args))
+        self.assertEqual(result['product'], 2)
+        self.assertEqual(progress[-2:], [('product', 1, 2), ('product', 2, 2)])
+        with self.assertNumQueries(0):
+            get_product_snapshot(self.product.pk)
+
+
+class MemoizeTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+        @memoize('popular', timeout=60)
+        def compute():
+            self.calls += 1
+            return self.calls
+
+        self.compute = compute
+        self.key = make_key('popular')
+
+    def test_fresh_value_is_cached(self):
+        """
+        Проверяем, что свежее значение берётся из кэша без пересчёта
+        """
+        self.assertEqual(self.compute(), 1)
+        self.assertEqual(self.compute(), 1)
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_served_while_revalidating(self):
+        """
+        Проверяем, что пока другой процесс пересчитывает значение, отдаётся устаревшее
+        """
+        cache.set(self.key, ('stale', 0.1, time.time() - 1))
+        cache.add(f'lock:{self.key}', 1)
+        self.assertEqual(self.compute(), 'stale')
+        self.assertEqual(self.calls, 0)
+
+        cache.delete(f'lock:{self.key}')
+        self.assertEqual(self.compute(), 1)
+        self.assertEqual(cache.get(self.key)[0], 1)
+
+    def test_early_recompute_near_expiry(self):
+        """
+        Проверяем досрочный пересчёт значения, которое долго вычисляется и скоро истечёт
+        """
+        cache.set(self.key, ('old', 1000, time.time() + 0.001))
+        self.assertEqual(self.compute(), 1)
+
+    def test_miss_waits_for_single_flight(self):
+        """
+        Проверяем, что при промахе процесс без блокировки ждёт значение, а не вычисляет его
+        """
+        cache.add(f'lock:{self.key}', 1)
+        with mock.patch('shop.memoize.time.sleep', lambda _: cache.set(self.key, ('other', 0, time.time() + 60))):
+            self.assertEqual(self.compute(), 'other')
+        self.assertEqual(self.calls, 0)
+
+
+@override_settings(CART_BACKEND='shop.cart.RedisCartBackend')
+class RedisCartTests(ShopTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.connection = FakeRedis()
+        for module in ('shop.cart', 'shop.cart_redis'):
+            patcher = mock.patch(f'{module}.get_redis_connection', return_value=self.connection)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.other_product = SellerProduct.objects.create(
+            seller=self.seller, product=self.product, price=Decimal('20.00'), quantity=1
+        )
+
+    def get_request(self, user=None):
+        request = RequestFactory().get('/')
+        request.user = user or AnonymousUser()
+        request.session = SessionStore()
+        return request
+
+    def get_cart_rows(self):
+        cart = Cart.objects.get(user=self.user)
+        rows = dict(cart.cart_items.values_list('product_id', 'quantity'))
+        return rows, (cart.quantity_total, cart.price_total)
+
+    def test_changes_written_to_database_by_flush(self):
+        """
+        Проверяем, что корзина пользователя загружается из базы при первом изменении,
+        а добавление, изменение, удаление и очистка записываются в Cart/CartItem отложенно
+        """
+        Cart.objects.create(user=self.user).add_product(self.seller_product, 1)
+        backend = get_cart(self.get_request(self.user))
+        backend.add_product(self.seller_product, 2)
+        backend.add_product(self.other_product, 1)
+        backend.update_product(self.other_product.pk, 4)
+        self.assertEqual(backend.get_totals(), (7, Decimal('380.00')))
+        self.assertEqual(
+            {item.product: item.quantity for item in backend.get_items()},
+            {self.seller_product: 3, self.other_product: 4},
+        )
+        # До записи в базе остаётся прежняя корзина
+        self.assertEqual(self.get_cart_rows(), ({self.seller_product.pk: 1}, (1, Decimal('100.00'))))
+
+        self.assertEqual(flush_dirty_carts(), 1)
+        self.assertEqual(
+            self.get_cart_rows(),
+            ({self.seller_product.pk: 3, self.other_product.pk: 4}, (7, Decimal('380.00'))),
+        )
+        self.assertEqual(rebuild_cart_totals(dry_run=True), [])
+
+        backend.delete_product(self.seller_product.pk)
+        backend.flush()
+        self.assertEqual(self.get_cart_rows(), ({self.other_product.pk: 4}, (4, Decimal('80.00'))))
+        self.assertEqual(flush_dirty_carts(), 0)
+
+        backend.clear()
+        self.assertEqual(backend.get_items(), [])
+        flush_dirty_carts()
+        self.assertEqual(self.get_cart_rows(), ({}, (0, Decimal('0.00'))))
+
+    def test_anonymous_cart_merged_on_login(self):
+        """
+        Проверяем, что корзина анонимного посетителя переносится в корзину пользователя
+        """
+        request = self.get_request()
+        anonymous = get_cart(request)
+        anonymous.add_products([(self.seller_product, 1), (self.other_product, 2)])
+        anonymous_key = anonymous.key
+        self.assertEqual(anonymous.get_totals(), (3, Decimal('140.00')))
+
+        get_cart(request, self.user).merge_anonymous_cart()
+        self.assertNotIn(anonymous_key, self.connection.data)
+        self.assertNotIn('cart_id', request.session)
+        flush_dirty_carts()
+        self.assertEqual(
+            self.get_cart_rows(),
+            ({self.seller_product.pk: 1, self.other_product.pk: 2}, (3, Decimal('140.00'))),
+        )
+
+    def test_failed_flush_returns_cart_to_dirty_set(self):
+        """
+        Проверяем, что корзина, которую не удалось записать, остаётся в очереди на запись
+        """
+        get_cart(self.get_request(self.user)).add_product(self.seller_product, 2)
+        with mock.patch('shop.cart_redis.flush_cart', side_effect=DatabaseError), \
+                self.assertLogs('shop.cart_redis', 'ERROR'):
+            self.assertEqual(flush_dirty_carts(), 0)
+        self.assertEqual(self.connection.data[DIRTY_CARTS_KEY], {str(self.user.pk).encode()})
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+        self.assertEqual(flush_carts(), 1)
+        self.assertEqual(self.get_cart_rows(), ({self.seller_product.pk: 2}, (2, Decimal('200.00'))))
+
+
+class LocalCacheTests(ShopTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        local_cache.clear()
+
+    def test_lru_eviction_and_ttl(self):
+        """
+        Проверяем вытеснение давно не читавшихся записей и истечение срока жизни
+        """
+        lru = LocalCache(max_entries=2)
+        lru.set('a', 1, 60)
+        lru.set('b', 2, 60)
+        lru.get('a')
+        lru.set('c', 3, 60)
+        self.assertIs(lru.get('b'), MISSING)
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('d', 4, -1)
+        self.assertIs(lru.get('d'), MISSING)
+
+    def test_hot_keys_served_from_process_memory(self):
+        """
+        Проверяем, что меню категорий читается из памяти процесса, а сохранение категории его сбрасывает
+        """
+        get_cached_categories()
+        local_hits = get_tier_stats()['local']['hits']
+        with mock.patch('shop.memoize.cache') as shared_cache:
+            self.assertEqual(set(get_cached_categories()), {self.category, self.child_category})
+            shared_cache.get.assert_not_called()
+        self.assertEqual(get_tier_stats()['local']['hits'], local_hits + 1)
+
+        self.category.name = 'Техника'
+        self.category.save()
+        self.assertIn('Техника', [category.name for category in get_cached_categories()])
+
+    def test_invalidation_message_from_other_node(self):
+        """
+        Проверяем, что сообщение о новой версии пространства имён выбрасывает локальные копии
+        """
+        get_cached_categories()
+        key = make_key('categories')
+        self.assertIsNot(local_cache.get(key), MISSING)
+        handle_invalidation(f'categories:{get_version("categories") + 1}')
+        self.assertIs(local_cache.get(key), MISSING)
+        self.assertNotEqual(make_key('categories'), key)
+
+
+class CacheMetricsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset_cache_metrics()
+
+    def test_counts_per_namespace(self):
+        """
+        Проверяем, что обёртка кэша считает попадания, промахи и записи по пространствам имён
+        """
+        key = make_key('product', 1)
+        cache.get(key)
+        cache.set(key, b'snapshot')
+        cache.get(key)
+        cache.get_many([key, make_key('tags')])
+
+        metrics = get_cache_metrics()
+        self.assertEqual(
+            (metrics['product']['hits'], metrics['product']['misses'], metrics['product']['sets']), (2, 1, 1)
+        )
+        self.assertEqual(metrics['product']['avg_size'], len(b'snapshot'))
+        self.assertEqual(metrics['tags']['misses'], 1)
+
+    @override_settings(CACHE_METRICS_SIZE_SAMPLE_RATE=2)
+    def test_value_sizes_sampled(self):
+        """
+        Проверяем, что сериализуемые значения измеряются выборочно
+        """
+        cache.set_many({make_key('tags', index): {'index': index} for index in range(4)})
+        metrics = get_cache_metrics()['tags']
+        self.assertEqual((metrics['sets'], metrics['sized_sets']), (4, 2))
+        self.assertGreater(metrics['avg_size'], 0)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_endpoint_access(self):
+        """
+        Проверяем, что метрики отдаются только по токену или сотрудникам
+        """
+        cache.get(make_key('categories'))
+        url = reverse('cache_metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertContains(response, 'cache_misses_total{namespace="categories"} 1')
+
+        self.client.force_login(User.objects.create_superuser(username='admin', password='testpassword'))
+        self.assertContains(self.client.get(reverse('admin:cache_stats')), 'categories')
+
+
+class CartTotalsTests(ShopTestMixin, TestCase):
+
+    def test_totals_follow_cart_changes(self):
+        """
+        Проверяем, что итоги корзины меняются вместе с позициями, включая каскадное удаление
+        """
+        cart = Cart.objects.create(user=self.user)
+        cart.add_product(self.seller_product, 2)
+        cart.add_product(self.seller_product, 1)
+        self.assertEqual((cart.total_quantity(), cart.total_price()), (3, Decimal('300.00')))
+
+        cart_item = cart.cart_items.get()
+        cart.update_product(cart_item, 1)
+        self.assertEqual((cart.total_quantity(), cart.total_price()), (1, Decimal('100.00')))
+
+        other_product = SellerProduct.objects.create(
+            seller=self.seller, product=self.product, price=Decimal('20.00'), quantity=1
+        )
+        cart.add_product(other_product)
+        other_product.delete()
+        cart.refresh_from_db()
+        self.assertEqual((cart.total_quantity(), cart.total_price()), (1, Decimal('100.00')))
+        self.assertEqual(rebuild_cart_totals(dry_run=True), [])
+
+        cart.delete_product(cart.cart_items.get())
+        self.assertEqual((cart.total_quantity(), cart.total_price()), (0, Decimal('0.00')))
+
+    def test_totals_backfilled_and_kept_by_admin(self):
+        """
+        Проверяем заполнение итогов после миграции и их изменение при сохранении позиции в админке
+        """
+        cart = Cart.objects.create(user=self.user)
+        cart_item = CartItem.objects.create(cart=cart, product=self.seller_product, quantity=2, price=Decimal('100.00'))
+        backfill_cart_totals(apps.get_app_config('shop'))
+        cart.refresh_from_db()
+        self.assertEqual((cart.quantity_total, cart.price_total), (2, Decimal('200.00')))
+
+        other_product = SellerProduct.objects.create(
+            seller=self.seller, product=self.product, price=Decimal('20.00'), quantity=1
+        )
+        cart_item.quantity = 3
+        CartItemAdmin(CartItem, admin.site).save_model(None, cart_item, None, True)
+        CartItemAdmin(CartItem, admin.site).save_model(
+            None, CartItem(cart=cart, product=other_product, quantity=1, price=Decimal('20.00')), None, False
+        )
+        cart.refresh_from_db()
+        self.assertEqual((cart.quantity_total, cart.price_total), (4, Decimal('320.00')))
+        self.assertEqual(rebuild_cart_totals(dry_run=True), [])
+
+    def test_backfill_skips_populated_totals(self):
+        """
+        Проверяем, что после миграции не пересчитываются корзины с уже заполненными итогами
+        """
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.seller_product, quantity=2, price=Decimal('100.00'))
+        Cart.objects.filter(pk=cart.pk).update(quantity_total=5, price_total=Decimal('1.00'))
+        with CaptureQueriesContext(connection) as queries:
+            backfill_cart_totals(apps.get_app_config('shop'))
+        self.assertEqual(len(queries), 1)
+        cart.refresh_from_db()
+        self.assertEqual(cart.quantity_total, 5)
+        self.assertEqual(len(rebuild_cart_totals(dry_run=True)), 1)
+
+    def test_header_reads_totals_without_writes(self):
+        """
+        Проверяем, что итоги в шапке читаются одним запросом и корзина при этом не создаётся
+        """
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(1):
+            self.assertEqual(info_cart(request), {'total_quantity': 0, 'total_price': 0})
+        self.assertFalse(Cart.objects.exists())
+
+        Cart.objects.create(user=self.user, quantity_total=5, price_total=Decimal('1.00'))
+        self.assertEqual(rebuild_cart_totals(), [(Cart.objects.get().pk, (5, Decimal('1.00')), (0, Decimal('0')))])
+        self.assertEqual(info_cart(request), {'total_quantity': 0, 'total_price': Decimal('0.00')})
+
+    def test_login_merges_session_cart_in_constant_queries(self):
+        """
+        Проверяем, что перенос корзины из сессии при входе не зависит от её размера по числу запросов
+        """
+        seller_products = SellerProduct.objects.bulk_create(
+            SellerProduct(seller=self.seller, product=self.product, price=Decimal('10.00'), quantity=1)
+            for _ in range(10)
+        )
+        cart = Cart.objects.create(user=self.user)
+        cart.add_product(self.seller_product, 1)
+
+        def login_with_session_cart(products):
+            self.client.logout()
+            session = self.client.session
+            session['cart'] = {
+                str(seller_product.pk): {'quantity': 2, 'price': str(seller_product.price)}
+                for seller_product in products
+            }
+            session.save()
+            with CaptureQueriesContext(connection) as queries:
+                self.client.force_login(self.user)
+            return len(queries)
+
+        small = login_with_session_cart([self.seller_product])
+        large = login_with_session_cart([self.seller_product, *seller_products])
+        self.assertEqual(small, large)
+
+        cart.refresh_from_db()
+        self.assertEqual(cart.cart_items.get(product=self.seller_product).quantity, 5)
+        self.assertEqual((cart.total_quantity(), cart.total_price()), (25, Decimal('700.00')))
+        self.assertEqual(rebuild_cart_totals(dry_run=True), [])
+
+    def test_add_product_is_single_upsert(self):
+        """
+        Проверяем, что добавление товара - атомарный upsert без чтения позиции,
+        а несколько товаров добавляются одним запросом через отдельный адрес
+        """
+        cart = Cart.objects.create(user=self.user)
+        cart.add_product(self.seller_product, 1)
+        with CaptureQueriesContext(connection) as queries:
+            cart.add_product(self.seller_product, 2)
+        statements = [query['sql'].split()[0] for query in queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(statements, ['INSERT', 'UPDATE'])
+        self.assertEqual(cart.cart_items.get().quantity, 3)
+
+        other_product = SellerProduct.objects.create(
+            seller=self.seller, product=self.product, price=Decimal('20.00'), quantity=1
+        )
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse('shop:add_many_to_cart'),
+            {'product': [self.seller_product.pk, other_product.pk], 'amount': ['1', '2']},
+        )
+        self.assertRedirects(response, reverse('shop:cart_detail'))
+        cart.refresh_from_db()
+        self.assertEqual(
+            dict(cart.cart_items.values_list('product_id', 'quantity')), {self.seller_product.pk: 4, other_product.pk: 2}
+        )
+        self.assertEqual((cart.total_quantity(), cart.total_price()), (6, Decimal('440.00')))
+        self.assertEqual(rebuild_cart_totals(dry_run=True), [])
+
+        # Неизвестные товары и некорректные количества отклоняются целиком
+        response = self.client.post(
+            reverse('shop:add_many_to_cart'), {'product': [self.seller_product.pk, 0], 'amount': ['1', '1']}
+        )
+        self.assertContains(response, 'Товары не найдены: 0.', status_code=400)
+        response = self.client.post(reverse('shop:add_many_to_cart'), {'product': [other_product.pk], 'amount': ['²']})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(cart.cart_items.get(product=self.seller_product).quantity, 4)
+        with self.assertRaises(ValueError):
+            cart.add_product(self.seller_product, -1)
+
+    def test_cart_backend_from_settings(self):
+        """
+        Проверяем, что корзина берётся из бэкенда в настройках, а позиции
+        удаляются только из корзины текущего пользователя
+        """
+        other_user = User.objects.create_user(username='other', email='other@example.com', password='password')
+        other_cart = Cart.objects.create(user=other_user)
+        other_cart.add_product(self.seller_product, 1)
+
+        request = RequestFactory().get('/')
+        request.user = self.user
+        backend = get_cart(request)
+        self.assertIsInstance(backend, DatabaseCartBackend)
+        backend.add_product(self.seller_product, 2)
+        self.assertEqual(backend.get_totals(), (2, Decimal('200.00')))
+
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('shop:cart_delete', args=[other_cart.cart_items.get().pk]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(other_cart.cart_items.count(), 1)
+
+        with override_settings(CART_BACKEND='shop.cart.RedisCartBackend'):
+            self.assertEqual(flush_carts(), 0)
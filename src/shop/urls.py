@@ -1,8 +1,8 @@
 from django.urls import path
 
-from .views import (AddToCartView, CartDetailView, CartItemDeleteView,
-                    CartItemUpdateView, CatalogProduct, IndexView,
-                    ProductDetailView, ReviewCreateView)
+from .views import (AddManyToCartView, AddToCartView, CartDetailView,
+                    CartItemDeleteView, CartItemUpdateView, CatalogProduct,
+                    IndexView, ProductDetailView, ReviewCreateView)
 
 app_name = "shop"
 
@@ -11,6 +11,7 @@ urlpatterns = [
     path("product/<int:pk>/", ProductDetailView.as_view(), name="product_detail"),
     path('product/<int:pk>/review/create/', ReviewCreateView.as_view(), name='review_create'),
     path('cart/<int:pk>/add/', AddToCartView.as_view(), name='add_to_cart'),
+    path('cart/add/', AddManyToCartView.as_view(), name='add_many_to_cart'),
     path('cart/', CartDetailView.as_view(), name='cart_detail'),
     path('cart/item/<int:pk>/delete/', CartItemDeleteView.as_view(), name='cart_delete'),
     path('cart/item/<int:pk>/update/', CartItemUpdateView.as_view(), name='cart_update'),
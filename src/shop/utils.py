@@ -3,11 +3,16 @@ from decimal import Decimal
 
 from django.contrib import messages
 from django.core.cache import cache
+from django.db import transaction
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 
+from shop.cache_keys import LOCAL_NAMESPACES, invalidate
+from shop.cache_metrics import get_cache_metrics, reset_cache_metrics
 from shop.forms import JSONImportForm
-from shop.models import CartItem, Product, SellerProduct, SiteSettings
+from shop.local_cache import get_tier_stats
+from shop.models import CartItem, SellerProduct, SiteSettings
+from shop.tasks import warm_cache
 
 """
 Методы для работы с корзиной неавторизованного пользователя в сессии
@@ -16,11 +21,15 @@ from shop.models import CartItem, Product, SellerProduct, SiteSettings
 
 def get_cart_from_session(request):
     cart = request.session.get('cart', {})
+    # Все товары корзины загружаются одним запросом; удалённые из каталога пропускаются
+    products = SellerProduct.objects.select_related('product').in_bulk([int(key) for key in cart])
     cart_items_objs = []
     for key, value in cart.items():
-        product = SellerProduct.objects.get(pk=int(key))
-        cart_item = CartItem(id=int(key), product=product, quantity=cart[key]['quantity'],
-                             price=Decimal(cart[key]['price']))
+        product = products.get(int(key))
+        if product is None:
+            continue
+        cart_item = CartItem(id=int(key), product=product, quantity=value['quantity'],
+                             price=Decimal(value['price']))
         cart_items_objs.append(cart_item)
     return cart_items_objs
 
@@ -42,6 +51,21 @@ def add_to_session_cart(request, product_id, quantity):
     save_cart_to_session(request, cart)
 
 
+def add_many_to_session_cart(request, items):
+    """
+    Добавляет в корзину в сессии несколько товаров: items - пары (товар продавца, количество).
+    Количество должно быть положительным целым числом.
+    """
+
+    cart = request.session.get('cart', {})
+    for product, quantity in items:
+        if not isinstance(quantity, int) or quantity <= 0:
+            raise ValueError(f"Некорректное количество товара {product.pk}: {quantity!r}")
+        line = cart.setdefault(str(product.pk), {'quantity': 0, 'price': str(product.price)})
+        line['quantity'] += quantity
+    save_cart_to_session(request, cart)
+
+
 def get_total_price_from_session_cart(request):
     cart = request.session.get('cart', {})
     total_price = 0
@@ -110,23 +134,37 @@ def import_json(request: HttpRequest) -> HttpResponse:
 def reset_cache_all(request: HttpRequest) -> HttpResponse:
     if request.method == "POST":
         cache.clear()
+        # Локальные копии в памяти воркеров сбрасываются через pub/sub
+        invalidate(*LOCAL_NAMESPACES)
+        # Прогрев запускается после фиксации транзакции, когда все сбросы уже видны
+        transaction.on_commit(warm_cache.delay)
         messages.success(request, "Весь кэш успешно сброшен.")
     return redirect('..')
 
 
 def reset_cache_products(request: HttpRequest) -> HttpResponse:
     if request.method == "POST":
-        for product in Product.objects.all():
-            cache_key = f'product_cache_key:{product.id}'
-            cache.delete(cache_key)
+        invalidate('product', 'categories', 'facets', 'price_bounds', 'tags', 'pages')
+        transaction.on_commit(warm_cache.delay)
         messages.success(request, "Кэш для товаров сброшен.")
     return redirect('..')
 
 
 def reset_cache_seller_products(request: HttpRequest) -> HttpResponse:
     if request.method == "POST":
-        for product in SellerProduct.objects.all():
-            cache_key = f'product_cache_key:{product.id}'
-            cache.delete(cache_key)
+        invalidate('product', 'products', 'popular', 'limited', 'pages')
+        transaction.on_commit(warm_cache.delay)
         messages.success(request, "Кэш для товаров продавцов сброшен.")
     return redirect('..')
+
+
+def cache_stats(request: HttpRequest) -> HttpResponse:
+    if request.method == "POST":
+        reset_cache_metrics()
+        messages.success(request, "Статистика кэша сброшена.")
+        return redirect('.')
+    context = {
+        "metrics": get_cache_metrics(),
+        "tier_stats": get_tier_stats(),
+    }
+    return render(request, "shop/admin/cache_stats.html", context)
@@ -1,38 +1,50 @@
+import hashlib
+import hmac
 from datetime import datetime
-from decimal import ROUND_HALF_UP, Decimal
+from decimal import Decimal
 from random import choice
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import PermissionRequiredMixin
-from django.core.cache import cache
-from django.core.paginator import Paginator
-from django.core.serializers import deserialize, serialize
-from django.db.models import Count, Max, Min
-from django.http import HttpResponseBadRequest
+from django.db.models import Case, Count, IntegerField, Max, When
+from django.http import (HttpResponse, HttpResponseBadRequest,
+                         HttpResponseForbidden)
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
 from django.utils.decorators import method_decorator
+from django.utils.functional import cached_property
 from django.utils.safestring import mark_safe
-from django.views.decorators.cache import never_cache
+from django.views.decorators.cache import cache_control, never_cache
 from django.views.generic import (CreateView, DetailView, ListView,
                                   TemplateView, View)
-from taggit.models import Tag
 
-from banners.models import Banner
+from banners.services import get_active_banners
+from discounts.services import annotate_discounted_prices
 from discounts.utils import calculate_best_discount
+from shop.cache_keys import get_version
+from shop.cart import get_cart
+from shop.cache_metrics import format_metrics, get_cache_metrics
+from shop.facets import compute_facets, get_facet_summary
 from shop.forms import ProductFilterForm, ReviewForm, TagsForm
-from shop.mixins import NonCachingMixin
-from shop.models import (Cart, CartItem, Category, HistoryProduct, Product,
-                         Review, SellerProduct)
+from shop.mixins import ConditionalGetMixin
+from shop.page_cache import cache_anonymous_page
+from shop.paginator import CursorPaginator, KnownCountPaginator
+from shop.models import (Cart, CatalogListing, Category, HistoryProduct,
+                         Product, Review, SellerProduct)
+from shop.reviews import add_review
 from shop.services import (get_cached_categories,
-                           get_cached_popular_products, get_limited_products)
-from shop.utils import (add_to_session_cart, get_cart_from_session,
-                        get_total_price_from_session_cart,
-                        get_total_quantity_from_session_cart,
-                        remove_from_session_cart, update_session_cart)
+                           get_cached_popular_products,
+                           get_category_price_bounds, get_limited_products,
+                           get_popular_categories)
+from shop.snapshots import (REVIEWS_PER_PAGE, build_review_snapshot,
+                            decode_snapshot, get_encoded_product_snapshot,
+                            get_product_snapshot)
+from shop.tags import get_tag_cloud, get_tagged_product_ids
 
 
-@method_decorator(decorator=never_cache, name="get")
+@method_decorator(decorator=cache_control(max_age=0, must_revalidate=True, private=True), name="dispatch")
+@method_decorator(decorator=cache_anonymous_page, name="get")
 class IndexView(TemplateView):
     """
         Главная страница сайта
@@ -42,113 +54,82 @@ class IndexView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        popular_categories = (
-            Category.objects
-            .annotate(
-                product_count=Count('products'),
-                min_price=Min('products__seller_products__price')
-            )
-            .order_by('-product_count')[:3]
-        )
-        limited_products = get_limited_products()
-        products_with_discount = [
-            product for product in limited_products
-            if product.product.discounts.exists()
-        ]
-        for product in products_with_discount:
-            discount = product.product.discounts.first()
-            if discount:
-                discount_value = Decimal(discount.discount)
-                product.price_after_discount = round(
-                    product.price * (1 - discount_value / Decimal(100)), 2)
+        popular_categories = get_popular_categories()
+        # Цены со скидками читаются одним запросом на список, независимо от числа товаров
+        limited_products = annotate_discounted_prices(get_limited_products())
+        products_with_discount = [product for product in limited_products if product.applied_discount]
 
         context['popular_categories'] = popular_categories
         context['product'] = choice(products_with_discount) if products_with_discount else None
-        context['seller_products'] = get_cached_popular_products()
+        context['seller_products'] = annotate_discounted_prices(get_cached_popular_products())
         context['limited_products'] = limited_products
-        context['banners'] = Banner.objects.filter(active=True)
+        context['banners'] = get_active_banners()
 
         return context
 
 
-class ProductDetailView(NonCachingMixin, DetailView):
+@method_decorator(decorator=cache_anonymous_page, name="get")
+class ProductDetailView(ConditionalGetMixin, DetailView):
+    """
+    Страница товара рендерится из снимка (shop.snapshots), который читается
+    из кэша одним обращением, без запросов к базе.
+    Отпечаток страницы для ETag - хэш этого же снимка.
+    """
+
     template_name = 'shop/product_detail.html'
     context_object_name = "product"
     model = Product
 
-    def get(self, request, *args, **kwargs):
+    def dispatch(self, request, *args, **kwargs):
+        # Просмотр попадает в историю и тогда, когда браузер получает 304
         if request.user.is_authenticated:
             product, created = HistoryProduct.objects.get_or_create(
-                user=request.user, product=self.get_object())
+                user=request.user, product_id=self.get_object().pk)
 
             if not created:
                 product.created_at = datetime.now()
                 product.save()
-        return super().get(request, *args, **kwargs)
+        return super().dispatch(request, *args, **kwargs)
 
-    # def get(self, request, *args, **kwargs):
+    @cached_property
+    def encoded_snapshot(self):
+        return get_encoded_product_snapshot(self.kwargs.get("pk"))
 
-    def get_object(self, queryset=None):
-        product_id = self.kwargs.get("pk")
-        product_cache_key = f'product_cache_key:{product_id}'
-        product_data = cache.get(product_cache_key)
-
-        if product_data is None:
-            product = get_object_or_404(Product, pk=product_id)
-            product_data = serialize("json", [product])
-            cache.set(product_cache_key, product_data, timeout=60 * 60 * 24)
-        else:
-            product = list(deserialize("json", product_data))[0].object
+    def get_content_fingerprint(self):
+        return (hashlib.md5(self.encoded_snapshot).hexdigest(),)
 
-        return product
+    def get_last_modified(self):
+        return self.get_object().modified_at
 
-    def get_seller_products(self, product_id):
-        seller_products_cache_key = f'seller_products_cache_key:{product_id}'
-        seller_products_data = cache.get(seller_products_cache_key)
+    def get_object(self, queryset=None):
+        if not hasattr(self, 'snapshot'):
+            # Снимок старой версии схемы перестраивается
+            self.snapshot = decode_snapshot(self.encoded_snapshot) or get_product_snapshot(self.kwargs.get("pk"))
+        return self.snapshot
 
-        if seller_products_data is None:
-            seller_products = SellerProduct.objects.filter(
-                product_id=product_id).prefetch_related('seller')
-            seller_products_data = serialize('json', seller_products)
-            cache.set(seller_products_cache_key, seller_products_data, timeout=60 * 60 * 24)
+    def get_reviews_page(self):
+        items_per_page = REVIEWS_PER_PAGE
+        page_number = self.request.GET.get('page')
+        # Число отзывов хранится в товаре, поэтому COUNT по отзывам не выполняется
+        paginator = KnownCountPaginator(
+            Review.objects.filter(product_id=self.object.pk).select_related('author'),
+            items_per_page,
+            count=self.object.review_count,
+        )
+        page_obj = paginator.get_page(page_number)
+        if page_obj.number == 1:
+            # Первая страница отзывов уже есть в снимке
+            page_obj.object_list = list(self.object.reviews)
         else:
-            seller_products = [obj.object for obj in deserialize('json', seller_products_data)]
-
-        return seller_products
+            page_obj.object_list = [build_review_snapshot(review) for review in page_obj.object_list]
+        return page_obj
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        product_id = self.kwargs.get('pk')
-        context['seller_products'] = seller_products_qs = self.get_seller_products(product_id)
-        price = 0
-        count = 0
-        min_price = 0
-        min_price_id = None
-        for seller_product in seller_products_qs:
-            price += seller_product.price
-            count += 1
-            if count == 1:
-                min_price_id = seller_product.id
-                min_price = price
-            elif count > 1:
-                if seller_product.price < min_price:
-                    min_price = seller_product.price
-                    min_price_id = seller_product.id
-
-        if count > 0:
-            average_price = (price / count).quantize(Decimal('0.00'), rounding=ROUND_HALF_UP)
-            context['average_price'] = Decimal(average_price)
-            context['min_price_id'] = min_price_id
-        else:
-            context['average_price'] = Decimal(0)
-            context['min_price_id'] = min_price_id
-        context['product_min_price_id'] = seller_products_qs
-
-        items_per_page = 3
-        page_number = self.request.GET.get('page')
-        paginator = Paginator(self.object.reviews.all(), items_per_page)
-        page_obj = paginator.get_page(page_number)
-        context['page_obj'] = page_obj
+        context['seller_products'] = self.object.offers
+        context['average_price'] = self.object.average_price
+        context['min_price_id'] = self.object.min_price_id
+        context['page_obj'] = self.get_reviews_page()
         context['form'] = ReviewForm()
         return context
 
@@ -166,7 +147,7 @@ class ReviewCreateView(PermissionRequiredMixin, CreateView):
         review = form.save(commit=False)
         review.product_id = self.kwargs.get('pk')
         review.author = self.request.user
-        review.save()
+        add_review(review)
         return redirect(review.product.get_absolute_url())
 
     def handle_no_permission(self):
@@ -197,15 +178,44 @@ class AddToCartView(View):
         if quantity <= 0:
             return HttpResponseBadRequest("Количество должно быть больше нуля.")
 
-        if request.user.is_authenticated:
-            cart, created = Cart.objects.get_or_create(user=request.user)
-            cart.add_product(product, quantity=quantity)
-        else:
-            add_to_session_cart(request, product_id, quantity)
+        get_cart(request).add_product(product, quantity=quantity)
 
         return redirect('shop:product_detail', product.product.id)
 
 
+class AddManyToCartView(View):
+    """
+    Представление: добавление в корзину нескольких товаров одним запросом (например, комплекта).
+    Параметры: product - id товаров продавцов, amount - количества в том же порядке (по умолчанию 1).
+    """
+
+    def post(self, request, *args, **kwargs):
+        product_ids = request.POST.getlist('product')
+        amounts = request.POST.getlist('amount') or ['1'] * len(product_ids)
+        if not product_ids or len(amounts) != len(product_ids):
+            return HttpResponseBadRequest("Нужно передать товары и количество для каждого из них.")
+        try:
+            product_ids = [int(value) for value in product_ids]
+            amounts = [int(value) for value in amounts]
+        except ValueError:
+            return HttpResponseBadRequest("Товары и количество должны быть целыми числами.")
+        if any(amount <= 0 for amount in amounts):
+            return HttpResponseBadRequest("Количество должно быть больше нуля.")
+
+        quantities = {}
+        for product_id, amount in zip(product_ids, amounts):
+            quantities[product_id] = quantities.get(product_id, 0) + amount
+
+        products = SellerProduct.objects.in_bulk(quantities)
+        missing = sorted(set(quantities) - set(products))
+        if missing:
+            # Ничего не добавляется: иначе посетитель не узнает, что часть товаров потерялась
+            return HttpResponseBadRequest(f"Товары не найдены: {', '.join(map(str, missing))}.")
+        get_cart(request).add_products((product, quantities[product_id]) for product_id, product in products.items())
+
+        return redirect('shop:cart_detail')
+
+
 @method_decorator(never_cache, name='dispatch')
 class CartDetailView(DetailView):
     model = Cart
@@ -221,16 +231,12 @@ class CartDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        backend = get_cart(self.request)
+        context['cart_items'] = backend.get_items()
+        context['total_quantity'], context['total_price'] = backend.get_totals()
         if self.request.user.is_authenticated:
-            cart = context['cart']
-            context['cart_items'] = cart.cart_items.all().prefetch_related('product')
-            discount = calculate_best_discount(cart, cart.cart_items.all())
-            context['total_price'] = cart.total_price() - discount
-            context['total_quantity'] = cart.total_quantity()
-        else:
-            context['cart_items'] = get_cart_from_session(self.request)
-            context['total_price'] = get_total_price_from_session_cart(self.request)
-            context['total_quantity'] = get_total_quantity_from_session_cart(self.request)
+            # Скидки считаются по уже прочитанным позициям, корзина из Redis в базу не записывается
+            context['total_price'] -= calculate_best_discount(context['cart'], context['cart_items'])
         return context
 
 
@@ -240,14 +246,7 @@ class CartItemDeleteView(View):
     """
 
     def post(self, request, *args, **kwargs):
-        product_id = kwargs.get('pk')
-
-        if request.user.is_authenticated:
-            cart, created = Cart.objects.get_or_create(user=request.user)
-            cart_item = get_object_or_404(CartItem, id=product_id)
-            cart.delete_product(cart_item)
-        else:
-            remove_from_session_cart(self.request, product_id)
+        get_cart(request).delete_product(kwargs.get('pk'))
 
         return redirect('shop:cart_detail')
 
@@ -266,101 +265,179 @@ class CartItemUpdateView(View):
         if quantity < 0:
             return HttpResponseBadRequest("Количество должно быть не меньше нуля.")
 
-        if request.user.is_authenticated:
-            cart, created = Cart.objects.get_or_create(user=request.user)
-            product = get_object_or_404(CartItem, id=product_id)
-            cart.update_product(product, quantity=quantity)
-        else:
-            update_session_cart(request, product_id, quantity)
+        get_cart(request).update_product(product_id, quantity)
 
         return redirect('shop:cart_detail')
 
 
-@method_decorator(decorator=never_cache, name="get")
-class CatalogProduct(ListView):
+@method_decorator(decorator=cache_anonymous_page, name="get")
+class CatalogProduct(ConditionalGetMixin, ListView):
     """
     Представление выводит все продукты переданной категории.
+    Данные читаются только из денормализованной витрины CatalogListing.
     """
-    model = SellerProduct
+    model = CatalogListing
     template_name = "shop/catalog.html"
     context_object_name = 'products'
     paginate_by = 8
-
-    def get_queryset(self):
-        sort_param = self.request.GET.get('sort')
+    sort_fields = {
+        'popularity': '-sales_count',
+        '-popularity': 'sales_count',
+        'price': 'price',
+        '-price': '-price',
+        'reviews': '-review_count',
+        '-reviews': 'review_count',
+        'created_at': '-created_at',
+        '-created_at': 'created_at',
+    }
+
+    @cached_property
+    def category(self):
         selected_category_id = self.kwargs.get('pk')
+        if not selected_category_id:
+            return None
+        return get_object_or_404(Category, pk=selected_category_id)
 
-        if selected_category_id:
-            # Получаем категорию и её дочерние категории
-            category = get_object_or_404(Category, pk=selected_category_id)
-            children = category.children.all()
-            queryset = SellerProduct.objects.filter(product__category__in=[category] + list(children))
-        else:
-            # Если категория не выбрана, возвращаем все продукты
-            queryset = SellerProduct.objects.all()
-
-        if sort_param:
-            if sort_param == 'popularity':
-                popular_products = get_cached_popular_products()
-                popular_product_ids = [p.product_id for p in popular_products]
-                queryset = queryset.filter(product__id__in=popular_product_ids)
-            elif sort_param == 'price':
-                queryset = queryset.order_by('price')
-            elif sort_param == '-price':
-                queryset = queryset.order_by('-price')
-            elif sort_param == 'reviews':
-                queryset = queryset.annotate(num_reviews=Count('product__reviews')).order_by('-num_reviews')
-            elif sort_param == '-reviews':
-                queryset = queryset.annotate(num_reviews=Count('product__reviews')).order_by('num_reviews')
-            elif sort_param == 'created_at':
-                queryset = queryset.order_by('-created_at')
-            elif sort_param == '-created_at':
-                queryset = queryset.order_by('created_at')
+    def get_category_path(self):
+        # Пустой путь означал бы весь каталог, поэтому у категории он строится при необходимости
+        return self.category.get_path() if self.category else None
+
+    def get_category_queryset(self):
+        queryset = CatalogListing.objects.all()
+        category_path = self.get_category_path()
+
+        if category_path:
+            # Категория и все её дочерние категории отбираются по префиксу пути
+            queryset = queryset.filter(category_path__startswith=category_path)
+
+        return queryset
+
+    @cached_property
+    def listing_stamps(self):
+        # Удаление записи не меняет максимум updated_at, поэтому учитывается и их число
+        return self.get_category_queryset().aggregate(modified_at=Max('updated_at'), count=Count('pk'))
+
+    def get_content_fingerprint(self):
+        return (
+            self.listing_stamps['modified_at'],
+            self.listing_stamps['count'],
+            get_version('tags'),
+            get_version('prices'),
+        )
+
+    def get_last_modified(self):
+        return self.listing_stamps['modified_at']
+
+    def get_ordering(self):
+        sort_field = self.sort_fields.get(self.request.GET.get('sort'))
+        if not sort_field:
+            # Без явной сортировки результаты поиска выводятся по релевантности
+            return ('search_rank', 'pk') if self.search_product_ids is not None else ('pk',)
+        # Направление tiebreaker'а совпадает с основным полем, чтобы работал составной индекс
+        return (sort_field, '-pk' if sort_field.startswith('-') else 'pk')
+
+    def get_queryset(self):
+        queryset = self.get_category_queryset()
+        self.search_product_ids = None
+        self.search_truncated = False
+        self.facet_filters = {}
 
         form = ProductFilterForm(self.request.GET)
         if form.is_valid():
             price = form.cleaned_data.get('price')
-            title = form.cleaned_data.get('title')
             in_stock = form.cleaned_data.get('in_stock')
             free_delivery = form.cleaned_data.get('free_delivery')
+            self.search_product_ids = form.search_product_ids()
+            self.search_truncated = form.search_truncated
 
             if price:
                 min_price, max_price = map(Decimal, price.split(';'))
                 queryset = queryset.filter(price__range=(min_price, max_price))
-            if title:
-                queryset = queryset.filter(product__name__icontains=title)
+                self.facet_filters['price_range'] = (min_price, max_price)
+            if self.search_product_ids is not None:
+                self.facet_filters['product_ids'] = self.search_product_ids
+                queryset = queryset.filter(product_id__in=self.search_product_ids).annotate(
+                    search_rank=Case(
+                        *[When(product_id=pk, then=rank) for rank, pk in enumerate(self.search_product_ids)],
+                        default=len(self.search_product_ids),
+                        output_field=IntegerField(),
+                    )
+                )
             if in_stock:
-                queryset = queryset.filter(quantity__gt=0)
+                queryset = queryset.filter(in_stock=True)
+                self.facet_filters['in_stock'] = True
             if free_delivery:
                 queryset = queryset.filter(free_delivery=True)
+                self.facet_filters['free_delivery'] = True
 
+        self.selected_tags = []
         tags_form = TagsForm(self.request.GET)
-        if tags_form.is_valid():
-            tags = tags_form.cleaned_data.get('tags')
-            if tags:
-                queryset = queryset.filter(product__tags__slug__icontains=tags)
+        if tags_form.is_valid() and tags_form.has_tag_filter():
+            self.selected_tags = tags_form.cleaned_data.get('tags')
+            # Товары с выбранными тегами берутся из закэшированного индекса тегов,
+            # если ни один из запрошенных тегов не найден, выборка пуста
+            tag_product_ids = get_tagged_product_ids(
+                self.selected_tags, tags_form.cleaned_data.get('tag_mode') or 'and'
+            )
+            queryset = queryset.filter(product_id__in=tag_product_ids)
+            self.facet_filters['tag_product_ids'] = tag_product_ids
 
-        return queryset
+        return queryset.order_by(*self.get_ordering())
+
+    def paginate_queryset(self, queryset, page_size):
+        if settings.CATALOG_PAGINATION_MODE != 'keyset':
+            return super().paginate_queryset(queryset, page_size)
+
+        paginator = CursorPaginator(queryset, page_size, self.get_ordering(), self.request.GET)
+        page = paginator.get_page(self.request.GET.get(paginator.cursor_param))
+        return paginator, page, page.object_list, page.has_other_pages()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        # Цены со скидками для всей страницы - одним запросом
+        context['products'] = context['object_list'] = annotate_discounted_prices(context['object_list'])
         categories = get_cached_categories()
         context['categories'] = categories
+        context['category'] = self.category
+        if self.category:
+            context['breadcrumbs'] = self.category.get_ancestors(include_self=True)
 
-        selected_category_id = self.kwargs.get('pk')
-        selected_category = Category.objects.filter(pk=selected_category_id).first()
-
-        if selected_category:
-            selected_products = SellerProduct.objects.filter(product__category=selected_category)
-        else:
-            selected_products = SellerProduct.objects.all()  # Получаем все продукты, если категории нет
+        context['data_min'], context['data_max'] = get_category_price_bounds(self.get_category_path())
 
-        max_price = selected_products.aggregate(Max('price'))['price__max']
-        min_price = selected_products.aggregate(Min('price'))['price__min']
-        context['data_min'] = min_price
-        context['data_max'] = max_price
+        # Счётчики фасетов считаются за один проход по закэшированной сводке категории
+        facets = compute_facets(
+            get_facet_summary(self.get_category_path()),
+            **self.facet_filters,
+        )
+        context['facets'] = facets
 
-        tags = Tag.objects.all()
+        tags = get_tag_cloud()
+        for tag in tags:
+            tag['facet_count'] = facets['tags'].get(tag['slug'], 0)
         context['tags'] = tags
+        context['selected_tags'] = self.selected_tags
+        context['tag_mode'] = self.request.GET.get('tag_mode', 'and')
+        context['search_truncated'] = self.search_truncated
+        context['search_limit'] = settings.SEARCH_RESULTS_LIMIT
 
         return context
+
+
+def has_metrics_access(request):
+    if request.user.is_staff:
+        return True
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(authorization, f'Bearer {token}')
+
+
+@never_cache
+def cache_metrics(request):
+    """
+    Метрики кэша в текстовом формате для системы мониторинга.
+    Доступны сотрудникам или по токену METRICS_TOKEN.
+    """
+
+    if not has_metrics_access(request):
+        return HttpResponseForbidden()
+    return HttpResponse(format_metrics(get_cache_metrics()), content_type='text/plain; version=0.0.4')
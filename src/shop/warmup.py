@@ -0,0 +1,109 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.db import connection
+from django.db.models import F, Max
+from django.http import Http404
+
+from banners.services import get_active_banners
+
+from .models import Product
+from .services import (get_cached_categories, get_cached_popular_products,
+                       get_limited_products, get_popular_categories,
+                       get_site_settings)
+from .snapshots import get_encoded_product_snapshot
+
+# Порядок важен: сначала то, что нужно каждой странице, затем главная страница
+WARMUP_STEPS = [
+    ('site_settings', get_site_settings),
+    ('categories', get_cached_categories),
+    ('banners', get_active_banners),
+    ('popular', get_cached_popular_products),
+    ('popular_categories', get_popular_categories),
+    ('limited', get_limited_products),
+]
+
+
+def get_products_by_recent_views(limit=None):
+    """
+    id товаров: сначала недавно просмотренные (по HistoryProduct), затем остальные
+    """
+
+    product_ids = (
+        Product.objects
+        .annotate(last_viewed_at=Max('historyproduct__created_at'))
+        .order_by(F('last_viewed_at').desc(nulls_last=True), 'pk')
+        .values_list('pk', flat=True)
+    )
+    return list(product_ids if limit is None else product_ids[:limit])
+
+
+def build_snapshot_batch(product_ids):
+    built = 0
+    for product_id in product_ids:
+        try:
+            get_encoded_product_snapshot.refresh(product_id)
+            built += 1
+        except Http404:
+            # Товар удалён после составления списка
+            pass
+    return built
+
+
+def build_snapshot_batch_in_thread(product_ids):
+    try:
+        return build_snapshot_batch(product_ids)
+    finally:
+        # Поток пула открывает собственное соединение с базой
+        connection.close()
+
+
+def warm_product_snapshots(limit=None, batch_size=50, workers=4, progress=None):
+    """
+    Строит снимки страниц товаров пачками, начиная с недавно просмотренных.
+    При workers > 1 пачки строятся параллельно в пуле потоков.
+    progress(готово, всего) вызывается после каждой пачки.
+    """
+
+    product_ids = get_products_by_recent_views(limit)
+    batches = [product_ids[index:index + batch_size] for index in range(0, len(product_ids), batch_size)]
+    done = built = 0
+
+    def report(batch, batch_built):
+        nonlocal done, built
+        done += len(batch)
+        built += batch_built
+        if progress:
+            progress(done, len(product_ids))
+
+    if workers <= 1:
+        for batch in batches:
+            report(batch, build_snapshot_batch(batch))
+        return built
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(build_snapshot_batch_in_thread, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            report(futures[future], future.result())
+    return built
+
+
+def warm_cache(product_limit=None, batch_size=50, workers=4, progress=None):
+    """
+    Заполняет кэш после деплоя или сброса: общие данные по приоритету, затем снимки товаров.
+    product_limit ограничивает число снимков товаров (0 - не строить).
+    Возвращает {шаг: число построенных значений}.
+    """
+
+    result = {}
+    for name, func in WARMUP_STEPS:
+        func.refresh()
+        result[name] = 1
+        if progress:
+            progress(name, 1, 1)
+    result['product'] = warm_product_snapshots(
+        product_limit,
+        batch_size,
+        workers,
+        progress=(lambda done, total: progress('product', done, total)) if progress else None,
+    )
+    return result